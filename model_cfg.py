@@ -1,6 +1,9 @@
 """Model configurations and default parameters."""
+import copy
 import logging
-from typing import Any, Callable, List, Optional, Tuple
+import os
+import threading
+from typing import Any, Callable, List, Mapping, Optional, Tuple, Union
 from torch.distributed import rpc as trpc
 from torchvision import models
 from transformers import AutoConfig
@@ -66,8 +69,22 @@ def get_model_layers(model_name: str) -> int:
     """Get a model's layer count."""
     return _MODEL_CONFIGS[model_name]['layers']
 
+# Loaded configs, which may require file or network I/O (key: model name, value: config)
+_model_configs_loaded = {}
+_model_configs_loaded_lock = threading.Lock()
+
 def get_model_config(model_name: str, model_file) -> Any:
-    """Get a model's config."""
+    """Get a model's config (a copy of a cached instance, if previously loaded)."""
+    with _model_configs_loaded_lock:
+        config = _model_configs_loaded.get(model_name)
+    if config is None:
+        config = _load_model_config(model_name)
+        with _model_configs_loaded_lock:
+            _model_configs_loaded[model_name] = config
+    # shards may modify their config
+    return copy.deepcopy(config)
+
+def _load_model_config(model_name: str) -> Any:
     # We'll need more complexity if/when we add support for models not from `transformers`
     if model_name.split('/')[0] == 'torchvision':
         if model_name.split('/')[1].startswith('resnet'):
@@ -87,6 +104,24 @@ def get_model_default_weights_file(model_name: str) -> str:
     """Get a model's default weights file name."""
     return _MODEL_CONFIGS[model_name]['weights_file']
 
+def prefetch_model(model_name: str, model_file: Optional[str]=None) -> None:
+    """
+    Load a model's config and start reading its weights file into the OS page cache.
+
+    Call in the background before the model shard is known, so that creating the shard doesn't
+    have to wait for file or network I/O.
+    """
+    if model_file is None:
+        model_file = get_model_default_weights_file(model_name)
+    get_model_config(model_name, model_file)
+    if hasattr(os, 'posix_fadvise') and os.path.isfile(model_file):
+        fd = os.open(model_file, os.O_RDONLY)
+        try:
+            # asynchronous readahead, which doesn't allocate any memory in our process
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
 def save_model_weights_file(model_name: str, model_file: Optional[str]=None) -> None:
     """Save a model's weights file."""
     if model_file is None:
@@ -95,9 +130,19 @@ def save_model_weights_file(model_name: str, model_file: Optional[str]=None) ->
     module = _MODEL_CONFIGS[model_name]['shard_module']
     module.save_weights(model_name, model_file)
 
+# Shard implementations that can reuse the overlapping layers of a previous shard
+_SHARD_MODULES_REUSE = (bert.BertModelShard, bert.BertShardForSequenceClassification,
+                        deit.DeiTShardForImageClassification, vit.ViTShardForImageClassification)
+
 def module_shard_factory(model_name: str, model_file: Optional[str], layer_start: int,
-                         layer_end: int, stage: int) -> ModuleShard:
-    """Get a shard instance on the globally-configured `devices.DEVICE`."""
+                         layer_end: int, stage: int, shard_reuse: Optional[ModuleShard]=None) -> \
+    ModuleShard:
+    """
+    Get a shard instance on the globally-configured `devices.DEVICE`.
+
+    If the model supports it, the layers that overlap with `shard_reuse` (a previous shard of the
+    same model) are reused rather than loaded again. Other models load all their layers.
+    """
     # This works b/c all shard implementations have the same constructor interface
     if model_file is None:
         model_file = get_model_default_weights_file(model_name)
@@ -107,7 +152,10 @@ def module_shard_factory(model_name: str, model_file: Optional[str], layer_start
     shard_config = ModuleShardConfig(layer_start=layer_start, layer_end=layer_end,
                                      is_first=is_first, is_last=is_last)
     module = _MODEL_CONFIGS[model_name]['shard_module']
-    shard = module(config, shard_config, model_file)
+    if module in _SHARD_MODULES_REUSE and isinstance(shard_reuse, module):
+        shard = module(config, shard_config, model_file, shard_reuse=shard_reuse)
+    else:
+        shard = module(config, shard_config, model_file)
     _logger.info("======= %s Stage %d =======", module.__name__, stage)
     shard.to(device=devices.DEVICE)
     shard.eval()
@@ -121,8 +169,15 @@ def _dist_rpc_pipeline_stage_factory(*args, **kwargs) -> rpc.DistRpcPipelineStag
 
 def dist_rpc_pipeline_factory(model_name: str, model_file: Optional[str], stage_ranks: List[int],
                               stage_layers: List[Tuple[int, int]], results_to: int,
-                              results_cb: Callable[[Any], None]) -> rpc.DistRpcPipeline:
-    """Get an RPC pipeline instance."""
+                              results_cb: Callable[[Any], None], num_fwd: Optional[int]=None,
+                              num_mod: int=1, module_replicas: int=1,
+                              num_threads: Optional[int]=None) -> rpc.DistRpcPipeline:
+    """
+    Get an RPC pipeline instance.
+
+    `num_fwd`, `num_mod`, `module_replicas`, and `num_threads` configure each stage's concurrency,
+    see `rpc.DistRpcPipelineStage`.
+    """
     # This works b/c all shard implementations have the same constructor interface
     if model_file is None:
         model_file = get_model_default_weights_file(model_name)
@@ -131,14 +186,16 @@ def dist_rpc_pipeline_factory(model_name: str, model_file: Optional[str], stage_
     assert len(stage_ranks) > 0
     assert len(stage_ranks) == len(stage_layers)
     for i, (dst_rank, layers) in enumerate(zip(stage_ranks, stage_layers)):
-        config = get_model_config(model_name)
+        config = get_model_config(model_name, model_file)
         is_first = i == 0
         is_last = i == len(stage_ranks) - 1
         shard_config = ModuleShardConfig(layer_start=layers[0], layer_end=layers[1],
                                          is_first=is_first, is_last=is_last)
         module_args = (config, shard_config, model_file)
         rref = trpc.remote(dst_rank, _dist_rpc_pipeline_stage_factory, args=(module,),
-                           kwargs={ 'module_args': module_args })
+                           kwargs={ 'module_args': module_args, 'num_fwd': num_fwd,
+                                    'num_mod': num_mod, 'module_replicas': module_replicas,
+                                    'num_threads': num_threads })
         trpc.remote(dst_rank, _logger.info,
                     args=("======= %s Stage %d =======", module.__name__, i))
         stage_rrefs.append(rref)
@@ -146,23 +203,46 @@ def dist_rpc_pipeline_factory(model_name: str, model_file: Optional[str], stage_
 
 def dist_p2p_pipeline_stage_factory(stage_ranks: List[int], data_rank: int, rank: int,
                                     stage: Optional[int], module: Optional[ModuleShard],
-                                    handle_results_cb: Callable[[Any], None]) \
+                                    handle_results_cb: Callable[[Any], None],
+                                    protocol: str=p2p.PROTOCOL_TENSORS,
+                                    queue_depths: Optional[Mapping[str, int]]=None,
+                                    send_window: int=p2p.SEND_WINDOW_DEFAULT,
+                                    work_threads: int=p2p.WORK_THREADS_DEFAULT,
+                                    work_num_threads: Optional[int]=None,
+                                    stage_replicas: Optional[List[Tuple[int, int]]]=None,
+                                    use_shm: bool=False,
+                                    codec_name: Union[str, Mapping[int, str]]=p2p.codec.CODEC_NONE,
+                                    epoch: int=0) \
     -> p2p.DistP2pPipelineStage:
-    """Get a P2P pipeline stage instance."""
+    """
+    Get a P2P pipeline stage instance.
+
+    `stage_replicas` are additional (stage, rank) pairs for stages replicated across ranks, where
+    `stage_ranks` entries are each stage's first replica.
+    """
+    if stage_replicas is None:
+        stage_replicas = []
+    stage_rank_lists = [[r] for r in stage_ranks]
+    for stage_rep, rank_rep in stage_replicas:
+        stage_rank_lists[stage_rep].append(rank_rep)
+    replica = (0, 1)
     if rank == data_rank:
         if stage is None:
             # We're data_rank w/out a module shard
-            rank_src = stage_ranks[-1]
-            rank_dst = stage_ranks[0]
+            rank_src = stage_rank_lists[-1]
+            rank_dst = stage_rank_lists[0]
             work_cb = None
         else:
             # We're simultaneously data_rank and a pipeline stage
             # In this case, the current p2p design requires that we must be the first stage
             if stage != 0:
                 raise ValueError(f"Data rank must be stage=0 or stage=None, but stage={stage}")
+            # Only the data rank feeds the first stage, so it can't be replicated
+            if len(stage_rank_lists[0]) > 1:
+                raise ValueError("Data rank must not be in a replicated stage")
             # Degenerate case when we're both data_rank and the only stage
-            rank_src = stage_ranks[-1] if len(stage_ranks) > 1 else None
-            rank_dst = stage_ranks[1] if len(stage_ranks) > 1 else None
+            rank_src = stage_rank_lists[-1] if len(stage_ranks) > 1 else None
+            rank_dst = stage_rank_lists[1] if len(stage_ranks) > 1 else None
             work_cb = module
         # While the handle_results_cb parameter isn't optional, we should assert it anyway.
         # If None, DistP2pPipelineStage would loop results back to its input queue, then the first
@@ -178,8 +258,13 @@ def dist_p2p_pipeline_stage_factory(stage_ranks: List[int], data_rank: int, rank
         results_cb = None
     else:
         # We're not data_rank, but we have a module shard (possibly first and/or last stage)
-        rank_src = data_rank if stage == 0 else stage_ranks[(stage - 1)]
-        rank_dst = data_rank if stage == len(stage_ranks) - 1 else stage_ranks[(stage + 1)]
+        rank_src = [data_rank] if stage == 0 else stage_rank_lists[(stage - 1)]
+        rank_dst = [data_rank] if stage == len(stage_ranks) - 1 else stage_rank_lists[(stage + 1)]
         work_cb = module
         results_cb = None
-    return p2p.DistP2pPipelineStage(rank_src, rank_dst, work_cb, results_cb)
+        replica = (stage_rank_lists[stage].index(rank), len(stage_rank_lists[stage]))
+    return p2p.DistP2pPipelineStage(rank_src, rank_dst, work_cb, results_cb, protocol=protocol,
+                                    queue_depths=queue_depths, send_window=send_window,
+                                    work_threads=work_threads, work_num_threads=work_num_threads,
+                                    replica=replica, use_shm=use_shm,
+                                    codec_name=codec_name, epoch=epoch)
@@ -0,0 +1,99 @@
+"""Distributed link prober that measures bandwidth and latency between all (or sampled) ranks."""
+import argparse
+import logging
+import socket
+import time
+import torch
+from pipeedge.comm.p2p import DistP2pContext, probe
+from pipeedge.sched import yaml_files, yaml_types
+import runtime
+
+logger = logging.getLogger(__name__)
+
+
+def _handle_cmd(cmd: int, tensors: tuple) -> None:
+    """The prober doesn't use commands."""
+    logger.warning("Ignoring unexpected command: %d (%d tensors)", cmd, len(tensors))
+
+
+def _str_to_tensor(string: str) -> torch.Tensor:
+    return torch.tensor(list(string.encode('utf-8')), dtype=torch.uint8)
+
+
+def _tensor_to_str(tensor: torch.Tensor) -> str:
+    return bytes(tensor.tolist()).decode('utf-8')
+
+
+def main() -> None:
+    """Main function."""
+    parser = argparse.ArgumentParser(description="Pipeline Link Prober",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    # Positional arguments
+    parser.add_argument("rank", type=int, help="the rank for the current node")
+    parser.add_argument("worldsize", type=int, help="the world size (the number of nodes)")
+    # Network configurations
+    netcfg = parser.add_argument_group('Network configuration')
+    netcfg.add_argument("-s", "--socket-ifname", type=str, default="lo0",
+                        help="socket interface name, use [ifconfig | ipaddress] to check")
+    netcfg.add_argument("--addr", type=str, default="127.0.0.1",
+                        help="ip address for the master node")
+    netcfg.add_argument("--port", type=int, default=29500,
+                        help="communication port for the master node")
+    # Device config
+    devcfg = parser.add_argument_group('Device configuration')
+    devcfg.add_argument("-H", "--host", type=str, default=socket.gethostname(),
+                        help="this device's host name (as used in scheduler YAML files)")
+    # Probe options
+    prbcfg = parser.add_argument_group('Probe configuration')
+    prbcfg.add_argument("-b", "--msg-bytes", type=str,
+                        default=','.join(str(b) for b in probe.MSG_BYTES_DEFAULT),
+                        help="comma-delimited list of message sizes for measuring bandwidth")
+    prbcfg.add_argument("-i", "--iters", type=int, default=probe.ITERS_DEFAULT,
+                        help="measurements per message size (the median is used)")
+    prbcfg.add_argument("--sample-fraction", type=float, default=1.0,
+                        help="fraction of rank pairs to measure, e.g., to refresh a subset of "
+                             "links in an existing output file")
+    prbcfg.add_argument("--sample-seed", type=int, default=0,
+                        help="random seed for sampling rank pairs (must be the same on all ranks)")
+    prbcfg.add_argument("-o", "--output", type=str, default='device_neighbors_world.yml',
+                        help="device neighbors world YAML file to write (on rank 0); existing "
+                             "entries are updated")
+    args = parser.parse_args()
+    msg_bytes = [int(b) for b in args.msg_bytes.split(',')]
+    if args.iters < 1:
+        raise ValueError(f"Iterations must be > 0, but iters={args.iters}")
+
+    rounds = probe.round_robin_pairings(args.worldsize)
+    if args.sample_fraction < 1:
+        rounds = probe.sample_pairings(rounds, args.sample_fraction, seed=args.sample_seed)
+
+    # Setup network
+    runtime.init_env(None, args.addr, args.port, args.socket_ifname)
+
+    with DistP2pContext(('gloo',), { 'world_size': args.worldsize, 'rank': args.rank },
+                        _handle_cmd) as dist_ctx:
+        logger.info("Probing links: rounds=%d", len(rounds))
+        t_start = time.time()
+        measurements = probe.probe_links(rounds, msg_bytes=msg_bytes, iters=args.iters)
+        logger.info("Probe time (sec): %f", time.time() - t_start)
+        for _, dst, rtt, bw_mbps in measurements:
+            logger.debug("Link to rank %d: rtt_ms=%f, bw_Mbps=%f", dst, 1000 * rtt, bw_mbps)
+        tensor_links = torch.tensor([[dst, rtt, bw_mbps] for _, dst, rtt, bw_mbps in measurements],
+                                    dtype=torch.float64).reshape(-1, 3)
+        gathered = dist_ctx.cmd_gather((_str_to_tensor(args.host), tensor_links))
+        if gathered is not None:
+            hosts = [_tensor_to_str(tensors[0]) for tensors in gathered]
+            yml = yaml_files.yaml_device_neighbors_world_load(args.output)
+            for host, (_, links) in zip(hosts, gathered):
+                neighbors = [hosts[int(dst)] for dst in links[:, 0].tolist()]
+                yml_neighbors = yaml_types.yaml_device_neighbors(
+                    neighbors, [round(bw, 3) for bw in links[:, 2].tolist()],
+                    latencies_ms=[round(1000 * rtt / 2, 3) for rtt in links[:, 1].tolist()])
+                yml.setdefault(host, {}).update(yml_neighbors)
+            yaml_files.yaml_save(yml, args.output)
+            logger.info("Saved device neighbors: %s", args.output)
+
+
+if __name__=="__main__":
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    main()
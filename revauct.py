@@ -81,7 +81,7 @@ def revauct_bid_latency(model: str, ubatch_size: int, dtype: str='torch.float32'
             costs.append(bid[1])
     host = _DEVICE_CFG['host']
     # yml_dev_neighbors is a dict with hostnames as keys and yaml_device_neighbors_type values
-    # (yaml_device_neighbors_type a dict, currently with only a single key: 'bw_Mbps').
+    # (yaml_device_neighbors_type a dict with key 'bw_Mbps', and optionally 'latency_ms').
     yml_dev_neighbors = _DEVICE_CFG['yml_dev_neighbors_world'].get(host, {})
     logger.debug("Reverse auction bid time (ms): %f", 1000 * (time.time() - t_start))
     return (host, (shards, costs, yml_dev_neighbors))
@@ -1,12 +1,15 @@
 """Distributed pipeline driver application."""
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import logging
 import os
 import queue
+import signal
 import sys
 import threading
 import time
-from typing import List, Optional, Tuple, Union
+from typing import List, Mapping, Optional, Tuple, Union
 import numpy as np
 from PIL import Image
 import requests
@@ -14,13 +17,12 @@ import torch
 from torch.utils.data import DataLoader, Dataset
 from torchvision.datasets import ImageNet
 from transformers import AutoTokenizer, DeiTFeatureExtractor, ViTFeatureExtractor
+from pipeedge.comm import p2p
 from pipeedge.comm.p2p import DistP2pContext
 from pipeedge.comm.rpc import DistRpcContext, tensorpipe_rpc_backend_options_factory
 from pipeedge import models
-from pipeedge.quantization.basic_op import (
-    compression_factor, tensor_encode_outerdim, tensor_decode_outerdim
-)
-from pipeedge.quantization.clamp_op import clamp_banner2019_gelu, clamp_banner2019_laplace
+from pipeedge.quantization import codec as quant_codec
+from pipeedge.quantization.basic_op import bitstream_nbytes
 from pipeedge.sched.scheduler import sched_pipeline
 import devices
 import model_cfg
@@ -60,6 +62,13 @@ def get_window_size() -> int:
 
 ENV_SEND_CONSTRAINT: str = "SEND_CONSTRAINT"
 
+# Quantize with per-group scales over groups of this many channels (0 for per-tensor scales)
+ENV_QUANT_GROUP_SIZE: str = "QUANT_GROUP_SIZE"
+# Huffman-code integer quantized values if set to 1
+ENV_QUANT_ENTROPY: str = "QUANT_ENTROPY"
+# Smoothing factor for the measured Huffman coding compression ratio
+QUANT_ENTROPY_RATIO_ALPHA = 0.1
+
 ENV_ADAPTIVE_QUANT: str = "ADAPTIVE_QUANT"
 ADAPTIVE_QUANT_HEURISTIC = "HEURISTIC"
 ADAPTIVE_QUANT_HEURISTIC2 = "HEURISTIC2"
@@ -71,6 +80,9 @@ MONITORING_KEY_QUANT_DECODE = 'quant_decode'
 MONITORING_KEY_QUANT_ENCODE = 'quant_encode'
 MONITORING_KEY_RECV = 'recv'
 MONITORING_KEY_SEND = 'send'
+MONITORING_KEY_STARTUP = 'startup'
+# Queue occupancy keys are this prefix + the queue name
+MONITORING_KEY_QUEUE_PREFIX = 'queue_'
 
 def forward_pre_hook_monitor(_module, _inputs) -> None:
     """Register iteration start."""
@@ -84,24 +96,52 @@ def forward_hook_monitor(module, _inputs, outputs) -> None:
     n_layers = module.shard_config.layer_end - module.shard_config.layer_start + 1
     monitoring.iteration(MONITORING_KEY_MODEL, work=n_items, accuracy=n_layers)
 
+# Work threads run a shard's hooks concurrently, so hooks lock its quantization state buffers
+_QUANT_STATE_LOCK = threading.Lock()
+def _quant_state_locked(hook):
+    @functools.wraps(hook)
+    def _hook(*args, **kwargs):
+        with _QUANT_STATE_LOCK:
+            return hook(*args, **kwargs)
+    return _hook
+
 def forward_hook_quant_encode(module, _input_arg, output: Union[torch.Tensor, Tuple[torch.Tensor, ...]]):
     """encode tensor in the forward hook (after each module)"""
     monitoring.iteration_start(MONITORING_KEY_QUANT_ENCODE)
     if isinstance(output, torch.Tensor):
         output = (output,)
     assert isinstance(output, tuple)
-    quant_bit = module.quant_bit.item()
+    with _QUANT_STATE_LOCK:
+        # quant_bit is a codec ID, where IDs 1-32 are integer quantization bitwidths
+        quant_bit = module.quant_bit.item()
+        # adaptive quantization hooks may also change the group size
+        quant_group_size = module.quant_group_size.item()
+        quant_entropy = module.quant_entropy.item()
+    if quant_entropy:
+        quant_bit = quant_codec.get_huffman_codec_id(quant_bit)
     comm_tuple = []
+    nbytes_packed = 0
+    nbytes_coded = 0
     for tensor in output:
         assert isinstance(tensor, torch.Tensor)
-        if quant_bit > 0:
-            clamp = clamp_banner2019_laplace if tensor.min() < 0.2 else clamp_banner2019_gelu
-            tensor = clamp(tensor, quant_bit)
-        stacked_tensor = tensor_encode_outerdim(tensor, quant_bit)
+        # clamping is skipped with per-group scales, which are meant to preserve outlier channels
+        stacked_tensor = quant_codec.encode_outerdim(tensor, quant_bit,
+                                                     group_size=quant_group_size, clamp=True)
         comm_tuple += stacked_tensor
+        if quant_codec.is_huffman_codec(quant_bit):
+            nbytes_packed += tensor.shape[0] * \
+                bitstream_nbytes(tensor.shape[1:].numel(), quant_codec.get_codec_bits(quant_bit))
+            nbytes_coded += stacked_tensor[0].numel()
+    if nbytes_packed > 0:
+        # adaptive quantization accounts for the real data size with this compression ratio
+        with _QUANT_STATE_LOCK:
+            ratio = (1 - QUANT_ENTROPY_RATIO_ALPHA) * module.quant_entropy_ratio.item() + \
+                QUANT_ENTROPY_RATIO_ALPHA * nbytes_coded / nbytes_packed
+            module.quant_entropy_ratio = torch.tensor(ratio)
     # Measure work as the microbatch size, but quantization only does work if quant_bit > 0.
     n_items = models.get_microbatch_size(output[0], verify=True) if quant_bit > 0 else 0
-    monitoring.iteration(MONITORING_KEY_QUANT_ENCODE, work=n_items, accuracy=quant_bit)
+    bits = quant_codec.get_codec_bits(quant_bit) if quant_bit > 0 else 0
+    monitoring.iteration(MONITORING_KEY_QUANT_ENCODE, work=n_items, accuracy=bits)
     return tuple(comm_tuple)
 
 def forward_pre_hook_quant_decode(_module, input_arg: Tuple[Tuple[torch.Tensor, ...]]):
@@ -114,11 +154,11 @@ def forward_pre_hook_quant_decode(_module, input_arg: Tuple[Tuple[torch.Tensor,
     assert isinstance(input_tensors, tuple)
     assert len(input_tensors)%5 == 0
     assert len(input_tensors) >= 5
-    quant_bit = input_tensors[4][0].item() # assume the same quantization bitwidth for all items
+    quant_bit = input_tensors[4][0].item() # assume the same codec for all items
     forward_tensor = []
     for i in range(len(input_tensors) // 5):
         input_tensor = input_tensors[i*5:i*5+5]
-        batched_tensor = tensor_decode_outerdim(input_tensor)
+        batched_tensor = quant_codec.decode_outerdim(input_tensor)
         forward_tensor.append(batched_tensor)
     # Return value(s) should be wrapped in an outer tuple, like input_arg
     # The tuple will be unpacked when forward() is invoked, which must yield a single parameter
@@ -129,9 +169,11 @@ def forward_pre_hook_quant_decode(_module, input_arg: Tuple[Tuple[torch.Tensor,
         outputs = (tuple(forward_tensor),)
     # Measure work as the microbatch size, but quantization only does work if quant_bit > 0.
     n_items = models.get_microbatch_size(outputs, verify=True) if quant_bit > 0 else 0
-    monitoring.iteration(MONITORING_KEY_QUANT_DECODE, work=n_items, accuracy=quant_bit)
+    bits = quant_codec.get_codec_bits(quant_bit) if quant_bit > 0 else 0
+    monitoring.iteration(MONITORING_KEY_QUANT_DECODE, work=n_items, accuracy=bits)
     return outputs
 
+@_quant_state_locked
 def forward_hook_set_quant_bandwidth_heuristic(module, _inputs, outputs) -> None:
     """Set quantization bitwidth to satisfy module's `rate_constraint` (requires comm=p2p)."""
     with monitoring.get_locked_context(MONITORING_KEY_SEND) as mctx:
@@ -148,15 +190,13 @@ def forward_hook_set_quant_bandwidth_heuristic(module, _inputs, outputs) -> None
         else:
             target_time = float('inf')
         target_datasize = target_time * bandwidth
-        quant_bit = module.quant_bit.item()
-        if quant_bit > 0:
-            compress_ratio = int(send_work * (32 / quant_bit) / target_datasize) + 1
-        else:
-            compress_ratio = int(send_work / target_datasize) + 1
+        quant_bits = quant_codec.get_codec_bits(module.quant_bit.item())
+        compress_ratio = int(send_work * (32 / quant_bits) / target_datasize) + 1
         if compress_ratio <= 1:
             module.quant_bit = torch.tensor(0)
         elif compress_ratio <= 2:
-            module.quant_bit = torch.tensor(16)
+            # the fp16 cast costs much less CPU time than int16 quantization of the same size
+            module.quant_bit = torch.tensor(quant_codec.CODEC_ID_FP16)
         elif compress_ratio <= 4:
             module.quant_bit = torch.tensor(8)
         elif compress_ratio <= 5:
@@ -167,6 +207,7 @@ def forward_hook_set_quant_bandwidth_heuristic(module, _inputs, outputs) -> None
             module.quant_bit = torch.tensor(2)
         logger.info("Adaptive quantization (heuristic): bitwidth=%d", int(module.quant_bit))
 
+@_quant_state_locked
 def forward_hook_set_quant_bandwidth_heuristic_2(module, _inputs, outputs) -> None:
     """Set quantization bitwidth to satisfy module's `rate_constraint` (requires comm=p2p)."""
     with monitoring.get_locked_context(MONITORING_KEY_SEND) as mctx:
@@ -180,19 +221,19 @@ def forward_hook_set_quant_bandwidth_heuristic_2(module, _inputs, outputs) -> No
         # Rate constraint is per-item, not per-ubatch; rate = 0 -> time = inf
         ubatch_size = models.get_microbatch_size(outputs, verify=True)
         ubatch_time = ubatch_size / module.rate_constraint
-        ubatch_mbits = sum(t.numel() * t.numpy().dtype.itemsize for t in tensors) * 8 / 1000000
-        src_bit = torch.tensor(tensors[0].numpy().dtype.itemsize * 8)
-        quant_bit = quantutil.constrain_max_bitwidth(ubatch_time, ubatch_mbits, bandwidth, src_bit)
+        ubatch_mbits = sum(t.numel() * t.element_size() for t in tensors) * 8 / 1000000
+        src_bit = torch.tensor(tensors[0].element_size() * 8)
+        quant_bit = quantutil.constrain_max_bitwidth(ubatch_time, ubatch_mbits, bandwidth, src_bit,
+                                                     ratio=module.quant_entropy_ratio.item())
         # enforce min bitwidth = 2; quant_bit = src_bit -> quant_bit = 0
         module.quant_bit = max(torch.tensor(2), quant_bit) % src_bit
         logger.info("Adaptive quantization (heuristic2): bitwidth=%d", int(module.quant_bit))
 
-# Largest bitwidths in range [2, 32] with unique discrete compressions
-BITWIDTHS = [i for i in range(32, 1, -1)
-             if int(compression_factor(i)) > int(compression_factor(i + 1))]
+# Bitwidths in range [2, 32], each with a unique compression since values are densely packed
+BITWIDTHS = list(range(32, 1, -1))
 # Cannot keep controllers in a Module instance, so cache by module reference
 _MODULE_QUANT_CONTROLLERS = {}
-_MODULE_QUANT_CONTROLLERS_LOCK = threading.Lock()
+@_quant_state_locked
 def forward_hook_set_quant_controller(module, _inputs, outputs) -> None:
     """Set quantization bitwidth to to satisfy module's `rate_constraint` (requires comm=p2p)."""
     try:
@@ -208,15 +249,15 @@ def forward_hook_set_quant_controller(module, _inputs, outputs) -> None:
         heartrate = mctx.get_window_heartrate(key=MONITORING_KEY_SEND)
     # Only adapt at window period intervals
     if tag > 0 and tag % window_size == 0:
-        with _MODULE_QUANT_CONTROLLERS_LOCK:
-            if module not in _MODULE_QUANT_CONTROLLERS:
-                # quant_bit = 0 -> bw_start = bw_max
-                bw_start = module.quant_bit.item() or max(BITWIDTHS)
-                _MODULE_QUANT_CONTROLLERS[module] = \
-                    quantutil.AdaptiveBitwidthPerformanceController(0, BITWIDTHS, bw_start)
+        if module not in _MODULE_QUANT_CONTROLLERS:
+            # quant_bit = 0 -> bw_start = bw_max (32)
+            bw_start = quant_codec.get_codec_bits(module.quant_bit.item())
+            _MODULE_QUANT_CONTROLLERS[module] = \
+                quantutil.AdaptiveBitwidthPerformanceController(0, BITWIDTHS, bw_start)
         bw_ctlr = _MODULE_QUANT_CONTROLLERS[module]
         # set the reference value on the controller (usually doesn't change)
         bw_ctlr.reference = module.rate_constraint.item()
+        bw_ctlr.compression_ratio = module.quant_entropy_ratio.item()
         ubatch_size = models.get_microbatch_size(outputs, verify=True)
         send_rate = heartrate * ubatch_size
         bw1, bw2, bw1_iters = bw_ctlr(send_rate, window_size)
@@ -239,13 +280,25 @@ def p2p_post_hook_monitor(tensors: Tuple[torch.Tensor, ...], key: str) -> None:
     assert isinstance(tensors, tuple)
     # Measure work in total data size (MBits), which is a useful metric for data transfers.
     # We don't have enough context here to map tensor structure to a higher-level work concept.
-    mbits = sum(t.numel() * t.numpy().dtype.itemsize for t in tensors) * 8 / 1000000
-    # Accuracy has no meaning here.
-    monitoring.iteration(key, work=mbits)
+    mbits = sum(t.numel() * t.element_size() for t in tensors) * 8 / 1000000
+    # Measure accuracy as the data size actually exchanged (MBits), including protocol overhead and
+    # after any compression.
+    wire_bytes = p2p.last_wire_bytes()
+    mbits_wire = mbits if wire_bytes is None else wire_bytes * 8 / 1000000
+    monitoring.iteration(key, work=mbits, accuracy=mbits_wire)
+
+def p2p_pre_hook_monitor_queues(stage_ctx: p2p.DistP2pPipelineStage) -> None:
+    """Register queue occupancies."""
+    # Measure work as a single sample and accuracy as the number of queued payloads, so that the
+    # average occupancy is the accuracy divided by the work.
+    for name, occupancy in stage_ctx.queue_occupancy().items():
+        monitoring.iteration(MONITORING_KEY_QUEUE_PREFIX + name, work=1, accuracy=occupancy,
+                             safe=False)
 
 
 results_counter = threads.ThreadSafeCounter()
 label_queue = queue.Queue()
+first_result_event = threading.Event()
 
 def handle_results(tensors: torch.Tensor) -> None:
     """Process result tensors"""
@@ -256,59 +309,91 @@ def handle_results(tensors: torch.Tensor) -> None:
     # Measure work as the microbatch size.
     n_items = models.get_microbatch_size(tensors, verify=True)
     if label_queue.empty():
-        # RPC comm doesn't guarantee microbatch ordering, so it can't reliably check labels.
-        # Measure accuracy as the prediction confidence values.
+        # Without labels, measure accuracy as the prediction confidence values.
         # Use softmax to get probability distribution for each tensor.
         acc = torch.nn.functional.softmax(tensors, dim=-1).max(dim=-1)[0].sum().item()
     else:
-        # Measure accuracy based on label (microbatch ordering must be enforced for correctness).
+        # Measure accuracy based on label (P2P and RPC comms both deliver results in order).
         ubatch_labels = label_queue.get()
         assert len(tensors) == len(ubatch_labels)
         pred = tensors.argmax(dim=1)
         acc = pred.eq(ubatch_labels).sum().item()
     monitoring.iteration(MONITORING_KEY_OUTPUT, work=n_items, accuracy=acc, safe=False)
+    if not first_result_event.is_set():
+        # completes the startup iteration, measuring time-to-first-result
+        monitoring.iteration(MONITORING_KEY_STARTUP, work=n_items, safe=False)
+        first_result_event.set()
     logger.info("outputs is %s", tensors)
     results_counter.add(n_items)
 
 
 def parse_yaml_sched(sched: List[dict], hosts: Optional[List[str]]) -> \
-    Tuple[List[Tuple[int, int]], List[int]]:
-    """Parse the YAML schedule into `stage_layers` and `stage_ranks`."""
-    # list of single-entry maps
+    Tuple[List[Tuple[int, int]], List[int], List[Tuple[int, int]]]:
+    """Parse the YAML schedule into `stage_layers`, `stage_ranks`, and `stage_replicas`."""
+    # list of maps
     assert isinstance(sched, list)
     if len(sched) == 0:
         raise RuntimeError("No viable schedule found")
     stage_layers = []
     stage_ranks = []
-    for stage in sched:
-        # dict with a single mapping: host -> [layer_start, layer_end]
-        assert len(stage) == 1
+    stage_replicas = []
+    for stage_idx, stage in enumerate(sched):
+        # dict with mappings: host -> [layer_start, layer_end]
+        # multiple mappings replicate the stage, and must have the same layers
+        assert len(stage) >= 1
         for host, layers in stage.items():
             assert len(layers) == 2
-            stage_layers.append((int(layers[0]), int(layers[1])))
+            layers = (int(layers[0]), int(layers[1]))
             if hosts:
                 try:
-                    stage_ranks.append(hosts.index(host))
+                    rank = hosts.index(host)
                 except ValueError:
                     logger.error("Scheduling: host not found in hosts list: %s", host)
                     raise
             else:
                 try:
-                    stage_ranks.append(int(host))
+                    rank = int(host)
                 except ValueError:
                     logger.error("Scheduling: 'hosts' not specified, failed to parse as rank: %s",
                                   host)
                     raise
-    return stage_layers, stage_ranks
+            if len(stage_layers) == stage_idx:
+                stage_layers.append(layers)
+                stage_ranks.append(rank)
+            elif layers != stage_layers[stage_idx]:
+                raise RuntimeError(f"Scheduling: stage {stage_idx} replica layers {layers} != "
+                                   f"{stage_layers[stage_idx]}")
+            else:
+                stage_replicas.append((stage_idx, rank))
+    return stage_layers, stage_ranks, stage_replicas
+
+
+def get_stage(rank: int, stage_ranks: List[int], stage_replicas: List[Tuple[int, int]]) -> \
+    Optional[int]:
+    """Get the stage for a rank, or `None` if it's not assigned a stage."""
+    try:
+        return stage_ranks.index(rank)
+    except ValueError:
+        pass
+    for stage, rank_rep in stage_replicas:
+        if rank_rep == rank:
+            return stage
+    return None
 
 
 def get_pipeline_sched(world_size: int, hosts: Optional[List[str]],
                        partition: Optional[List[Tuple[int, int]]], quant: Optional[List[int]],
-                       rank_order: Optional[List[int]], model_name: str, microbatch_size: int,
-                       s_models_file: Optional[str], s_dev_types_file: Optional[str],
-                       s_dev_file: Optional[str]) -> \
-    Tuple[List[Tuple[int, int]], List[int], List[int]]:
-    """Get the pipeline schedule: `stage_layers`, `stage_quant`, and `stage_ranks`."""
+                       rank_order: Optional[List[List[int]]], model_name: str,
+                       microbatch_size: int, s_models_file: Optional[str],
+                       s_dev_types_file: Optional[str], s_dev_file: Optional[str],
+                       buffers_in: int=2, buffers_out: int=2) -> \
+    Tuple[List[Tuple[int, int]], List[int], List[int], List[Tuple[int, int]]]:
+    """
+    Get the pipeline schedule: `stage_layers`, `stage_quant`, `stage_ranks`, and `stage_replicas`.
+
+    `stage_ranks` are each stage's first rank, and `stage_replicas` are (stage, rank) pairs for any
+    additional ranks that replicate a stage.
+    """
     def _get_default_quant(n_stages: int) -> List[int]:
         return [0] * n_stages
     if partition:
@@ -326,11 +411,14 @@ def get_pipeline_sched(world_size: int, hosts: Optional[List[str]],
         if rank_order:
             # User specified the stage ranks
             logger.info("Scheduling: using user-defined rank ordering")
-            stage_ranks = rank_order
+            stage_ranks = [ranks[0] for ranks in rank_order]
+            stage_replicas = [(stage, rank) for stage, ranks in enumerate(rank_order)
+                              for rank in ranks[1:]]
         else:
             # Use natural rank order
             logger.info("Scheduling: using natural rank ordering")
             stage_ranks = list(range(len(stage_layers)))
+            stage_replicas = []
     elif quant:
         raise RuntimeError("Must specify partition with quantization")
     elif rank_order:
@@ -341,6 +429,7 @@ def get_pipeline_sched(world_size: int, hosts: Optional[List[str]],
         stage_layers = [(1, model_cfg.get_model_layers(model_name))]
         stage_quant = _get_default_quant(len(stage_layers))
         stage_ranks = [0]
+        stage_replicas = []
     else:
         # Compute the distributed schedule
         # Set membership constraints: hosts in "s_dev_file" <= "hosts" <= hosts in "world" context
@@ -352,21 +441,22 @@ def get_pipeline_sched(world_size: int, hosts: Optional[List[str]],
                 raise RuntimeError("Specified hosts count != world size")
         # Scheduler assumes 1 processing thread and accounts for those in/out buffers independently.
         # Then for both data receive and send, the design intent for the worst case is:
-        # 1 buffer for in-flight data exchanges, 1 buffer for queued (P2P) or blocked (RPC) data.
-        # So, let both 'in' and 'out' buffer counts = 2.
+        # 1 buffer for in-flight data exchanges, N buffers for queued (P2P) or blocked (RPC) data.
+        # So, 'in' and 'out' buffer counts = N + 1, where by default N = 1.
         # P2P enforces this with threads for recv/process/send, and queues between the 3 threads.
         # RPC threads each do recv/process/send for a microbatch, but are constrained in number (3).
-        sched = sched_pipeline(model_name, 2, 2, microbatch_size,
+        sched = sched_pipeline(model_name, buffers_in, buffers_out, microbatch_size,
                                models_file=s_models_file,
                                dev_types_file=s_dev_types_file,
                                dev_file=s_dev_file)
-        stage_layers, stage_ranks = parse_yaml_sched(sched, hosts)
+        stage_layers, stage_ranks, stage_replicas = parse_yaml_sched(sched, hosts)
         # no quantization support yet for automated scheduling
         stage_quant = _get_default_quant(len(stage_layers))
     logger.info("Scheduling: stage-to-layer mapping: %s", stage_layers)
     logger.info("Scheduling: stage output quantization: %s", stage_quant)
     logger.info("Scheduling: stage-to-rank mapping: %s", stage_ranks)
-    return stage_layers, stage_quant, stage_ranks
+    logger.info("Scheduling: stage replicas: %s", stage_replicas)
+    return stage_layers, stage_quant, stage_ranks, stage_replicas
 
 
 def load_dataset(dataset_cfg: dict, model_name: str, batch_size: int, ubatch_size: int) -> Dataset:
@@ -443,13 +533,39 @@ def load_dataset(dataset_cfg: dict, model_name: str, batch_size: int, ubatch_siz
     return dataset
 
 
+def sched_to_tensors(stage_layers: List[Tuple[int, int]], stage_quant: List[int],
+                     stage_ranks: List[int], data_rank: int,
+                     stage_replicas: List[Tuple[int, int]]) -> Tuple[torch.Tensor, ...]:
+    """Get the schedule as `CMD_SCHED` tensors."""
+    tensors = (torch.tensor(stage_layers),
+               torch.tensor(stage_quant),
+               torch.tensor(stage_ranks),
+               torch.tensor(data_rank))
+    # replicas are optional, which avoids sending an empty tensor
+    if len(stage_replicas) > 0:
+        tensors += (torch.tensor(stage_replicas),)
+    return tensors
+
+
+def sched_from_lists(sched: tuple) -> \
+    Tuple[List[Tuple[int, int]], List[int], List[int], int, List[Tuple[int, int]]]:
+    """Get the schedule from received `CMD_SCHED` tensors (as lists)."""
+    stage_layers, stage_quant, stage_ranks, data_rank = sched[:4]
+    stage_replicas = [tuple(rep) for rep in sched[4]] if len(sched) > 4 else []
+    return stage_layers, stage_quant, stage_ranks, data_rank, stage_replicas
+
+
 sched_q = queue.Queue()
 stop_event = threading.Event()
+# Set to request that the P2P data rank re-schedules the pipeline
+resched_event = threading.Event()
 def handle_cmd(cmd: int, tensors: Tuple[torch.Tensor, ...]) -> None:
     """Process received commands."""
     if cmd == CMD_STOP:
         logger.info("handle_cmd: stop")
         stop_event.set()
+        # wake up ranks that are waiting for a (re-)schedule
+        sched_q.put(None)
     elif cmd == CMD_SCHED:
         logger.info("handle_cmd: sched")
         sched_q.put(tuple(t.tolist() for t in tensors))
@@ -457,113 +573,232 @@ def handle_cmd(cmd: int, tensors: Tuple[torch.Tensor, ...]) -> None:
         logger.warning("handle_cmd: Unknown command: %s", cmd)
 
 
+def p2p_module_shard(model_name: str, model_file: Optional[str],
+                     stage_layers: List[Tuple[int, int]], stage_quant: List[int],
+                     stage: Optional[int], model: Optional[models.ModuleShard]) -> \
+    Optional[models.ModuleShard]:
+    """
+    Create a P2P stage's module shard, reusing `model` (a previous shard) where layers overlap.
+
+    A previous shard with the same layers is reused entirely, since shards with the same layers
+    have the same first/last status, and thus the same hooks. Otherwise, a new shard reuses the
+    previous shard's overlapping layers and loads only the others (if the model supports it).
+    """
+    if stage is None:
+        return None
+    layer_start, layer_end = stage_layers[stage]
+    if model is not None and (model.shard_config.layer_start, model.shard_config.layer_end) == \
+        (layer_start, layer_end):
+        logger.info("Reusing module shard: layers: [%d, %d]", layer_start, layer_end)
+        model.register_buffer('quant_bit', torch.tensor(stage_quant[stage]), persistent=False)
+        return model
+    if model is not None:
+        logger.info("Reusing module shard layers: [%d, %d]",
+                    max(layer_start, model.shard_config.layer_start),
+                    min(layer_end, model.shard_config.layer_end))
+    model = model_cfg.module_shard_factory(model_name, model_file, layer_start, layer_end, stage,
+                                           shard_reuse=model)
+    model.register_buffer('quant_bit', torch.tensor(stage_quant[stage]), persistent=False)
+    quant_group_size = int(os.getenv(ENV_QUANT_GROUP_SIZE, str(0)))
+    model.register_buffer('quant_group_size', torch.tensor(quant_group_size), persistent=False)
+    quant_entropy = os.getenv(ENV_QUANT_ENTROPY, str(0)) == '1'
+    model.register_buffer('quant_entropy', torch.tensor(quant_entropy), persistent=False)
+    model.register_buffer('quant_entropy_ratio', torch.tensor(1.0), persistent=False)
+    send_constraint = float(os.getenv(ENV_SEND_CONSTRAINT, str(0)))
+    model.register_buffer('rate_constraint', torch.tensor(send_constraint), persistent=False)
+    model.register_forward_hook(devices.forward_hook_to_cpu)
+    model.register_forward_hook(forward_hook_monitor)
+    if not model.shard_config.is_last:
+        quant_impl = os.getenv(ENV_ADAPTIVE_QUANT)
+        if quant_impl == ADAPTIVE_QUANT_CONTROLLER:
+            model.register_forward_hook(forward_hook_set_quant_controller)
+        elif quant_impl == ADAPTIVE_QUANT_HEURISTIC:
+            model.register_forward_hook(forward_hook_set_quant_bandwidth_heuristic)
+        elif quant_impl == ADAPTIVE_QUANT_HEURISTIC2:
+            model.register_forward_hook(forward_hook_set_quant_bandwidth_heuristic_2)
+        model.register_forward_hook(forward_hook_quant_encode)
+    if not model.shard_config.is_first:
+        model.register_forward_pre_hook(forward_pre_hook_quant_decode)
+    model.register_forward_pre_hook(forward_pre_hook_monitor)
+    model.register_forward_pre_hook(devices.forward_pre_hook_to_device)
+    return model
+
+
 def run_pipeline_p2p(world_size: int, rank: int, model_name: str, model_file: Optional[str],
                      batch_size: int, ubatch_size: int, partition: Optional[List[Tuple[int, int]]],
-                     quant: Optional[List[int]], rank_order: Optional[List[int]], data_rank: int,
+                     quant: Optional[List[int]], rank_order: Optional[List[List[int]]],
+                     data_rank: int,
                      hosts: Optional[List[str]], dataset_cfg: dict,
                      sched_models_file: Optional[str], sched_dev_types_file: Optional[str],
-                     sched_dev_file: Optional[str]) -> None:
+                     sched_dev_file: Optional[str], p2p_protocol: str,
+                     p2p_queue_depths: Mapping[str, int], p2p_send_window: int,
+                     p2p_work_threads: int, p2p_work_num_threads: Optional[int],
+                     p2p_shm: bool, p2p_codec: Union[str, Mapping[int, str]]) -> None:
     """Run the pipeline using P2P communication."""
     monitoring.init(MONITORING_KEY_MODEL, get_window_size(), work_type='tensors', acc_type='layers')
     monitoring.add_key(MONITORING_KEY_OUTPUT, work_type='classifications', acc_type='correct')
     monitoring.add_key(MONITORING_KEY_QUANT_DECODE, work_type='tensors', acc_type='bits')
     monitoring.add_key(MONITORING_KEY_QUANT_ENCODE, work_type='tensors', acc_type='bits')
-    monitoring.add_key(MONITORING_KEY_RECV, work_type='Mbits')
-    monitoring.add_key(MONITORING_KEY_SEND, work_type='Mbits')
-    with DistP2pContext(('gloo',), { 'world_size': world_size, 'rank': rank }, handle_cmd) \
-        as dist_ctx:
+    monitoring.add_key(MONITORING_KEY_RECV, work_type='Mbits', acc_type='wire Mbits')
+    monitoring.add_key(MONITORING_KEY_SEND, work_type='Mbits', acc_type='wire Mbits')
+    for name in p2p.QUEUE_NAMES:
+        monitoring.add_key(MONITORING_KEY_QUEUE_PREFIX + name, work_type='samples',
+                           acc_type='queued')
+    monitoring.add_key(MONITORING_KEY_STARTUP, work_type='classifications', acc_type='acc')
+    # start startup monitoring - completed by the first result in handle_results
+    monitoring.iteration(MONITORING_KEY_STARTUP, work=0, accuracy=0, safe=False)
+    # Each additional worker thread holds another input, and its output until its turn
+    sched_kwargs = {
+        'buffers_in': p2p_queue_depths.get('in', 1) + p2p_work_threads,
+        'buffers_out': p2p_queue_depths.get('out', 1) + p2p_send_window + p2p_work_threads - 1,
+    }
+    # Overlap startup I/O with process group rendezvous and scheduling
+    prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefetch')
+    prefetch_executor.submit(model_cfg.prefetch_model, model_name, model_file)
+    dataset_future = None
+    if rank == data_rank:
+        dataset_future = prefetch_executor.submit(load_dataset, dataset_cfg, model_name,
+                                                  batch_size, ubatch_size)
+    prefetch_executor.shutdown(wait=False)
+    with DistP2pContext(('gloo',), { 'world_size': world_size, 'rank': rank }, handle_cmd,
+                        protocol=p2p_protocol) as dist_ctx:
         # Send or receive the schedule
         if rank == 0:
-            stage_layers, stage_quant, stage_ranks = \
+            stage_layers, stage_quant, stage_ranks, stage_replicas = \
                 get_pipeline_sched(world_size, hosts, partition, quant, rank_order,
                                    model_name, ubatch_size, sched_models_file,
-                                   sched_dev_types_file, sched_dev_file)
+                                   sched_dev_types_file, sched_dev_file, **sched_kwargs)
             logger.info("Scheduling: data rank: %s", data_rank)
             logger.info("Broadcasting schedule")
-            dist_ctx.cmd_broadcast(CMD_SCHED,
-                                   (torch.tensor(stage_layers),
-                                    torch.tensor(stage_quant),
-                                    torch.tensor(stage_ranks),
-                                    torch.tensor(data_rank)))
+            sched = sched_to_tensors(stage_layers, stage_quant, stage_ranks, data_rank,
+                                     stage_replicas)
+            dist_ctx.cmd_broadcast(CMD_SCHED, sched)
+            sched = tuple(t.tolist() for t in sched)
+            if partition:
+                # re-scheduling re-runs the scheduler, so a user-defined schedule wouldn't change
+                logger.info("Re-scheduling disabled: using user-defined partitioning")
+            elif data_rank == 0 and hasattr(signal, 'SIGHUP'):
+                # re-scheduling requires that the scheduler is also the data rank, which drains
+                # the pipeline before broadcasting the new schedule
+                signal.signal(signal.SIGHUP, lambda _signum, _frame: resched_event.set())
         else:
             logger.info("Waiting for schedule")
-            stage_layers, stage_quant, stage_ranks, data_rank = sched_q.get()
+            sched = sched_q.get()
+        model = None
+        # data rank state, which persists across pipeline epochs
+        data_iter = None
+        tik_data = 0.0
+        start_count = 0
+        enqueued = 0
+        # Each (re-)schedule starts a new pipeline epoch
+        epoch = 0
+        while sched is not None:
+            stage_layers, stage_quant, stage_ranks, data_rank, stage_replicas = \
+                sched_from_lists(sched)
             logger.info("Stage layers: %s", stage_layers)
             logger.info("Stage quant: %s", stage_quant)
             logger.info("Stage ranks: %s", stage_ranks)
+            logger.info("Stage replicas: %s", stage_replicas)
             logger.info("Data rank: %s", data_rank)
-        # Create model shard locally
-        try:
-            stage = stage_ranks.index(rank)
-        except ValueError:
-            # we're not assigned a stage at this time
-            stage = None
-        if stage is None:
-            model = None
-        else:
-            model = model_cfg.module_shard_factory(model_name, model_file, stage_layers[stage][0],
-                                                   stage_layers[stage][1], stage)
-            model.register_buffer('quant_bit', torch.tensor(stage_quant[stage]), persistent=False)
-            send_constraint = float(os.getenv(ENV_SEND_CONSTRAINT, str(0)))
-            model.register_buffer('rate_constraint', torch.tensor(send_constraint),
-                                  persistent=False)
-            model.register_forward_hook(devices.forward_hook_to_cpu)
-            model.register_forward_hook(forward_hook_monitor)
-            if stage != len(stage_ranks) - 1:
-                quant_impl = os.getenv(ENV_ADAPTIVE_QUANT)
-                if quant_impl == ADAPTIVE_QUANT_CONTROLLER:
-                    model.register_forward_hook(forward_hook_set_quant_controller)
-                elif quant_impl == ADAPTIVE_QUANT_HEURISTIC:
-                    model.register_forward_hook(forward_hook_set_quant_bandwidth_heuristic)
-                elif quant_impl == ADAPTIVE_QUANT_HEURISTIC2:
-                    model.register_forward_hook(forward_hook_set_quant_bandwidth_heuristic_2)
-                model.register_forward_hook(forward_hook_quant_encode)
-            if stage != 0:
-                model.register_forward_pre_hook(forward_pre_hook_quant_decode)
-            model.register_forward_pre_hook(forward_pre_hook_monitor)
-            model.register_forward_pre_hook(devices.forward_pre_hook_to_device)
-        # Initialize the stage context
-        with model_cfg.dist_p2p_pipeline_stage_factory(stage_ranks, data_rank, rank, stage, model,
-                                                       handle_results) as stage_ctx:
-            stage_ctx.register_recv_pre_hook(p2p_pre_hook_monitor, (MONITORING_KEY_RECV,))
-            stage_ctx.register_recv_post_hook(p2p_post_hook_monitor, (MONITORING_KEY_RECV,))
-            stage_ctx.register_send_pre_hook(p2p_pre_hook_monitor, (MONITORING_KEY_SEND,))
-            stage_ctx.register_send_post_hook(p2p_post_hook_monitor, (MONITORING_KEY_SEND,))
-            if rank == data_rank:
-                dataset = load_dataset(dataset_cfg, model_name, batch_size, ubatch_size)
-                data_loader = DataLoader(dataset, batch_size=ubatch_size)
-                tik_data = time.time()
-                # start results monitoring - see comments in handle_results
-                monitoring.iteration(MONITORING_KEY_OUTPUT, work=0, accuracy=0, safe=False)
-                # this call is asynchronous - wait for results to get end-to-end timings
-                start_count = results_counter.value
-                for ubatch, ubatch_labels in data_loader:
-                    label_queue.put(ubatch_labels)
-                    stage_ctx.enqueue_tensor(ubatch)
-                results_counter.wait_gte(start_count + len(dataset))
-                tok_data = time.time()
-                latency = tok_data - tik_data
-                throughput = batch_size / latency
-                logger.info("Latency is %f, throughput is %f", latency, throughput)
-                # will set stop_event on all other ranks
-                dist_ctx.cmd_broadcast(CMD_STOP)
-                stop_event.set()
-            else:
-                stop_event.wait()
+            # Create model shard locally (we may not be assigned a stage at this time)
+            stage = get_stage(rank, stage_ranks, stage_replicas)
+            if model is not None and (stage is None or
+                                      stage_layers[stage][0] > model.shard_config.layer_end or
+                                      stage_layers[stage][1] < model.shard_config.layer_start):
+                # no layers to reuse, so drop the previous shard's weights before loading new ones
+                model = None
+            model = p2p_module_shard(model_name, model_file, stage_layers, stage_quant, stage,
+                                     model)
+            # Initialize the stage context
+            with model_cfg.dist_p2p_pipeline_stage_factory(stage_ranks, data_rank, rank, stage,
+                                                           model, handle_results,
+                                                           protocol=p2p_protocol,
+                                                           queue_depths=p2p_queue_depths,
+                                                           send_window=p2p_send_window,
+                                                           work_threads=p2p_work_threads,
+                                                           work_num_threads=p2p_work_num_threads,
+                                                           stage_replicas=stage_replicas,
+                                                           use_shm=p2p_shm,
+                                                           codec_name=p2p_codec,
+                                                           epoch=epoch) \
+                as stage_ctx:
+                stage_ctx.register_recv_pre_hook(p2p_pre_hook_monitor_queues, (stage_ctx,))
+                stage_ctx.register_send_pre_hook(p2p_pre_hook_monitor_queues, (stage_ctx,))
+                stage_ctx.register_recv_pre_hook(p2p_pre_hook_monitor, (MONITORING_KEY_RECV,))
+                stage_ctx.register_recv_post_hook(p2p_post_hook_monitor, (MONITORING_KEY_RECV,))
+                stage_ctx.register_send_pre_hook(p2p_pre_hook_monitor, (MONITORING_KEY_SEND,))
+                stage_ctx.register_send_post_hook(p2p_post_hook_monitor, (MONITORING_KEY_SEND,))
+                # Wait for all ranks to be ready, so end-to-end timings exclude other ranks' startup
+                logger.info("Waiting for all ranks to be ready")
+                dist_ctx.cmd_gather(root=data_rank)
+                if rank != data_rank:
+                    # the data rank drains the pipeline before sending a new schedule
+                    sched = sched_q.get()
+                else:
+                    if data_iter is None:
+                        if dataset_future is None:
+                            # the scheduler chose a data rank other than our --data-rank argument
+                            dataset = load_dataset(dataset_cfg, model_name, batch_size,
+                                                   ubatch_size)
+                        else:
+                            dataset = dataset_future.result()
+                        data_iter = iter(DataLoader(dataset, batch_size=ubatch_size))
+                        tik_data = time.time()
+                        # start results monitoring - see comments in handle_results
+                        monitoring.iteration(MONITORING_KEY_OUTPUT, work=0, accuracy=0,
+                                             safe=False)
+                        # this call is asynchronous - wait for results to get end-to-end timings
+                        start_count = results_counter.value
+                    for ubatch, ubatch_labels in data_iter:
+                        label_queue.put(ubatch_labels)
+                        stage_ctx.enqueue_tensor(ubatch)
+                        enqueued += len(ubatch_labels)
+                        if resched_event.is_set():
+                            break
+                    # drain the pipeline
+                    results_counter.wait_gte(start_count + enqueued)
+                    if enqueued < len(dataset):
+                        resched_event.clear()
+                        logger.info("Re-scheduling")
+                        stage_layers, stage_quant, stage_ranks, stage_replicas = \
+                            get_pipeline_sched(world_size, hosts, partition, quant, rank_order,
+                                               model_name, ubatch_size, sched_models_file,
+                                               sched_dev_types_file, sched_dev_file,
+                                               **sched_kwargs)
+                        sched = sched_to_tensors(stage_layers, stage_quant, stage_ranks,
+                                                 data_rank, stage_replicas)
+                        dist_ctx.cmd_broadcast(CMD_SCHED, sched)
+                        sched = tuple(t.tolist() for t in sched)
+                    else:
+                        tok_data = time.time()
+                        latency = tok_data - tik_data
+                        throughput = batch_size / latency
+                        logger.info("Latency is %f, throughput is %f", latency, throughput)
+                        # will set stop_event on all other ranks
+                        dist_ctx.cmd_broadcast(CMD_STOP)
+                        stop_event.set()
+                        sched = None
+            epoch += 1
     monitoring.finish()
 
 
 def run_pipeline_rpc(world_size: int, rank: int, model_name: str, model_file: Optional[str],
                      batch_size: int, ubatch_size: int, partition: Optional[List[Tuple[int, int]]],
-                     quant: Optional[List[int]], rank_order: Optional[List[int]], data_rank: int,
+                     quant: Optional[List[int]], rank_order: Optional[List[List[int]]],
+                     data_rank: int,
                      hosts: Optional[List[str]], dataset_cfg: dict,
                      sched_models_file: Optional[str], sched_dev_types_file: Optional[str],
-                     sched_dev_file: Optional[str], rpc_num_worker_threads: int) -> None:
+                     sched_dev_file: Optional[str], rpc_num_worker_threads: int,
+                     rpc_num_fwd: Optional[int], rpc_num_mod: int, rpc_module_replicas: int,
+                     rpc_module_num_threads: Optional[int]) -> None:
     """Run the pipeline using RPC communication."""
     monitoring.init(MONITORING_KEY_MODEL, get_window_size(), work_type='tensors', acc_type='layers')
-    monitoring.add_key(MONITORING_KEY_OUTPUT, work_type='classifications', acc_type='confidence')
+    monitoring.add_key(MONITORING_KEY_OUTPUT, work_type='classifications', acc_type='correct')
     monitoring.add_key(MONITORING_KEY_QUANT_DECODE, work_type='tensors', acc_type='bits')
     monitoring.add_key(MONITORING_KEY_QUANT_ENCODE, work_type='tensors', acc_type='bits')
+    monitoring.add_key(MONITORING_KEY_STARTUP, work_type='classifications', acc_type='acc')
+    # start startup monitoring - completed by the first result in handle_results
+    monitoring.iteration(MONITORING_KEY_STARTUP, work=0, accuracy=0, safe=False)
     logger.debug("GLOO Threads: %d", rpc_num_worker_threads)
     rpc_opts = tensorpipe_rpc_backend_options_factory(num_worker_threads=rpc_num_worker_threads)
     with DistRpcContext((f"worker{rank}",),
@@ -573,20 +808,20 @@ def run_pipeline_rpc(world_size: int, rank: int, model_name: str, model_file: Op
                        ) as dist_ctx:
         # Send or receive the schedule
         if rank == 0:
-            stage_layers, stage_quant, stage_ranks = \
+            stage_layers, stage_quant, stage_ranks, stage_replicas = \
                 get_pipeline_sched(world_size, hosts, partition, quant, rank_order,
                                    model_name, ubatch_size, sched_models_file,
                                    sched_dev_types_file, sched_dev_file)
+            if len(stage_replicas) > 0:
+                raise RuntimeError("Stage replicas are only supported by 'p2p' communication")
             logger.info("Scheduling: data rank: %s", data_rank)
             logger.info("Broadcasting schedule")
             dist_ctx.cmd_broadcast(handle_cmd, CMD_SCHED,
-                                   (torch.tensor(stage_layers),
-                                    torch.tensor(stage_quant),
-                                    torch.tensor(stage_ranks),
-                                    torch.tensor(data_rank)))
+                                   sched_to_tensors(stage_layers, stage_quant, stage_ranks,
+                                                    data_rank, stage_replicas))
         else:
             logger.info("Waiting for schedule")
-            stage_layers, stage_quant, stage_ranks, data_rank = sched_q.get()
+            stage_layers, stage_quant, stage_ranks, data_rank, _ = sched_from_lists(sched_q.get())
             logger.info("Stage layers: %s", stage_layers)
             logger.info("Stage quant: %s", stage_quant)
             logger.info("Stage ranks: %s", stage_ranks)
@@ -596,9 +831,24 @@ def run_pipeline_rpc(world_size: int, rank: int, model_name: str, model_file: Op
             data_loader = DataLoader(dataset, batch_size=ubatch_size)
             # Create model shards on workers (requires distributed context to be initialized)
             pipeline = model_cfg.dist_rpc_pipeline_factory(model_name, model_file, stage_ranks,
-                                                           stage_layers, data_rank, handle_results)
+                                                           stage_layers, data_rank, handle_results,
+                                                           num_fwd=rpc_num_fwd,
+                                                           num_mod=rpc_num_mod,
+                                                           module_replicas=rpc_module_replicas,
+                                                           num_threads=rpc_module_num_threads)
             pipeline.rpc_register_buffer('quant_bit', [torch.tensor(q) for q in stage_quant],
                                          persistent=False)
+            quant_group_size = int(os.getenv(ENV_QUANT_GROUP_SIZE, str(0)))
+            pipeline.rpc_register_buffer('quant_group_size',
+                                         [torch.tensor(quant_group_size) for _ in stage_quant],
+                                         persistent=False)
+            quant_entropy = os.getenv(ENV_QUANT_ENTROPY, str(0)) == '1'
+            pipeline.rpc_register_buffer('quant_entropy',
+                                         [torch.tensor(quant_entropy) for _ in stage_quant],
+                                         persistent=False)
+            pipeline.rpc_register_buffer('quant_entropy_ratio',
+                                         [torch.tensor(1.0) for _ in stage_quant],
+                                         persistent=False)
             pipeline.rpc_register_forward_hook(devices.forward_hook_to_cpu)
             pipeline.rpc_register_forward_hook(forward_hook_monitor)
             pipeline.rpc_register_forward_hook(forward_hook_quant_encode, last=False)
@@ -610,7 +860,8 @@ def run_pipeline_rpc(world_size: int, rank: int, model_name: str, model_file: Op
             monitoring.iteration(MONITORING_KEY_OUTPUT, work=0, accuracy=0, safe=False)
             # this call is asynchronous - wait for results to get end-to-end timings
             start_count = results_counter.value
-            for ubatch, _ in data_loader:
+            for ubatch, ubatch_labels in data_loader:
+                label_queue.put(ubatch_labels)
                 pipeline.enqueue_tensor(ubatch)
             results_counter.wait_gte(start_count + len(dataset))
             tok_data = time.time()
@@ -670,6 +921,48 @@ def main() -> None:
                         help="the communication implementation")
     parser.add_argument("-w", "--worker-threads", default=16, type=int,
                         help="the number of worker threads for the 'rpc' communication backend")
+    parser.add_argument("--rpc-num-fwd", type=int,
+                        help="max microbatches in each stage at once for the 'rpc' communication "
+                             "backend; default: 3 * rpc-num-mod * rpc-module-replicas")
+    parser.add_argument("--rpc-num-mod", type=int, default=1,
+                        help="max concurrent microbatches processed by each module replica for "
+                             "the 'rpc' communication backend")
+    parser.add_argument("--rpc-module-replicas", type=int, default=1,
+                        help="number of module copies in each stage for the 'rpc' communication "
+                             "backend, which process microbatches in parallel (worker threads "
+                             "must accommodate the increased concurrency)")
+    parser.add_argument("--rpc-module-num-threads", type=int,
+                        help="torch intra-op threads for each module call for the 'rpc' "
+                             "communication backend")
+    parser.add_argument("--p2p-protocol", type=str, default=p2p.PROTOCOL_TENSORS,
+                        choices=p2p.PROTOCOLS,
+                        help="the wire protocol for the 'p2p' communication backend - "
+                             "'framed' sends all metadata for a payload in a single header, "
+                             "'packed' also sends all payload data in a single buffer")
+    parser.add_argument("--p2p-queue-depths", type=str, default="1",
+                        help="comma-delimited list of max queue sizes for the 'p2p' communication "
+                             "backend, either one value for all queues or 3 values ordered as: "
+                             "inbound,outbound,results")
+    parser.add_argument("--p2p-send-window", type=int, default=p2p.SEND_WINDOW_DEFAULT,
+                        help="max number of microbatches with sends in flight at once for the "
+                             "'p2p' communication backend")
+    parser.add_argument("--p2p-work-threads", type=int, default=p2p.WORK_THREADS_DEFAULT,
+                        help="number of threads processing microbatches in each stage for the "
+                             "'p2p' communication backend (model monitoring intervals overlap "
+                             "when > 1)")
+    parser.add_argument("--p2p-work-num-threads", type=int,
+                        help="torch intra-op threads for each processing thread for the 'p2p' "
+                             "communication backend")
+    parser.add_argument("--p2p-shm", action='store_true',
+                        help="send data through shared memory to co-located ranks for the 'p2p' "
+                             "communication backend (requires a 'framed' or 'packed' protocol)")
+    parser.add_argument("--p2p-codec", type=str, default=p2p.codec.CODEC_NONE,
+                        help="lossless compression codec for the 'p2p' communication backend, "
+                             "used while it pays off (requires the 'packed' protocol), either "
+                             "one of: " + ", ".join(p2p.codec.CODECS) + "; or a comma-delimited "
+                             "list of dst rank and codec pairs for per-link codecs, e.g.: "
+                             "'2:zlib,3:shuffle-zlib' (other links aren't compressed); "
+                             "'shuffle-zlib' groups bytes by significance before compressing")
     # Model options
     parser.add_argument("-m", "--model-name", type=str, default="google/vit-base-patch16-224",
                         choices=model_cfg.get_model_names(),
@@ -699,10 +992,12 @@ def main() -> None:
                         help="comma-delimited list of start/end layer pairs, e.g.: '1,24,25,48'; "
                              "single-node default: all layers in the model")
     usched.add_argument("-q", "--quant", type=str,
-                        help="comma-delimited list of quantization bits to use after each stage")
+                        help="comma-delimited list of quantization bits (0 for none) or codecs "
+                             "(e.g., 'fp16', 'bf16', 'int8') to use after each stage")
     usched.add_argument("-r", "--rank-order", type=str, default=None,
-                        help="comma-delimited list of ranks in desired stage order; "
-                             "default: natural rank order")
+                        help="comma-delimited list of ranks in desired stage order, where '+' "
+                             "delimits ranks that replicate a stage ('p2p' only), e.g.: "
+                             "'0,1+3,2'; default: natural rank order")
     usched.add_argument("-D", "--data-rank", type=int, default=0,
                         help="rank where inputs are loaded and outputs are processed - must be "
                              "the same as stage=0 or not in the stage pipeline")
@@ -749,9 +1044,33 @@ def main() -> None:
         parts = [int(i) for i in args.partition.split(',')]
         assert len(parts) % 2 == 0
         partition = [(parts[i], parts[i+1]) for i in range(0, len(parts), 2)]
-    quant = None if args.quant is None else [int(i) for i in args.quant.split(',')]
-    rank_order = None if args.rank_order is None else [int(i) for i in args.rank_order.split(',')]
+    try:
+        quant = None if args.quant is None else \
+            [quant_codec.get_codec_id(i) for i in args.quant.split(',')]
+    except ValueError as exc:
+        parser.error(f"--quant: {exc}")
+    rank_order = None if args.rank_order is None else \
+        [[int(i) for i in ranks.split('+')] for ranks in args.rank_order.split(',')]
     hosts = None if args.hosts is None else args.hosts.split(',')
+    queue_depths = [int(i) for i in args.p2p_queue_depths.split(',')]
+    if len(queue_depths) == 1:
+        queue_depths *= len(p2p.QUEUE_NAMES)
+    if len(queue_depths) != len(p2p.QUEUE_NAMES):
+        parser.error("--p2p-queue-depths requires 1 or 3 values")
+    p2p_queue_depths = dict(zip(p2p.QUEUE_NAMES, queue_depths))
+    if ':' in args.p2p_codec:
+        try:
+            p2p_codec = { int(dst): name for dst, name in
+                          (link.split(':') for link in args.p2p_codec.split(',')) }
+        except ValueError:
+            parser.error(f"--p2p-codec: invalid dst rank and codec pairs: {args.p2p_codec}")
+        p2p_codec_names = p2p_codec.values()
+    else:
+        p2p_codec = args.p2p_codec
+        p2p_codec_names = [p2p_codec]
+    for name in p2p_codec_names:
+        if name not in p2p.codec.CODECS:
+            parser.error(f"--p2p-codec: unknown codec: {name}")
 
     tik = time.time()
     init_env(args.device, args.addr, args.port, args.socket_ifname)
@@ -763,12 +1082,16 @@ def main() -> None:
         run_pipeline_p2p(args.worldsize, args.rank, args.model_name, args.model_file,
                          args.batch_size, args.ubatch_size, partition, quant, rank_order,
                          args.data_rank, hosts, dataset_cfg, args.sched_models_file,
-                         args.sched_dev_types_file, args.sched_dev_file)
+                         args.sched_dev_types_file, args.sched_dev_file, args.p2p_protocol,
+                         p2p_queue_depths, args.p2p_send_window, args.p2p_work_threads,
+                         args.p2p_work_num_threads, args.p2p_shm, p2p_codec)
     else:
         run_pipeline_rpc(args.worldsize, args.rank, args.model_name, args.model_file,
                          args.batch_size, args.ubatch_size, partition, quant, rank_order,
                          args.data_rank, hosts, dataset_cfg, args.sched_models_file,
-                         args.sched_dev_types_file, args.sched_dev_file, args.worker_threads)
+                         args.sched_dev_types_file, args.sched_dev_file, args.worker_threads,
+                         args.rpc_num_fwd, args.rpc_num_mod, args.rpc_module_replicas,
+                         args.rpc_module_num_threads)
     tok = time.time()
     logger.info("Total program execution time = %f", tok - tik)
 
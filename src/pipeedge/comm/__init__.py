@@ -1,9 +1,44 @@
 """Communication module."""
-from typing import Callable, Tuple, Type
+from typing import Callable, List, Optional, Tuple, Type
 import torch
 
 DistCmdHandler: Type = Callable[[int, Tuple[torch.Tensor, ...]], None]
 
+
+def _tree_check(rank: int, root: int, world_size: int) -> int:
+    if not 0 <= root < world_size:
+        raise ValueError(f"Root must be in [0, {world_size}), but root={root}")
+    if not 0 <= rank < world_size:
+        raise ValueError(f"Rank must be in [0, {world_size}), but rank={rank}")
+    # rank relative to root
+    return (rank - root) % world_size
+
+def tree_parent(rank: int, root: int, world_size: int) -> Optional[int]:
+    """Get a rank's parent in the binomial tree rooted at `root`, or `None` for the root."""
+    vrank = _tree_check(rank, root, world_size)
+    if vrank == 0:
+        return None
+    # clear the lowest set bit
+    return ((vrank & (vrank - 1)) + root) % world_size
+
+def tree_children(rank: int, root: int, world_size: int) -> List[int]:
+    """
+    Get a rank's children in the binomial tree rooted at `root`, largest subtree first.
+
+    Messages sent down the tree (or up it, in reverse) reach all ranks in `ceil(log2(world_size))`
+    rounds, and no rank sends more than that many messages.
+    """
+    vrank = _tree_check(rank, root, world_size)
+    # children set one of the bits below the lowest set bit (any bit for the root)
+    mask = vrank & -vrank if vrank > 0 else 1 << max(0, world_size - 1).bit_length()
+    children = []
+    mask >>= 1
+    while mask > 0:
+        if vrank | mask < world_size:
+            children.append(((vrank | mask) + root) % world_size)
+        mask >>= 1
+    return children
+
 class DistContext:
     """Parent class for distributed context managers."""
 
@@ -3,15 +3,21 @@ import collections
 import queue
 import threading
 import time
-from typing import Any, Callable, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+import numpy as np
 import torch
 import torch.distributed as dist
-from .. import DistCmdHandler, DistContext
-from . import util
+from .. import DistCmdHandler, DistContext, tree_children, tree_parent
+from . import codec, shm, util
 
 # Base tag values
 TAG_BASE_DATA = 0
 TAG_BASE_CMD = 10
+TAG_BASE_GATHER = 20
+TAG_BASE_PROBE = 30
+# Data tags for each pipeline epoch are offset by this stride, so messages left over from a
+# previous epoch's pipeline (e.g., stop messages) are never received by a later one
+TAG_EPOCH_STRIDE = 100
 
 # Offsets which are added to base values above
 TAG_TENSOR_COUNT = 0
@@ -19,6 +25,66 @@ TAG_TENSOR_DTYPE_SHAPELEN = 1
 TAG_TENSOR_SHAPE = 2
 TAG_TENSOR = 3
 TAG_TENSOR_PICKLED_SIZE = 4
+TAG_FRAME_HEADER = 5
+TAG_FRAME_HEADER_EXT = 6
+TAG_SHM_REPLY = 7
+TAG_SHM_RELEASE = 8
+
+# Wire protocols for exchanging payloads
+# PROTOCOL_TENSORS: count, then pickled size, dtype/shape length, shape, and data for each tensor
+# PROTOCOL_FRAMED: a single header with all payload metadata, then data for each tensor
+# PROTOCOL_PACKED: a single header with all payload metadata, then all tensor data in one buffer
+PROTOCOL_TENSORS = 'tensors'
+PROTOCOL_FRAMED = 'framed'
+PROTOCOL_PACKED = 'packed'
+PROTOCOLS = [PROTOCOL_TENSORS, PROTOCOL_FRAMED, PROTOCOL_PACKED]
+
+# Frame headers have a fixed length so they can be received without first knowing their size.
+# Larger headers (lots of tensors and/or dimensions) overflow into a header extension message.
+FRAME_HEADER_LEN = 64
+# Frame header fields, followed by one record per tensor: [pickled size, dtype, ndim, *shape]
+# _FRAME_DATA_BYTES is the size of encoded (e.g., compressed) data, which can't be inferred
+# _FRAME_ROOT is the rank that originated a command, which may be forwarded by other ranks
+_FRAME_LEN = 0
+_FRAME_COUNT = 1
+_FRAME_FLAGS = 2
+_FRAME_SRC = 3
+_FRAME_CMD = 4
+_FRAME_DATA_BYTES = 5
+_FRAME_ROOT = 6
+_FRAME_RECORDS = 7
+# Default maximum queue sizes for DistP2pPipelineStage
+QUEUE_DEPTH_DEFAULT = 1
+QUEUE_NAMES = ['in', 'out', 'res']
+# Default maximum number of payloads in flight in DistP2pPipelineStage send threads
+SEND_WINDOW_DEFAULT = 1
+# Default number of worker threads in DistP2pPipelineStage
+WORK_THREADS_DEFAULT = 1
+# Default maximum number of free receive buffers kept for reuse by DistP2pPipelineStage
+RECV_POOL_SIZE_DEFAULT = 16
+
+# Tensor count which signals that the sender stopped (recall that -1 indicates a non-tuple payload)
+TENSOR_COUNT_STOP = -2
+
+# Frame header flags
+FRAME_FLAG_PACKED = 0x1
+# The packed buffer is in the sender's shared memory ring, rather than sent as a message
+FRAME_FLAG_SHM = 0x2
+# The frame carries the path to a shared memory ring, to which the receiver replies if it's usable
+FRAME_FLAG_SHM_HELLO = 0x4
+# The packed buffer is compressed
+FRAME_FLAG_ZLIB = 0x8
+FRAME_FLAG_SHUFFLE = 0x10
+_FRAME_FLAGS_CODECS = {
+    codec.CODEC_ZLIB: FRAME_FLAG_ZLIB,
+    codec.CODEC_SHUFFLE_ZLIB: FRAME_FLAG_ZLIB | FRAME_FLAG_SHUFFLE,
+}
+
+# Shared memory rings for co-located ranks: number of slots, and minimum slot size
+SHM_SLOTS = 4
+SHM_SLOT_BYTES_MIN = 1024 * 1024
+# Byte alignment of each tensor in a packed buffer, so that views into the buffer are aligned
+PACK_ALIGN = 16
 
 # Ordered set of torch types: https://pytorch.org/docs/stable/tensor_attributes.html
 TORCH_TYPES = [ torch.float32,
@@ -36,6 +102,9 @@ TORCH_TYPES = [ torch.float32,
 TORCH_TYPES_ENUM = collections.OrderedDict()
 for i, t in enumerate(TORCH_TYPES):
     TORCH_TYPES_ENUM[t] = i
+# numpy has no bfloat16, so it's packed/unpacked as int16, which has the same size
+_NUMPY_TYPES = { t: torch.empty(0, dtype=torch.int16 if t == torch.bfloat16 else t).numpy().dtype
+                 for t in TORCH_TYPES }
 
 
 class DistP2pContext(DistContext):
@@ -50,11 +119,17 @@ class DistP2pContext(DistContext):
         Keyword arguments for ``torch.distributed.init_process_group()``.
     cmd_cb : DistCmdHandler
         Command handler callback.
+    protocol : str
+        The wire protocol for commands, one of `PROTOCOLS` (must be the same on all ranks).
     """
 
-    def __init__(self, ipg_args: tuple, ipg_kwargs: dict, cmd_cb: DistCmdHandler):
+    def __init__(self, ipg_args: tuple, ipg_kwargs: dict, cmd_cb: DistCmdHandler,
+                 protocol: str=PROTOCOL_TENSORS):
         super().__init__(ipg_args, ipg_kwargs)
-        self._thread_cmd = CommandThread(cmd_cb)
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"Unknown protocol: {protocol}")
+        self._protocol = protocol
+        self._thread_cmd = CommandThread(cmd_cb, protocol=protocol)
 
     def init(self) -> None:
         """Initialize the distributed context and threads."""
@@ -70,20 +145,70 @@ class DistP2pContext(DistContext):
         dist.destroy_process_group()
 
     def cmd_broadcast(self, cmd: int, tensors: Optional[Tuple[torch.Tensor, ...]]=None) -> None:
-        """Broadcast a command."""
+        """Broadcast a command, which receivers forward down a binomial tree."""
         assert self._initialized
         if tensors is None:
             tensors = ()
-        tensor_cmd = torch.tensor([cmd, len(tensors)], dtype=torch.int)
-        reqs = []
-        for dst in range(self._world_size):
-            if dst != self._rank:
-                reqs.append(dist.isend(tensor_cmd, dst=dst, tag=TAG_BASE_CMD))
-                for tensor in tensors:
-                    reqs += _send_tensor(tensor, dst, TAG_BASE_CMD, fn_send=dist.isend)
-        for req in reqs:
+        dsts = tree_children(self._rank, self._rank, self._world_size)
+        for req in _send_cmd(self._protocol, cmd, tensors, self._rank, dsts):
             req.wait()
 
+    def cmd_gather(self, tensors: Optional[Tuple[torch.Tensor, ...]]=None, root: int=0) \
+        -> Optional[List[Tuple[torch.Tensor, ...]]]:
+        """
+        Gather tensors from all ranks to `root` up a binomial tree.
+
+        All ranks must call this method with the same `root`.
+        Returns the tensors from each rank (in rank order) on `root`, and `None` on other ranks.
+        """
+        assert self._initialized
+        if tensors is None:
+            tensors = ()
+        parent = tree_parent(self._rank, root, self._world_size)
+        gathered = [(self._rank, tuple(tensors))]
+        # smallest subtrees are likely to finish first
+        for src in reversed(tree_children(self._rank, root, self._world_size)):
+            tensor_size = torch.zeros(1, dtype=torch.long)
+            dist.recv(tensor=tensor_size, src=src, tag=TAG_BASE_GATHER+TAG_TENSOR_PICKLED_SIZE)
+            buf = torch.empty(int(tensor_size), dtype=torch.uint8)
+            dist.recv(tensor=buf, src=src, tag=TAG_BASE_GATHER+TAG_TENSOR)
+            gathered += util.tensor_to_object(buf, int(tensor_size))
+        if parent is not None:
+            buf, tensor_size = util.object_to_tensor(gathered, None)
+            dist.send(tensor=tensor_size, dst=parent, tag=TAG_BASE_GATHER+TAG_TENSOR_PICKLED_SIZE)
+            dist.send(tensor=buf, dst=parent, tag=TAG_BASE_GATHER+TAG_TENSOR)
+            return None
+        results = [()] * self._world_size
+        for rank, rank_tensors in gathered:
+            results[rank] = tuple(rank_tensors)
+        return results
+
+
+def _send_cmd(protocol, cmd, tensors, root, dsts):
+    """Asynchronously send a command to ranks, return the send requests."""
+    reqs = []
+    if len(dsts) == 0:
+        return reqs
+    if protocol != PROTOCOL_TENSORS:
+        tensor_sizes = (-1,) * len(tensors)
+        flags = 0
+        if protocol == PROTOCOL_PACKED:
+            flags = FRAME_FLAG_PACKED
+        headers = _frame_headers(tensors, tensor_sizes, len(tensors), cmd=cmd, flags=flags,
+                                 root=root)
+        if protocol == PROTOCOL_PACKED:
+            buf = _pack_tensors(tensors)
+            tensors = (buf,) if len(buf) > 0 else ()
+        for dst in dsts:
+            reqs += _send_frame(headers, tensors, dst, TAG_BASE_CMD, fn_send=dist.isend)
+    else:
+        tensor_cmd = torch.tensor([cmd, len(tensors), root], dtype=torch.int)
+        for dst in dsts:
+            reqs.append(dist.isend(tensor_cmd, dst=dst, tag=TAG_BASE_CMD))
+            for tensor in tensors:
+                reqs += _send_tensor(tensor, dst, TAG_BASE_CMD, fn_send=dist.isend)
+    return reqs
+
 
 class ConditionQueue(queue.Queue):
     """A Queue with a public `condition: threading.Condition` variable for synchronization."""
@@ -108,19 +233,227 @@ def _send_tensor(tensor, dst, tag_base, fn_send=dist.send):
     return results
 
 
-def _recv_tensor(src, tag_base):
-    tensor_dtype_shapelen = torch.zeros(2, dtype=torch.int)
+def _empty(shape, dtype, pool=None):
+    if pool is None:
+        return torch.empty(shape, dtype=dtype)
+    return pool.acquire(shape, dtype)
+
+
+def _recv_tensor(src, tag_base, pool=None):
+    tensor_dtype_shapelen = _empty((2,), torch.int, pool=pool)
     dist.recv(tensor=tensor_dtype_shapelen, src=src, tag=tag_base+TAG_TENSOR_DTYPE_SHAPELEN)
-    dtype = TORCH_TYPES[tensor_dtype_shapelen[0]]
-    shape_len = tensor_dtype_shapelen[1]
-    tensor_shape = torch.zeros(shape_len, dtype=torch.int)
+    dtype_enum, shape_len = tensor_dtype_shapelen.tolist()
+    dtype = TORCH_TYPES[dtype_enum]
+    shape = []
     if shape_len > 0:
+        tensor_shape = _empty((shape_len,), torch.int, pool=pool)
         dist.recv(tensor=tensor_shape, src=src, tag=tag_base+TAG_TENSOR_SHAPE)
-    tensor = torch.tensor((), dtype=dtype).new_empty(tensor_shape.tolist())
+        shape = tensor_shape.tolist()
+        if pool is not None:
+            pool.release(tensor_shape)
+    if pool is not None:
+        pool.release(tensor_dtype_shapelen)
+    tensor = _empty(shape, dtype, pool=pool)
     dist.recv(tensor=tensor, src=src, tag=tag_base+TAG_TENSOR)
     return tensor
 
 
+def _pack_layout(records):
+    """Get the byte offset of each (dtype, shape) record in a packed buffer, and the buffer size."""
+    offsets = []
+    nbytes = 0
+    for dtype, shape in records:
+        offsets.append(nbytes)
+        numel = int(np.prod(shape, dtype=np.int64))
+        nbytes += -(-numel * _NUMPY_TYPES[dtype].itemsize // PACK_ALIGN) * PACK_ALIGN
+    return offsets, nbytes
+
+
+def _pack_tensors(tensors, buf=None):
+    """Copy tensors into a byte buffer (reallocated if `buf` is too small), return a buffer view."""
+    offsets, nbytes = _pack_layout([(t.dtype, t.shape) for t in tensors])
+    if buf is None or len(buf) < nbytes:
+        buf = torch.empty(nbytes, dtype=torch.uint8)
+    buf_np = buf.numpy()
+    for tensor, offset in zip(tensors, offsets):
+        dtype = _NUMPY_TYPES[tensor.dtype]
+        if tensor.dtype == torch.bfloat16:
+            tensor = tensor.view(torch.int16)
+        dst = buf_np[offset:offset + tensor.numel() * dtype.itemsize].view(dtype)
+        np.copyto(dst.reshape(tensor.shape), tensor.detach().numpy())
+    return buf[:nbytes]
+
+
+def _unpack_tensors(buf, records):
+    """Get tensors as zero-copy views into a packed byte buffer."""
+    offsets, _ = _pack_layout(records)
+    buf_np = buf.numpy()
+    tensors = ()
+    for (dtype, shape), offset in zip(records, offsets):
+        np_dtype = _NUMPY_TYPES[dtype]
+        numel = int(np.prod(shape, dtype=np.int64))
+        arr = buf_np[offset:offset + numel * np_dtype.itemsize].view(np_dtype).reshape(shape)
+        tensor = torch.from_numpy(arr)
+        if dtype == torch.bfloat16:
+            tensor = tensor.view(torch.bfloat16)
+        tensors += (tensor,)
+    return tensors
+
+
+def _nbytes(tensors):
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def _pack_segments(records):
+    """Get the `codec.Segment` of each (dtype, shape) record in a packed buffer."""
+    offsets, _ = _pack_layout(records)
+    return [(offset, _NUMPY_TYPES[dtype].itemsize, int(np.prod(shape, dtype=np.int64)))
+            for (dtype, shape), offset in zip(records, offsets)]
+
+
+def _frame_headers(tensors, tensor_sizes, tensor_count, cmd=0, flags=0, data_bytes=0, root=None):
+    header = [0] * _FRAME_RECORDS
+    header[_FRAME_COUNT] = tensor_count
+    header[_FRAME_FLAGS] = flags
+    header[_FRAME_SRC] = dist.get_rank()
+    header[_FRAME_CMD] = cmd
+    header[_FRAME_DATA_BYTES] = data_bytes
+    header[_FRAME_ROOT] = header[_FRAME_SRC] if root is None else root
+    for tensor, tensor_size in zip(tensors, tensor_sizes):
+        header += [tensor_size, TORCH_TYPES_ENUM[tensor.dtype], len(tensor.shape)]
+        header += tensor.shape
+    header[_FRAME_LEN] = len(header)
+    header += [0] * (FRAME_HEADER_LEN - len(header))
+    tensor_header = torch.tensor(header, dtype=torch.long)
+    # the extension is empty unless the header overflows its fixed length
+    return tensor_header[:FRAME_HEADER_LEN], tensor_header[FRAME_HEADER_LEN:]
+
+
+def _send_frame(headers, tensors, dst, tag_base, fn_send=dist.send):
+    tensor_header, tensor_header_ext = headers
+    results = []
+    results.append(fn_send(tensor=tensor_header, dst=dst, tag=tag_base+TAG_FRAME_HEADER))
+    if len(tensor_header_ext) > 0:
+        results.append(fn_send(tensor=tensor_header_ext, dst=dst,
+                               tag=tag_base+TAG_FRAME_HEADER_EXT))
+    for tensor in tensors:
+        results.append(fn_send(tensor=tensor, dst=dst, tag=tag_base+TAG_TENSOR))
+    return results
+
+
+def _recv_frame(tensor_header, tag_base, pool=None, shm_ring=None):
+    """
+    Receive the remainder of a frame, given its (already received) fixed-length header.
+
+    Returns the tensors, their pickled sizes, the buffers that were received into, and the number
+    of bytes that were received (including the header).
+    Frames with `FRAME_FLAG_SHM` are read from `shm_ring`.
+    """
+    src = int(tensor_header[_FRAME_SRC])
+    header_len = int(tensor_header[_FRAME_LEN])
+    wire_bytes = _nbytes((tensor_header,))
+    if header_len > FRAME_HEADER_LEN:
+        tensor_header_ext = torch.zeros(header_len - FRAME_HEADER_LEN, dtype=torch.long)
+        dist.recv(tensor=tensor_header_ext, src=src, tag=tag_base+TAG_FRAME_HEADER_EXT)
+        tensor_header = torch.cat((tensor_header, tensor_header_ext))
+        wire_bytes += _nbytes((tensor_header_ext,))
+    header = tensor_header[:header_len].tolist()
+    records = []
+    tensor_sizes = ()
+    idx = _FRAME_RECORDS
+    while idx < header_len:
+        tensor_size, dtype, shape_len = header[idx:idx+3]
+        records.append((TORCH_TYPES[dtype], header[idx+3:idx+3+shape_len]))
+        tensor_sizes += (tensor_size,)
+        idx += 3 + shape_len
+    if header[_FRAME_FLAGS] & FRAME_FLAG_PACKED:
+        _, nbytes = _pack_layout(records)
+        buf = _empty((nbytes,), torch.uint8, pool=pool)
+        if header[_FRAME_FLAGS] & FRAME_FLAG_SHM:
+            shm_ring.read_into(buf)
+            wire_bytes += nbytes
+        elif header[_FRAME_FLAGS] & FRAME_FLAG_ZLIB:
+            data = torch.empty(header[_FRAME_DATA_BYTES], dtype=torch.uint8)
+            dist.recv(tensor=data, src=src, tag=tag_base+TAG_TENSOR)
+            wire_bytes += len(data)
+            codec_name = codec.CODEC_SHUFFLE_ZLIB if header[_FRAME_FLAGS] & FRAME_FLAG_SHUFFLE \
+                else codec.CODEC_ZLIB
+            codec.decompress(codec_name, data, buf, _pack_segments(records))
+        elif nbytes > 0:
+            dist.recv(tensor=buf, src=src, tag=tag_base+TAG_TENSOR)
+            wire_bytes += nbytes
+        return _unpack_tensors(buf, records), tensor_sizes, (buf,), wire_bytes
+    tensors = ()
+    for dtype, shape in records:
+        tensor = _empty(shape, dtype, pool=pool)
+        dist.recv(tensor=tensor, src=src, tag=tag_base+TAG_TENSOR)
+        tensors += (tensor,)
+    return tensors, tensor_sizes, tensors, wire_bytes + _nbytes(tensors)
+
+
+def _payload_to_tensors(payload):
+    # Avoids pickling tensors if payload is a Tensor or Tuple[Tensor, ...]
+    if isinstance(payload, tuple):
+        objs = payload
+        tensor_count = len(objs)
+    else:
+        objs = (payload,)
+        tensor_count = -1
+    # pickle as needed
+    tensors = ()
+    tensor_sizes = ()
+    for obj in objs:
+        if isinstance(obj, torch.Tensor):
+            tensor, tensor_size = obj, -1
+        else:
+            tensor, tensor_size = util.object_to_tensor(obj, None)
+            tensor_size = int(tensor_size)
+        tensors += (tensor,)
+        tensor_sizes += (tensor_size,)
+    return tensor_count, tensors, tensor_sizes
+
+
+def _tensors_to_payload(tensor_count, tensors, tensor_sizes):
+    # unpickle as needed
+    objs = ()
+    for tensor, tensor_size in zip(tensors, tensor_sizes):
+        obj = tensor if tensor_size < 0 else util.tensor_to_object(tensor, tensor_size)
+        objs += (obj,)
+    # if tensor_count >= 0, then the original payload was a tuple
+    return objs if tensor_count >= 0 else objs[0]
+
+
+def _ranks_list(ranks):
+    return [ranks] if isinstance(ranks, int) else list(ranks)
+
+
+def _link_codecs(codec_name, ranks):
+    """Get the codec name for each rank, given one for all ranks or a mapping by rank."""
+    if isinstance(codec_name, str):
+        return { rank: codec_name for rank in ranks }
+    return { rank: codec_name.get(rank, codec.CODEC_NONE) for rank in ranks }
+
+
+def _replica_peer(peers, replica, seq):
+    """Get the peer rank for a replica's `seq`-th payload, given round-robin distribution."""
+    # Microbatch c is processed by replica (c % replicas) of each stage, so a replica's payloads
+    # are microbatches c = index + seq * replicas, and peer replica (c % len(peers)) handles them.
+    index, replicas = replica
+    return peers[(index + seq * replicas) % len(peers)]
+
+
+_tls_exchange = threading.local()
+
+def last_wire_bytes() -> Optional[int]:
+    """
+    Get the number of bytes sent or received for the calling thread's last payload.
+
+    Intended for use in send/recv post hooks, when the payload's tensors (the logical data) may
+    differ in size from the data that was actually exchanged, e.g., due to compression.
+    """
+    return getattr(_tls_exchange, 'wire_bytes', None)
+
+
 class AbstractTensorExchangeThread(threading.Thread):
     """Abstract tensor exchange thread."""
 
@@ -147,18 +480,62 @@ class AbstractTensorExchangeThread(threading.Thread):
         for hook, args in self._pre_hooks:
             hook(*args)
 
-    def _call_post_hooks(self, tensors):
+    def _call_post_hooks(self, tensors, wire_bytes=None):
+        _tls_exchange.wire_bytes = wire_bytes
         for hook, args in self._post_hooks:
             hook(tensors, *args)
 
 
 class TensorSendThread(AbstractTensorExchangeThread):
-    """Thread for sending tensors."""
+    """
+    Thread for sending tensors.
+
+    Given multiple `dst_rank`s (replicas of the next stage), payloads are distributed round-robin
+    based on this rank's `replica` index and the number of replicas in its own stage.
+
+    With `use_shm=True` (and a frame-based `protocol`), payload data for co-located receivers is
+    packed directly into shared memory, and only the frame header is sent as a message.
+    Co-location is detected with a handshake: the receiver replies whether it could open the
+    shared memory ring that's named in a hello frame.
+    The receiver notifies each slot it frees with a message, which is only waited for when the
+    ring is full.
+
+    With `window=1`, each payload is sent with blocking sends before the next one is dequeued.
+    With `window>1`, sends are asynchronous and up to `window` payloads may be in flight at once.
+    Payloads complete in order, and hooks wrap the time each payload spends at the head of the
+    window, i.e., until its send completes after the previous payload's send completed.
+
+    With a `codec_name` (and the packed `protocol`), packed buffers are compressed while
+    compression pays off, as measured by a `codec.CodecController` for each link.
+    A mapping selects the codec for each link by dst rank, where unmapped links aren't compressed.
+    """
 
-    def __init__(self, queue_out: ConditionQueue, dst_rank: int):
+    def __init__(self, queue_out: ConditionQueue, dst_rank: Union[int, Sequence[int]],
+                 protocol: str=PROTOCOL_TENSORS, window: int=1, replica: Tuple[int, int]=(0, 1),
+                 use_shm: bool=False,
+                 codec_name: Union[str, Mapping[int, str]]=codec.CODEC_NONE,
+                 tag_base: int=TAG_BASE_DATA):
         super().__init__()
+        self._tag_base = tag_base
         self._queue_out = queue_out
-        self._dst_rank = dst_rank
+        self._dst_ranks = _ranks_list(dst_rank)
+        self._replica = replica
+        self._seq = 0
+        self._protocol = protocol
+        self._window = window
+        # in-flight payloads, in send order: (dst, tensors, requests, pack buffer, wire bytes)
+        self._inflight = collections.deque()
+        self._t_head = None
+        # free pack buffers - at most one per window slot
+        self._bufs_pack = []
+        # shared memory rings by dst rank, or None for ranks that aren't co-located
+        self._use_shm = use_shm
+        self._shm_rings: Dict[int, Optional[shm.ShmRing]] = {}
+        self._shm_release = torch.zeros(1, dtype=torch.int)
+        self._waiter = util.DistRequestWaiter()
+        self._codec_names = _link_codecs(codec_name, self._dst_ranks)
+        self._codec_ctlrs = { dst: codec.CodecController() for dst in self._dst_ranks }
+        self._reqs_stop = []
         self._evt_stop_thread = threading.Event()
 
     def stop(self) -> None:
@@ -166,89 +543,320 @@ class TensorSendThread(AbstractTensorExchangeThread):
         with self._queue_out.condition:
             self._evt_stop_thread.set()
             self._queue_out.condition.notify_all()
+        # don't stop _waiter: a dequeued payload may still be waiting for a shared memory slot
+
+    def _send_stop(self):
+        # Tell the receivers to stop - don't wait, as they may already be gone.
+        # Keep references to the requests so their tensor remains valid.
+        if self._protocol == PROTOCOL_TENSORS:
+            tensor_stop = torch.tensor(TENSOR_COUNT_STOP, dtype=torch.int)
+            tag = self._tag_base+TAG_TENSOR_COUNT
+        else:
+            tensor_stop, _ = _frame_headers((), (), TENSOR_COUNT_STOP)
+            tag = self._tag_base+TAG_FRAME_HEADER
+        self._reqs_stop = [dist.isend(tensor=tensor_stop, dst=dst, tag=tag)
+                           for dst in self._dst_ranks]
+        for ring in self._shm_rings.values():
+            if ring is not None:
+                ring.unlink()
+
+    def _shm_ring(self, dst, nbytes):
+        """Get the shared memory ring for a dst, which is created and offered on first use."""
+        if dst not in self._shm_rings:
+            # leave room for payloads to grow, e.g., with pickled objects - larger ones use gloo
+            ring = shm.ShmRing.create(SHM_SLOTS, max(2 * nbytes, SHM_SLOT_BYTES_MIN))
+            path = torch.tensor(list(ring.path.encode()), dtype=torch.uint8)
+            headers = _frame_headers((path,), (-1,), 0, flags=FRAME_FLAG_SHM_HELLO)
+            _send_frame(headers, (path,), dst, self._tag_base)
+            reply = torch.zeros(1, dtype=torch.int)
+            dist.recv(tensor=reply, src=dst, tag=self._tag_base+TAG_SHM_REPLY)
+            if not reply[0]:
+                ring.unlink()
+                ring = None
+            self._shm_rings[dst] = ring
+        return self._shm_rings[dst]
+
+    def _shm_wait_release(self, dst):
+        """Wait for a dst to notify that it freed a shared memory slot; raises if dst is gone."""
+        req = dist.irecv(tensor=self._shm_release, src=dst, tag=self._tag_base+TAG_SHM_RELEASE)
+        return self._waiter.wait(req)
+
+    def _dequeue(self, block=True):
+        with self._queue_out.condition:
+            while self._queue_out.empty():
+                if self._evt_stop_thread.is_set() or not block:
+                    return None
+                self._queue_out.condition.wait()
+            payload = self._queue_out.get(block=False)
+            self._queue_out.condition.notify_all()
+        return payload
+
+    def _pack(self, tensors):
+        # pack buffers are reused (and grown as needed) once their sends complete
+        buf_free = self._bufs_pack.pop() if len(self._bufs_pack) > 0 else None
+        buf = _pack_tensors(tensors, buf=buf_free)
+        if buf_free is not None and buf.data_ptr() == buf_free.data_ptr():
+            # keep the full buffer, not just the view
+            return buf, buf_free
+        return buf, buf
+
+    def _start_head(self):
+        # the payload's send is now at the head of the window (trivially so if not windowed)
+        self._t_head = time.monotonic()
+        self._call_pre_hooks()
+
+    def _complete_head(self, dst, tensors, wire_bytes):
+        self._codec_ctlrs[dst].observe_send(wire_bytes, time.monotonic() - self._t_head)
+        self._call_post_hooks(tensors, wire_bytes=wire_bytes)
+
+    def _encode(self, dst, buf, tensors):
+        """Maybe compress a packed buffer, return the data to send and frame header flags."""
+        codec_name = self._codec_names[dst]
+        codec_ctlr = self._codec_ctlrs[dst]
+        if codec_name == codec.CODEC_NONE or len(buf) == 0 or not codec_ctlr.enabled():
+            return buf, 0
+        t_start = time.monotonic()
+        segments = _pack_segments([(t.dtype, t.shape) for t in tensors])
+        data = codec.compress(codec_name, buf, segments)
+        codec_ctlr.observe_compress(len(buf), len(data), time.monotonic() - t_start)
+        if len(data) >= len(buf):
+            return buf, 0
+        return data, _FRAME_FLAGS_CODECS[codec_name]
+
+    def _send_payload(self, payload, fn_send=dist.send, pre_hooks=True):
+        """Send a payload, return its dst, tensors, requests, pack buffer (if any), wire bytes."""
+        dst = _replica_peer(self._dst_ranks, self._replica, self._seq)
+        self._seq += 1
+        tensor_count, tensors, tensor_sizes = _payload_to_tensors(payload)
+        buf_pack = None
+        reqs = []
+        ring = None
+        if self._use_shm and self._protocol != PROTOCOL_TENSORS:
+            _, nbytes = _pack_layout([(t.dtype, t.shape) for t in tensors])
+            ring = self._shm_ring(dst, nbytes)
+            if ring is not None and nbytes > ring.slot_bytes:
+                ring = None
+        if ring is not None:
+            headers = _frame_headers(tensors, tensor_sizes, tensor_count,
+                                     flags=FRAME_FLAG_PACKED | FRAME_FLAG_SHM)
+            # packing into the ring is the data transfer, so pre/post hooks wrap it and count its
+            # bytes, like a send of the packed buffer (but not any pickling work)
+            if pre_hooks:
+                self._start_head()
+            slot = ring.wait_write(nbytes, lambda: self._shm_wait_release(dst))
+            if slot is None:
+                # _waiter is only stopped after run() finishes sending
+                raise RuntimeError(f"Stopped waiting for shared memory receiver: {dst}")
+            _pack_tensors(tensors, buf=slot)
+            ring.commit_write()
+            reqs += _send_frame(headers, (), dst, self._tag_base, fn_send=fn_send)
+            wire_bytes = _nbytes(headers) + nbytes
+        elif self._protocol == PROTOCOL_FRAMED:
+            headers = _frame_headers(tensors, tensor_sizes, tensor_count)
+            # pre/post hooks should only wrap tensor send, not any pickling work (above)
+            if pre_hooks:
+                self._start_head()
+            reqs += _send_frame(headers, tensors, dst, self._tag_base, fn_send=fn_send)
+            wire_bytes = _nbytes(headers) + _nbytes(tensors)
+        elif self._protocol == PROTOCOL_PACKED:
+            buf, buf_pack = self._pack(tensors)
+            data, flags = self._encode(dst, buf, tensors)
+            headers = _frame_headers(tensors, tensor_sizes, tensor_count,
+                                     flags=FRAME_FLAG_PACKED | flags,
+                                     data_bytes=len(data) if flags else 0)
+            # pre/post hooks should only wrap tensor send, not any pickling/packing work
+            if pre_hooks:
+                self._start_head()
+            reqs += _send_frame(headers, (data,) if len(data) > 0 else (), dst, self._tag_base,
+                                fn_send=fn_send)
+            wire_bytes = _nbytes(headers) + len(data)
+        else:
+            tensor_count = torch.tensor(tensor_count, dtype=torch.int)
+            reqs.append(fn_send(tensor=tensor_count, dst=dst, tag=self._tag_base+TAG_TENSOR_COUNT))
+            wire_bytes = _nbytes((tensor_count,))
+            # pre/post hooks should only wrap tensor send, not any pickling work (above)
+            if pre_hooks:
+                self._start_head()
+            for tensor, tensor_size in zip(tensors, tensor_sizes):
+                reqs.append(fn_send(tensor=torch.LongTensor([tensor_size]), dst=dst,
+                                    tag=self._tag_base+TAG_TENSOR_PICKLED_SIZE))
+                reqs += _send_tensor(tensor, dst, self._tag_base, fn_send=fn_send)
+                # pickled size, dtype and shape length, shape, data
+                wire_bytes += 8 + 8 + 4 * tensor.dim() + _nbytes((tensor,))
+        return dst, tensors, reqs, buf_pack, wire_bytes
+
+    def _send_payload_blocking(self, payload):
+        dst, tensors, _, buf_pack, wire_bytes = self._send_payload(payload)
+        if buf_pack is not None:
+            self._bufs_pack.append(buf_pack)
+        self._complete_head(dst, tensors, wire_bytes)
+
+    def _send_payload_async(self, payload):
+        # hooks wrap only the head of the window, so they're never interleaved across payloads
+        is_head = len(self._inflight) == 0
+        self._inflight.append(self._send_payload(payload, fn_send=dist.isend, pre_hooks=is_head))
+
+    def _retire_payload(self):
+        dst, tensors, reqs, buf_pack, wire_bytes = self._inflight.popleft()
+        for req in reqs:
+            req.wait()
+        if buf_pack is not None:
+            self._bufs_pack.append(buf_pack)
+        self._complete_head(dst, tensors, wire_bytes)
+        if len(self._inflight) > 0:
+            # the next payload is now at the head of the window
+            self._start_head()
+
+    def _run_window(self):
+        while not self._evt_stop_thread.is_set():
+            payload = None
+            if len(self._inflight) < self._window:
+                # only block for new payloads when there are no sends to complete
+                payload = self._dequeue(block=len(self._inflight) == 0)
+            if payload is not None:
+                self._send_payload_async(payload)
+            elif len(self._inflight) > 0:
+                self._retire_payload()
+            else:
+                break
+        while len(self._inflight) > 0:
+            self._retire_payload()
 
     def run(self):
         """Dequeue tensors and send them."""
-        while not self._evt_stop_thread.is_set():
-            with self._queue_out.condition:
-                while self._queue_out.empty():
-                    if self._evt_stop_thread.is_set():
-                        return
-                    self._queue_out.condition.wait()
-                payload = self._queue_out.get(block=False)
-                self._queue_out.condition.notify_all()
-            # Avoids pickling tensors if payload is a Tensor or Tuple[Tensor, ...]
-            if isinstance(payload, tuple):
-                objs = payload
-                tensor_count = torch.tensor(len(objs), dtype=torch.int)
-            else:
-                objs = (payload,)
-                tensor_count = torch.tensor(-1, dtype=torch.int)
-            # pickle as needed
-            tensors = ()
-            tensor_sizes = ()
-            for obj in objs:
-                if isinstance(obj, torch.Tensor):
-                    tensor, tensor_size = obj, torch.LongTensor([-1])
-                else:
-                    tensor, tensor_size = util.object_to_tensor(obj, None)
-                tensors += (tensor,)
-                tensor_sizes += (tensor_size,)
-            dist.send(tensor=tensor_count, dst=self._dst_rank, tag=TAG_BASE_DATA+TAG_TENSOR_COUNT)
-            # pre/post hooks should only wrap tensor send, not any pickling work (above)
-            self._call_pre_hooks()
-            for tensor, tensor_size in zip(tensors, tensor_sizes):
-                dist.send(tensor=tensor_size, dst=self._dst_rank,
-                          tag=TAG_BASE_DATA+TAG_TENSOR_PICKLED_SIZE)
-                _send_tensor(tensor, self._dst_rank, TAG_BASE_DATA)
-            self._call_post_hooks(tensors)
+        self._waiter.start()
+        if self._window > 1:
+            self._run_window()
+        else:
+            while not self._evt_stop_thread.is_set():
+                payload = self._dequeue()
+                if payload is None:
+                    break
+                self._send_payload_blocking(payload)
+        self._send_stop()
+        self._waiter.stop()
 
 
 class TensorRecvThread(AbstractTensorExchangeThread):
-    """Thread for receiving tensors."""
+    """
+    Thread for receiving tensors.
 
-    def __init__(self, queue_in: ConditionQueue, src_rank: int):
+    Given multiple `src_rank`s (replicas of the previous stage), payloads are received round-robin
+    based on this rank's `replica` index and the number of replicas in its own stage, which merges
+    them back into their original order.
+
+    Receivers always accept shared memory rings offered by co-located senders.
+    """
+
+    def __init__(self, queue_in: ConditionQueue, src_rank: Union[int, Sequence[int]],
+                 protocol: str=PROTOCOL_TENSORS, pool: Optional[util.TensorPool]=None,
+                 replica: Tuple[int, int]=(0, 1), tag_base: int=TAG_BASE_DATA):
         super().__init__()
+        self._tag_base = tag_base
         self._queue_in = queue_in
-        self._src_rank = src_rank
-        self._evt_stop_thread = threading.Event()
+        self._src_ranks = _ranks_list(src_rank)
+        self._replica = replica
+        self._seq = 0
+        self._protocol = protocol
+        self._pool = pool
+        self._waiter = util.DistRequestWaiter()
+        # metadata tensors are consumed before the next receive, so they're allocated only once
+        self._tensor_header = torch.zeros(FRAME_HEADER_LEN, dtype=torch.long)
+        self._tensor_count = torch.tensor(0, dtype=torch.int)
+        self._tensor_size = torch.LongTensor([-1])
+        # shared memory rings by src rank, and their in-flight slot release notifications
+        self._shm_rings: Dict[int, shm.ShmRing] = {}
+        self._shm_reqs_release: Dict[int, collections.deque] = {}
+        self._shm_release = torch.ones(1, dtype=torch.int)
 
     def stop(self) -> None:
         """Direct the thread to stop."""
-        self._evt_stop_thread.set()
+        self._waiter.stop()
+
+    def _shm_hello(self, src, tensor_header):
+        (path,), _, _, _ = _recv_frame(tensor_header, self._tag_base)
+        ring = shm.ShmRing.open(bytes(path.tolist()).decode())
+        if ring is not None:
+            # the mapping remains valid, and the file can't leak if either side dies
+            ring.unlink()
+            self._shm_rings[src] = ring
+            self._shm_reqs_release[src] = collections.deque()
+        dist.send(tensor=torch.tensor([ring is not None], dtype=torch.int), dst=src,
+                  tag=self._tag_base+TAG_SHM_REPLY)
+
+    def _recv_tensors(self):
+        src = _replica_peer(self._src_ranks, self._replica, self._seq)
+        self._seq += 1
+        if self._protocol != PROTOCOL_TENSORS:
+            tensor_header = self._tensor_header
+            while True:
+                ircv_req = dist.irecv(tensor=tensor_header, src=src,
+                                      tag=self._tag_base+TAG_FRAME_HEADER)
+                if not self._waiter.wait(ircv_req) or \
+                    tensor_header[_FRAME_COUNT] == TENSOR_COUNT_STOP:
+                    return None
+                if not int(tensor_header[_FRAME_FLAGS]) & FRAME_FLAG_SHM_HELLO:
+                    break
+                self._shm_hello(src, tensor_header)
+            # pre/post hooks should only wrap tensor recv, not any unpickling work
+            self._call_pre_hooks()
+            tensors, tensor_sizes, bufs, wire_bytes = \
+                _recv_frame(tensor_header, self._tag_base, pool=self._pool,
+                            shm_ring=self._shm_rings.get(src))
+            if int(tensor_header[_FRAME_FLAGS]) & FRAME_FLAG_SHM:
+                self._shm_release_slot(src)
+            return int(tensor_header[_FRAME_COUNT]), tensors, tensor_sizes, bufs, wire_bytes
+        tensor_count = self._tensor_count
+        ircv_req = dist.irecv(tensor=tensor_count, src=src,
+                              tag=self._tag_base+TAG_TENSOR_COUNT)
+        if not self._waiter.wait(ircv_req) or tensor_count == TENSOR_COUNT_STOP:
+            return None
+        tensors = ()
+        tensor_sizes = ()
+        wire_bytes = _nbytes((tensor_count,))
+        # pre/post hooks should only wrap tensor recv, not any unpickling work
+        self._call_pre_hooks()
+        for _ in range(abs(tensor_count)):
+            dist.recv(tensor=self._tensor_size, src=src, tag=self._tag_base+TAG_TENSOR_PICKLED_SIZE)
+            tensor = _recv_tensor(src, self._tag_base, pool=self._pool)
+            tensor_sizes += (int(self._tensor_size),)
+            tensors += (tensor,)
+            # pickled size, dtype and shape length, shape, data
+            wire_bytes += 8 + 8 + 4 * tensor.dim() + _nbytes((tensor,))
+        return int(tensor_count), tensors, tensor_sizes, tensors, wire_bytes
+
+    def _shm_release_slot(self, src):
+        """Notify a src that its shared memory slot was read, so it may be written again."""
+        reqs = self._shm_reqs_release[src]
+        if len(reqs) == self._shm_rings[src].slots:
+            # the sender can't have written the slot we just read without receiving this one
+            reqs.popleft().wait()
+        reqs.append(dist.isend(tensor=self._shm_release, dst=src,
+                               tag=self._tag_base+TAG_SHM_RELEASE))
+
+    def _lend_bufs(self, payload, bufs):
+        # Buffers for unpickled objects are free now, the rest are reclaimed after processing
+        lent = ()
+        for buf in bufs:
+            if util.shares_memory(buf, payload):
+                lent += (buf,)
+            else:
+                self._pool.release(buf)
+        if len(lent) > 0:
+            self._pool.lend(payload, lent)
 
     def run(self):
         """Receive tensors and enqueue them."""
+        self._waiter.start()
         while True:
-            tensor_count = torch.tensor(0, dtype=torch.int)
-            ircv_req = dist.irecv(tensor=tensor_count, src=self._src_rank,
-                                  tag=TAG_BASE_DATA+TAG_TENSOR_COUNT)
-            ircv_req_t = util.DistRequestWaitDaemon(ircv_req)
-            ircv_req_t.start()
-            while ircv_req_t.is_alive():
-                if self._evt_stop_thread.is_set():
-                    return
-                # TODO: we're basically spinning...
-                time.sleep(0.001)
-            tensors = ()
-            tensor_sizes = ()
-            # pre/post hooks should only wrap tensor recv, not any unpickling work (further below)
-            self._call_pre_hooks()
-            for _ in range(abs(tensor_count)):
-                tensor_size = torch.LongTensor([-1])
-                dist.recv(tensor=tensor_size, src=self._src_rank,
-                          tag=TAG_BASE_DATA+TAG_TENSOR_PICKLED_SIZE)
-                tensor = _recv_tensor(self._src_rank, TAG_BASE_DATA)
-                tensor_sizes += (tensor_size,)
-                tensors += (tensor,)
-            self._call_post_hooks(tensors)
-            # unpickle as needed
-            objs = ()
-            for tensor, tensor_size in zip(tensors, tensor_sizes):
-                obj = tensor if tensor_size < 0 else util.tensor_to_object(tensor, tensor_size)
-                objs += (obj,)
-            # if tensor_count >= 0, then the original payload was a tuple
-            payload = objs if tensor_count >= 0 else objs[0]
+            received = self._recv_tensors()
+            if received is None:
+                return
+            tensor_count, tensors, tensor_sizes, bufs, wire_bytes = received
+            self._call_post_hooks(tensors, wire_bytes=wire_bytes)
+            payload = _tensors_to_payload(tensor_count, tensors, tensor_sizes)
+            if self._pool is not None:
+                self._lend_bufs(payload, bufs)
             # Blocks if queue is full, which then blocks receiving more tensors (as intended)
             # Worker thread must be running to avoid indefinite blocking
             with self._queue_in.condition:
@@ -258,14 +866,45 @@ class TensorRecvThread(AbstractTensorExchangeThread):
                 self._queue_in.condition.notify_all()
 
 
+class WorkSequencer:
+    """
+    Preserves payload order across `TensorWorkThread`s that share inbound and outbound queues.
+
+    Payloads are numbered as they're dequeued, and each thread waits for its turn to enqueue.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # seq_in is only accessed while holding the inbound queue's condition
+        self.seq_in = 0
+        self.seq_out = 0
+
+    def wait_turn(self, seq: int) -> None:
+        """Wait until all prior payloads are enqueued (or dropped)."""
+        with self.condition:
+            while self.seq_out != seq:
+                self.condition.wait()
+
+    def end_turn(self) -> None:
+        """Let the next payload be enqueued."""
+        with self.condition:
+            self.seq_out += 1
+            self.condition.notify_all()
+
+
 class TensorWorkThread(threading.Thread):
     """Thread for processing tensors."""
 
-    def __init__(self, queue_in: ConditionQueue, queue_out: ConditionQueue, callback: Callable):
+    def __init__(self, queue_in: ConditionQueue, queue_out: ConditionQueue, callback: Callable,
+                 pool: Optional[util.TensorPool]=None, sequencer: Optional[WorkSequencer]=None,
+                 num_threads: Optional[int]=None):
         super().__init__()
         self._queue_in = queue_in
         self._queue_out = queue_out
         self._callback = callback
+        self._pool = pool
+        self._sequencer = sequencer
+        self._num_threads = num_threads
         self._evt_stop_thread = threading.Event()
 
     def stop(self) -> None:
@@ -276,6 +915,9 @@ class TensorWorkThread(threading.Thread):
 
     def run(self):
         """Dequeue, process, enqueue."""
+        if self._num_threads is not None:
+            # torch's intra-op parallelism setting is thread-local for OpenMP builds
+            torch.set_num_threads(self._num_threads)
         # Empty inbound queue before stopping
         while True:
             with self._queue_in.condition:
@@ -284,8 +926,16 @@ class TensorWorkThread(threading.Thread):
                         return
                     self._queue_in.condition.wait()
                 tensor_in = self._queue_in.get(block=False)
+                if self._sequencer is not None:
+                    seq = self._sequencer.seq_in
+                    self._sequencer.seq_in += 1
                 self._queue_in.condition.notify_all()
             tensor_out = self._callback(tensor_in)
+            if self._pool is not None:
+                # Recycle received buffers, unless they're (still) referenced by the outputs
+                self._pool.reclaim(tensor_in, tensor_out)
+            if self._sequencer is not None:
+                self._sequencer.wait_turn(seq)
             if tensor_out is not None:
                 # Sender thread must be running to avoid indefinite blocking
                 with self._queue_out.condition:
@@ -293,41 +943,63 @@ class TensorWorkThread(threading.Thread):
                         self._queue_out.condition.wait()
                     self._queue_out.put(tensor_out)
                     self._queue_out.condition.notify_all()
+            if self._sequencer is not None:
+                self._sequencer.end_turn()
 
 
 class CommandThread(threading.Thread):
-    """Thread for receiving commands."""
+    """Thread for receiving commands, which are forwarded down the broadcast tree first."""
 
-    def __init__(self, callback: DistCmdHandler):
+    def __init__(self, callback: DistCmdHandler, protocol: str=PROTOCOL_TENSORS):
         super().__init__()
         self._callback = callback
-        self._evt_stop_thread = threading.Event()
+        self._protocol = protocol
+        self._waiter = util.DistRequestWaiter()
 
     def stop(self) -> None:
         """Direct the thread to stop."""
-        self._evt_stop_thread.set()
+        self._waiter.stop()
+
+    def _recv_cmd_framed(self):
+        tensor_header = torch.zeros(FRAME_HEADER_LEN, dtype=torch.long)
+        ircv_req = dist.irecv(tensor=tensor_header, tag=TAG_BASE_CMD+TAG_FRAME_HEADER)
+        if not self._waiter.wait(ircv_req):
+            return None
+        # the header identifies its src, so the remaining frame isn't received from just any rank
+        tensors, _, _, _ = _recv_frame(tensor_header, TAG_BASE_CMD)
+        return int(tensor_header[_FRAME_CMD]), tensors, int(tensor_header[_FRAME_ROOT])
+
+    def _recv_cmd(self):
+        # contains (1) CMD enumeration, (2) an optional tensor count, and (3) the root rank
+        tensor_cmd = torch.zeros(3, dtype=torch.int)
+        ircv_req = dist.irecv(tensor=tensor_cmd, tag=TAG_BASE_CMD)
+        if not self._waiter.wait(ircv_req):
+            return None
+        cmd = int(tensor_cmd[0])
+        _tensor_count = int(tensor_cmd[1])
+        tensors = ()
+        for _ in range(_tensor_count):
+            # it would be nice if we could restrict src to the prior request's src, but the
+            # ircv_req "distributed request object" API doesn't document a src property to use
+            tensor = _recv_tensor(None, TAG_BASE_CMD)
+            tensors += (tensor,)
+        return cmd, tensors, int(tensor_cmd[2])
 
     def run(self):
         """Listen for commands."""
+        self._waiter.start()
         while True:
-            # contains (1) CMD enumeration and (2) an optional tensor count
-            tensor_cmd = torch.zeros(2, dtype=torch.int)
-            ircv_req = dist.irecv(tensor=tensor_cmd, tag=TAG_BASE_CMD)
-            ircv_req_t = util.DistRequestWaitDaemon(ircv_req)
-            ircv_req_t.start()
-            while ircv_req_t.is_alive():
-                if self._evt_stop_thread.is_set():
-                    return
-                # TODO: we're basically spinning...
-                time.sleep(0.1)
-            cmd = int(tensor_cmd[0])
-            _tensor_count = int(tensor_cmd[1])
-            tensors = ()
-            for _ in range(_tensor_count):
-                # it would be nice if we could restrict src to the prior request's src, but the
-                # ircv_req "distributed request object" API doesn't document a src property to use
-                tensor = _recv_tensor(None, TAG_BASE_CMD)
-                tensors += (tensor,)
+            if self._protocol != PROTOCOL_TENSORS:
+                received = self._recv_cmd_framed()
+            else:
+                received = self._recv_cmd()
+            if received is None:
+                return
+            cmd, tensors, root = received
+            # forward before handling, since handling may be slow or shut down the context
+            dsts = tree_children(dist.get_rank(), root, dist.get_world_size())
+            for req in _send_cmd(self._protocol, cmd, tensors, root, dsts):
+                req.wait()
             self._callback(cmd, tensors)
 
 
@@ -351,47 +1023,139 @@ class DistP2pPipelineStage:
 
     Ranks that do nothing may specify `None` for all parameters.
 
+    A stage may be replicated across ranks for data parallelism.
+    Microbatch `c` is processed by replica `c % replicas` of each stage, so stages distribute
+    payloads to the next stage's replicas and merge them from the previous stage's replicas in
+    round-robin order.
+
     Parameters
     ----------
-    rank_src : Optional[int]
-        The rank to receive tensors from.
-    rank_dst : Optional[int]
-        The rank to send tensors to.
+    rank_src : Optional[Union[int, Sequence[int]]]
+        The rank(s) to receive tensors from (replicas of the previous stage, in replica order).
+    rank_dst : Optional[Union[int, Sequence[int]]]
+        The rank(s) to send tensors to (replicas of the next stage, in replica order).
     work_cb : Optional[Callable]
         The worker callback - if None, received tensors are sent without modification.
     results_cb : Optional[Callable]
         The results callback.
+    protocol : str
+        The wire protocol for data, one of `PROTOCOLS` (must be the same on all ranks).
+    queue_depths : Optional[Mapping[str, int]]
+        Maximum sizes of the inbound ('in'), outbound ('out'), and results ('res') queues.
+        Deeper queues absorb more variance in processing and communication times, at the expense
+        of memory. Unspecified queues use `QUEUE_DEPTH_DEFAULT`.
+    recv_pool_size : int
+        Maximum number of free receive buffers kept for reuse once the worker thread has consumed
+        them, or 0 to disable reuse.
+        Buffers are only reused when received data is processed by the worker thread.
+    send_window : int
+        Maximum number of payloads with sends in flight at once.
+        Larger windows help fill high-latency links, at the expense of memory.
+    work_threads : int
+        Number of worker threads that call `work_cb` concurrently, which must be thread-safe.
+        Outputs are enqueued for sending in the same order that inputs were received.
+    work_num_threads : Optional[int]
+        The `torch.set_num_threads` value for each worker thread, e.g., so that worker threads
+        divide the host's cores rather than oversubscribe them.
+    replica : Tuple[int, int]
+        This rank's replica index in its stage, and the number of replicas in its stage.
+    use_shm : bool
+        Send payload data through shared memory to co-located ranks (requires a frame-based
+        `protocol`), rather than through the process group's backend.
+    codec_name : Union[str, Mapping[int, str]]
+        The lossless compression codec for sent payload data, one of `codec.CODECS` (requires the
+        packed `protocol`), or a mapping from dst rank to codec for per-link codecs, where
+        unmapped links aren't compressed. Compression is skipped while it doesn't pay off.
+    epoch : int
+        The pipeline epoch, which must be the same on all ranks and must be incremented each time
+        the pipeline is rebuilt (e.g., with a new schedule) in the same distributed context.
     """
 
-    def __init__(self, rank_src: Optional[int], rank_dst: Optional[int],
-                 work_cb: Optional[Callable], results_cb: Optional[Callable[[Any], None]]):
+    def __init__(self, rank_src: Optional[Union[int, Sequence[int]]],
+                 rank_dst: Optional[Union[int, Sequence[int]]],
+                 work_cb: Optional[Callable], results_cb: Optional[Callable[[Any], None]],
+                 protocol: str=PROTOCOL_TENSORS, queue_depths: Optional[Mapping[str, int]]=None,
+                 recv_pool_size: int=RECV_POOL_SIZE_DEFAULT,
+                 send_window: int=SEND_WINDOW_DEFAULT, work_threads: int=WORK_THREADS_DEFAULT,
+                 work_num_threads: Optional[int]=None, replica: Tuple[int, int]=(0, 1),
+                 use_shm: bool=False,
+                 codec_name: Union[str, Mapping[int, str]]=codec.CODEC_NONE, epoch: int=0):
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"Unknown protocol: {protocol}")
+        if queue_depths is None:
+            queue_depths = {}
+        for name, depth in queue_depths.items():
+            if name not in QUEUE_NAMES:
+                raise ValueError(f"Unknown queue: {name}")
+            if depth < 1:
+                raise ValueError(f"Queue depth must be > 0, but {name}={depth}")
+        if recv_pool_size < 0:
+            raise ValueError(f"Receive pool size must be >= 0, but recv_pool_size={recv_pool_size}")
+        if send_window < 1:
+            raise ValueError(f"Send window must be > 0, but send_window={send_window}")
+        if work_threads < 1:
+            raise ValueError(f"Work threads must be > 0, but work_threads={work_threads}")
+        if work_num_threads is not None and work_num_threads < 1:
+            raise ValueError(f"Work thread torch threads must be > 0, but "
+                             f"work_num_threads={work_num_threads}")
+        if use_shm and protocol == PROTOCOL_TENSORS:
+            raise ValueError(f"Shared memory requires a frame-based protocol, not: {protocol}")
+        codec_names = [codec_name] if isinstance(codec_name, str) else codec_name.values()
+        for name in codec_names:
+            if name not in codec.CODECS:
+                raise ValueError(f"Unknown codec: {name}")
+            if name != codec.CODEC_NONE and protocol != PROTOCOL_PACKED:
+                raise ValueError(f"Compression requires the packed protocol, not: {protocol}")
+        if epoch < 0:
+            raise ValueError(f"Epoch must be >= 0, but epoch={epoch}")
+        if not 0 <= replica[0] < replica[1]:
+            raise ValueError(f"Replica index must be in [0, {replica[1]}), but "
+                             f"replica={replica[0]}")
         self._initialized = False
         self._queues = {}
         self._threads = {}
-        self._create_stage(rank_src, rank_dst, work_cb, results_cb)
-
-    def _create_stage(self, rank_src, rank_dst, work_cb, results_cb):
-        self._queues['in'] = ConditionQueue(maxsize=1)
-        self._queues['out'] = ConditionQueue(maxsize=1)
-        self._queues['res'] = ConditionQueue(maxsize=1)
+        self._create_stage(rank_src, rank_dst, work_cb, results_cb, protocol, queue_depths,
+                           recv_pool_size, send_window, work_threads, work_num_threads, replica,
+                           use_shm, codec_name, TAG_BASE_DATA + TAG_EPOCH_STRIDE * epoch)
+
+    def _create_stage(self, rank_src, rank_dst, work_cb, results_cb, protocol, queue_depths,
+                      recv_pool_size, send_window, work_threads, work_num_threads, replica,
+                      use_shm, codec_name, tag_base):
+        for name in QUEUE_NAMES:
+            maxsize = queue_depths.get(name, QUEUE_DEPTH_DEFAULT)
+            self._queues[name] = ConditionQueue(maxsize=maxsize)
+
+        # Received data must be consumed by the worker thread, which then recycles the buffers
+        pool = None
+        if rank_src is not None and work_cb is not None and results_cb is None and \
+            recv_pool_size > 0:
+            pool = util.TensorPool(recv_pool_size)
 
         if work_cb is None:
             # Short-circuit from the inbound queue (can relay data without a worker thread)
             self._queues['out'] = self._queues['in']
         else:
-            self._threads['work'] = TensorWorkThread(self._queues['in'], self._queues['out'],
-                                                     work_cb)
+            sequencer = WorkSequencer() if work_threads > 1 else None
+            for work_idx in range(work_threads):
+                name = 'work' if work_idx == 0 else f'work{work_idx}'
+                self._threads[name] = TensorWorkThread(self._queues['in'], self._queues['out'],
+                                                       work_cb, pool=pool, sequencer=sequencer,
+                                                       num_threads=work_num_threads)
 
         if results_cb is not None:
             queue_res = self._queues['out'] if rank_dst is None else self._queues['res']
             self._threads['res'] = TensorWorkThread(queue_res, None, results_cb)
 
         if rank_dst is not None:
-            self._threads['send'] = TensorSendThread(self._queues['out'], rank_dst)
+            self._threads['send'] = TensorSendThread(self._queues['out'], rank_dst,
+                                                     protocol=protocol, window=send_window,
+                                                     replica=replica, use_shm=use_shm,
+                                                     codec_name=codec_name, tag_base=tag_base)
 
         if rank_src is not None:
             queue_in = self._queues['in'] if results_cb is None else self._queues['res']
-            self._threads['recv'] = TensorRecvThread(queue_in, rank_src)
+            self._threads['recv'] = TensorRecvThread(queue_in, rank_src, protocol=protocol,
+                                                     pool=pool, replica=replica, tag_base=tag_base)
 
     def init(self) -> None:
         """Initialize the distributed context and threads."""
@@ -408,6 +1172,10 @@ class DistP2pPipelineStage:
             thr.stop()
             thr.join()
 
+    def queue_occupancy(self) -> Dict[str, int]:
+        """Get the approximate number of payloads in each queue (some queues may be shared)."""
+        return { name: que.qsize() for name, que in self._queues.items() }
+
     def register_recv_pre_hook(self, hook: Callable[..., None], args: tuple) -> None:
         """Register a pre hook for tensor receive with signature: `hook(*args)`."""
         thr = self._threads.get('recv')
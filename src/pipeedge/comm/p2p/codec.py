@@ -0,0 +1,108 @@
+"""Lossless compression codecs for packed payload buffers."""
+from typing import List, Optional, Tuple
+import zlib
+import numpy as np
+import torch
+
+CODEC_NONE = 'none'
+CODEC_ZLIB = 'zlib'
+# Byte-shuffling groups the bytes of multi-byte elements by significance (e.g., float exponents
+# together), which is usually much more compressible than interleaved bytes.
+CODEC_SHUFFLE_ZLIB = 'shuffle-zlib'
+CODECS = [CODEC_NONE, CODEC_ZLIB, CODEC_SHUFFLE_ZLIB]
+
+# Favor speed over compression ratio
+ZLIB_LEVEL = 1
+
+# A segment is a packed tensor's (byte offset, element size, element count)
+Segment = Tuple[int, int, int]
+
+
+def _shuffle(arr: np.ndarray, segments: List[Segment], inverse: bool=False) -> np.ndarray:
+    out = arr.copy()
+    for offset, itemsize, numel in segments:
+        if itemsize > 1 and numel > 1:
+            end = offset + itemsize * numel
+            if inverse:
+                out[offset:end] = arr[offset:end].reshape(itemsize, numel).T.ravel()
+            else:
+                out[offset:end] = arr[offset:end].reshape(numel, itemsize).T.ravel()
+    return out
+
+
+def compress(codec: str, buf: torch.Tensor, segments: List[Segment]) -> torch.Tensor:
+    """Compress a packed byte buffer."""
+    arr = buf.numpy()
+    if codec == CODEC_SHUFFLE_ZLIB:
+        arr = _shuffle(arr, segments)
+    elif codec != CODEC_ZLIB:
+        raise ValueError(f"Unknown codec: {codec}")
+    data = zlib.compress(arr, ZLIB_LEVEL)
+    return torch.from_numpy(np.frombuffer(bytearray(data), dtype=np.uint8))
+
+
+def decompress(codec: str, data: torch.Tensor, buf: torch.Tensor,
+               segments: List[Segment]) -> None:
+    """Decompress data into a packed byte buffer."""
+    arr = np.frombuffer(zlib.decompress(data.numpy()), dtype=np.uint8)
+    if codec == CODEC_SHUFFLE_ZLIB:
+        arr = _shuffle(arr, segments, inverse=True)
+    elif codec != CODEC_ZLIB:
+        raise ValueError(f"Unknown codec: {codec}")
+    np.copyto(buf.numpy(), arr)
+
+
+class CodecController:
+    """
+    Decides whether compression pays off, based on measured costs and benefits.
+
+    Compression pays off when the time to compress a byte is less than the time that's saved by
+    sending fewer bytes, i.e., `compress_s_per_byte < (1 - ratio) * send_s_per_byte`, where `ratio`
+    is the compressed size relative to the original size.
+    Measurements are exponentially-weighted moving averages.
+    While compression doesn't pay off, it's still attempted periodically in case conditions change.
+    """
+
+    def __init__(self, alpha: float=0.1, ratio_max: float=0.9, probe_interval: int=32):
+        self._alpha = alpha
+        self._ratio_max = ratio_max
+        self._probe_interval = probe_interval
+        self._ratio: Optional[float] = None
+        self._compress_s_per_byte: Optional[float] = None
+        self._send_s_per_byte: Optional[float] = None
+        self._skipped = 0
+
+    def _ewma(self, avg: Optional[float], val: float) -> float:
+        return val if avg is None else (1 - self._alpha) * avg + self._alpha * val
+
+    def pays_off(self) -> bool:
+        """Check if compression currently pays off."""
+        if self._ratio is None:
+            return True
+        if self._ratio > self._ratio_max:
+            return False
+        if self._send_s_per_byte is None:
+            return True
+        return self._compress_s_per_byte < (1 - self._ratio) * self._send_s_per_byte
+
+    def enabled(self) -> bool:
+        """Check if the next buffer should be compressed."""
+        if self.pays_off():
+            self._skipped = 0
+            return True
+        self._skipped += 1
+        if self._skipped >= self._probe_interval:
+            self._skipped = 0
+            return True
+        return False
+
+    def observe_compress(self, nbytes: int, nbytes_compressed: int, seconds: float) -> None:
+        """Record a compression measurement."""
+        if nbytes > 0:
+            self._ratio = self._ewma(self._ratio, nbytes_compressed / nbytes)
+            self._compress_s_per_byte = self._ewma(self._compress_s_per_byte, seconds / nbytes)
+
+    def observe_send(self, nbytes: int, seconds: float) -> None:
+        """Record a send measurement."""
+        if nbytes > 0:
+            self._send_s_per_byte = self._ewma(self._send_s_per_byte, seconds / nbytes)
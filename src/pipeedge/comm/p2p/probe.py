@@ -0,0 +1,110 @@
+"""Measure link bandwidth and latency between ranks with P2P communication."""
+import random
+import statistics
+import time
+from typing import List, Optional, Sequence, Tuple
+import torch
+import torch.distributed as dist
+from . import TAG_BASE_PROBE, TAG_TENSOR
+
+# A link measurement: (src rank, dst rank, round-trip time (seconds), bandwidth (Mbps))
+LinkMeasurement = Tuple[int, int, float, float]
+
+# Default message sizes for measuring bandwidth - large messages amortize per-message overheads
+MSG_BYTES_DEFAULT = [1024 * 1024, 8 * 1024 * 1024]
+ITERS_DEFAULT = 5
+
+
+def round_robin_pairings(world_size: int) -> List[List[Tuple[int, int]]]:
+    """
+    Get rounds of rank pairs, where each round's pairs are disjoint (can be measured in parallel).
+
+    Every pair of ranks appears exactly once across the `world_size - 1` rounds (or `world_size`
+    rounds if `world_size` is odd), using the circle method.
+    """
+    ranks: List[Optional[int]] = list(range(world_size))
+    if world_size % 2 == 1:
+        # a rank paired with None sits out the round
+        ranks.append(None)
+    num = len(ranks)
+    rounds = []
+    for _ in range(num - 1):
+        pairs = [(ranks[i], ranks[num - 1 - i]) for i in range(num // 2)]
+        rounds.append([(min(p), max(p)) for p in pairs if None not in p])
+        # rotate all but the first rank
+        ranks = [ranks[0], ranks[-1]] + ranks[1:-1]
+    return rounds
+
+
+def sample_pairings(rounds: List[List[Tuple[int, int]]], fraction: float, seed: int=0) -> \
+    List[List[Tuple[int, int]]]:
+    """
+    Randomly sample a fraction of pairs from rounds, dropping rounds that become empty.
+
+    All ranks must use the same `seed` so that they agree on the sample.
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError(f"Sample fraction must be in (0, 1], but fraction={fraction}")
+    rand = random.Random(seed)
+    sampled = [[pair for pair in pairs if rand.random() < fraction] for pairs in rounds]
+    return [pairs for pairs in sampled if len(pairs) > 0]
+
+
+def _ping_pong(peer: int, initiator: bool, tensor: torch.Tensor, ack: torch.Tensor) -> float:
+    """Initiator sends `tensor` and waits for `ack`, returns elapsed time (initiator only)."""
+    if initiator:
+        t_start = time.perf_counter()
+        dist.send(tensor=tensor, dst=peer, tag=TAG_BASE_PROBE+TAG_TENSOR)
+        dist.recv(tensor=ack, src=peer, tag=TAG_BASE_PROBE+TAG_TENSOR)
+        return time.perf_counter() - t_start
+    dist.recv(tensor=tensor, src=peer, tag=TAG_BASE_PROBE+TAG_TENSOR)
+    dist.send(tensor=ack, dst=peer, tag=TAG_BASE_PROBE+TAG_TENSOR)
+    return 0
+
+
+def probe_link(peer: int, initiator: bool, msg_bytes: Sequence[int]=None,
+               iters: int=ITERS_DEFAULT) -> Tuple[float, float]:
+    """
+    Measure the link to `peer`, which must simultaneously call this function as the non-initiator.
+
+    Returns the median round-trip time (seconds) and the bandwidth (Mbps) from the initiator to the
+    peer, which is the best bandwidth across message sizes after subtracting the round-trip time.
+    Results are only meaningful on the initiator.
+    """
+    if msg_bytes is None:
+        msg_bytes = MSG_BYTES_DEFAULT
+    ack = torch.zeros(1, dtype=torch.uint8)
+    # the first exchange synchronizes the peers, so it's not measured
+    _ping_pong(peer, initiator, torch.zeros(1, dtype=torch.uint8), ack)
+    rtt = statistics.median(_ping_pong(peer, initiator, torch.zeros(1, dtype=torch.uint8), ack)
+                            for _ in range(iters))
+    bw_mbps = 0.0
+    for nbytes in msg_bytes:
+        tensor = torch.zeros(nbytes, dtype=torch.uint8)
+        elapsed = statistics.median(_ping_pong(peer, initiator, tensor, ack)
+                                    for _ in range(iters))
+        if initiator:
+            bw_mbps = max(bw_mbps, nbytes * 8 / 1000000 / max(elapsed - rtt, 1e-9))
+    return rtt, bw_mbps
+
+
+def probe_links(rounds: List[List[Tuple[int, int]]], msg_bytes: Sequence[int]=None,
+                iters: int=ITERS_DEFAULT) -> List[LinkMeasurement]:
+    """
+    Measure links in both directions for each pair in `rounds`, which all ranks must call.
+
+    Returns this rank's outbound link measurements.
+    """
+    rank = dist.get_rank()
+    measurements = []
+    for pairs in rounds:
+        for rank_a, rank_b in pairs:
+            if rank not in (rank_a, rank_b):
+                continue
+            peer = rank_b if rank == rank_a else rank_a
+            # rank_a measures its link to rank_b first, then vice versa
+            for src in (rank_a, rank_b):
+                rtt, bw_mbps = probe_link(peer, rank == src, msg_bytes=msg_bytes, iters=iters)
+                if rank == src:
+                    measurements.append((rank, peer, rtt, bw_mbps))
+    return measurements
@@ -0,0 +1,112 @@
+"""Shared memory ring buffers for exchanging data between co-located ranks."""
+import os
+import tempfile
+from typing import Callable, Optional
+import uuid
+import numpy as np
+import torch
+
+# Ring files are created in a RAM-backed file system when available
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+SHM_PREFIX = 'pipeedge-p2p-'
+
+# Ring header fields (int64), followed by the slots (at a fixed offset)
+_HDR_MAGIC = 0
+_HDR_SLOTS = 1
+_HDR_SLOT_BYTES = 2
+_HDR_WRITTEN = 3
+_HDR_LEN = 8
+_HDR_BYTES = _HDR_LEN * 8
+_MAGIC = 0x50697065456467 # "PipeEdg"
+
+
+class ShmRing:
+    """
+    A single-producer, single-consumer ring of fixed-size slots in a memory-mapped file.
+
+    The producer writes a slot, then commits it by incrementing the shared `written` counter.
+    The consumer reads the slot, then notifies the producer that the slot is free through another
+    channel (e.g., a message), so a producer with a full ring blocks rather than polls.
+    The counter is only ever written by the producer, so no locks are needed across processes.
+    Use `create()` (producer) and `open()` (consumer) rather than the constructor.
+    """
+
+    def __init__(self, path: str, mmap: np.memmap):
+        self.path = path
+        self._mmap = mmap
+        self._hdr = mmap[:_HDR_BYTES].view(np.int64)
+        self.slots = int(self._hdr[_HDR_SLOTS])
+        self.slot_bytes = int(self._hdr[_HDR_SLOT_BYTES])
+        # each side tracks its own counter locally too
+        self._count = 0
+        # slots freed by the consumer, as notified to the producer
+        self._released = 0
+
+    @classmethod
+    def create(cls, slots: int, slot_bytes: int) -> 'ShmRing':
+        """Create a new ring with a unique path (the producer side)."""
+        path = os.path.join(SHM_DIR, SHM_PREFIX + uuid.uuid4().hex)
+        mmap = np.memmap(path, dtype=np.uint8, mode='w+', shape=(_HDR_BYTES + slots * slot_bytes,))
+        hdr = mmap[:_HDR_BYTES].view(np.int64)
+        hdr[_HDR_SLOTS] = slots
+        hdr[_HDR_SLOT_BYTES] = slot_bytes
+        hdr[_HDR_WRITTEN] = 0
+        # write magic last, so a partially initialized ring is never valid
+        hdr[_HDR_MAGIC] = _MAGIC
+        return cls(path, mmap)
+
+    @classmethod
+    def open(cls, path: str) -> Optional['ShmRing']:
+        """Open an existing ring (the consumer side), or `None` if it's not accessible."""
+        # only accept paths that a producer may have created
+        if os.path.dirname(path) != SHM_DIR or not os.path.basename(path).startswith(SHM_PREFIX):
+            return None
+        try:
+            mmap = np.memmap(path, dtype=np.uint8, mode='r+')
+        except (OSError, ValueError):
+            return None
+        if len(mmap) < _HDR_BYTES or mmap[:_HDR_BYTES].view(np.int64)[_HDR_MAGIC] != _MAGIC:
+            return None
+        return cls(path, mmap)
+
+    def unlink(self) -> None:
+        """Remove the ring's file - mappings remain valid until they're closed."""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _slot(self, nbytes: int) -> torch.Tensor:
+        offset = _HDR_BYTES + (self._count % self.slots) * self.slot_bytes
+        return torch.from_numpy(self._mmap[offset:offset + nbytes])
+
+    def wait_write(self, nbytes: int,
+                   wait_release: Callable[[], bool]) -> Optional[torch.Tensor]:
+        """
+        Wait for a free slot, return a view of its first `nbytes`, or `None` if stopped.
+
+        If the ring is full, `wait_release()` must block until the consumer notifies that it freed
+        a slot, and return `False` if stopped instead.
+        Each notification is consumed only when needed, so at most `slots` are ever pending.
+        """
+        assert nbytes <= self.slot_bytes
+        while self._count - self._released >= self.slots:
+            if not wait_release():
+                return None
+            self._released += 1
+        return self._slot(nbytes)
+
+    def commit_write(self) -> None:
+        """Commit the slot from the last `wait_write()`."""
+        self._count += 1
+        self._hdr[_HDR_WRITTEN] = self._count
+
+    def read_into(self, buf: torch.Tensor) -> None:
+        """
+        Copy the next slot into a byte buffer - the slot must already be written.
+
+        The caller must then notify the producer that the slot is free.
+        """
+        assert self._count < int(self._hdr[_HDR_WRITTEN])
+        buf.copy_(self._slot(len(buf)))
+        self._count += 1
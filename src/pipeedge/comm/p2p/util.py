@@ -1,46 +1,293 @@
 """Communication utilities."""
-import io
 import pickle
+import struct
 import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
 import torch
 
 
-class DistRequestWaitDaemon(threading.Thread):
+class DistRequestWaiter(threading.Thread):
     """
-    Thread for waiting on asynchronous distributed requests.
+    Long-lived daemon thread for waiting on asynchronous distributed requests.
 
-    Parent thread should poll is_alive() to determine if the request is complete.
+    One waiter serves a sequence of requests, e.g., for a single link.
+    Parent thread calls `wait()`, which blocks on a condition until the request completes or the
+    waiter is stopped, so there's neither a thread per request nor any polling.
     """
     # This is a hack to get around is_completed() not working.
     # Using wait() blocks forever, which prevents normal threads from stopping cleanly on command.
     # See: https://github.com/pytorch/pytorch/issues/30723
 
-    def __init__(self, req):
+    def __init__(self):
         super().__init__(daemon=True)
-        self._req = req
+        self._cond = threading.Condition()
+        self._req = None
+        self._completed = False
+        self._error = None
+        self._stopped = False
+
+    def stop(self) -> None:
+        """Direct the waiter to stop, which releases a parent thread blocked in `wait()`."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def wait(self, req) -> bool:
+        """Wait for a request to complete: returns `True` if completed, `False` if stopped."""
+        with self._cond:
+            self._req = req
+            self._completed = False
+            self._cond.notify_all()
+            while not self._completed and not self._stopped:
+                self._cond.wait()
+            if self._error is not None:
+                err, self._error = self._error, None
+                raise err
+            return self._completed
 
     def run(self):
-        """Wait for request."""
-        self._req.wait()
+        """Wait for requests."""
+        while True:
+            with self._cond:
+                while self._req is None and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                req = self._req
+                self._req = None
+            # If stopped while waiting here, the daemon thread may block forever (as intended).
+            try:
+                req.wait()
+            except RuntimeError as err:
+                with self._cond:
+                    self._error = err
+            with self._cond:
+                self._completed = True
+                self._cond.notify_all()
+
+
+def _iter_tensors(obj: Any) -> Iterator[torch.Tensor]:
+    if isinstance(obj, torch.Tensor):
+        yield obj
+    elif isinstance(obj, (tuple, list)):
+        for elem in obj:
+            yield from _iter_tensors(elem)
+
+
+def _memory_range(tensor: torch.Tensor) -> Tuple[int, int]:
+    start = tensor.data_ptr()
+    if tensor.numel() == 0:
+        return start, start
+    span = sum((size - 1) * stride for size, stride in zip(tensor.shape, tensor.stride())) + 1
+    return start, start + span * tensor.element_size()
+
+
+def shares_memory(tensor: torch.Tensor, obj: Any) -> bool:
+    """Check if a CPU tensor's memory overlaps with any tensor in `obj` (e.g., a tuple payload)."""
+    start, end = _memory_range(tensor)
+    for other in _iter_tensors(obj):
+        if other.device != tensor.device:
+            continue
+        other_start, other_end = _memory_range(other)
+        if other_start < end and start < other_end:
+            return True
+    return False
+
+
+class TensorPool:
+    """
+    Thread-safe pool of recyclable tensor buffers, keyed by dtype and shape.
+
+    Buffers backing a payload are lent out with `lend()` and returned with `reclaim()` after the
+    payload is consumed, unless the consumer's outputs still reference their memory.
+    At most `max_size` free buffers are kept - any others are left to the allocator.
+    """
+
+    def __init__(self, max_size: int):
+        self._lock = threading.Lock()
+        self._max_size = max_size
+        self._free: Dict[Tuple[torch.dtype, Tuple[int, ...]], List[torch.Tensor]] = {}
+        self._free_count = 0
+        self._lent: Dict[int, Tuple[Any, Tuple[torch.Tensor, ...]]] = {}
+
+    def acquire(self, shape, dtype: torch.dtype) -> torch.Tensor:
+        """Get a buffer, which may contain stale data."""
+        key = (dtype, tuple(shape))
+        with self._lock:
+            bufs = self._free.get(key)
+            if bufs:
+                self._free_count -= 1
+                return bufs.pop()
+        return torch.empty(key[1], dtype=dtype)
+
+    def release(self, tensor: torch.Tensor) -> None:
+        """Return a buffer, which must no longer be in use."""
+        with self._lock:
+            if self._free_count < self._max_size:
+                self._free.setdefault((tensor.dtype, tuple(tensor.shape)), []).append(tensor)
+                self._free_count += 1
+
+    def lend(self, obj: Any, bufs: Tuple[torch.Tensor, ...]) -> None:
+        """Record buffers backing `obj` until it's reclaimed - `obj` is referenced until then."""
+        with self._lock:
+            self._lent[id(obj)] = (obj, bufs)
+
+    def reclaim(self, obj: Any, outputs: Optional[Any]=None) -> None:
+        """Release buffers lent with `obj`, except those whose memory is shared with `outputs`."""
+        with self._lock:
+            _, bufs = self._lent.pop(id(obj), (None, ()))
+        for buf in bufs:
+            if not shares_memory(buf, outputs):
+                self.release(buf)
+
+
+# Object codec: each item starts with a type tag byte.
+# Only the (default) pickle fallback can run arbitrary code when decoding.
+_OBJ_PICKLE = 0
+_OBJ_NONE = 1
+_OBJ_FALSE = 2
+_OBJ_TRUE = 3
+_OBJ_INT = 4 # int64
+_OBJ_FLOAT = 5 # float64
+_OBJ_STR = 6 # uint32 length, utf-8 bytes
+_OBJ_BYTES = 7 # uint32 length, bytes
+_OBJ_TUPLE = 8 # uint32 count, items
+_OBJ_LIST = 9 # uint32 count, items
+_OBJ_TENSOR = 10 # uint8 dtype, uint8 ndim, int64 shape, padding, data (aligned)
+_OBJ_ALIGN = 16
+_OBJ_TENSOR_TYPES = [ torch.float32, torch.float64, torch.complex64, torch.complex128,
+                      torch.float16, torch.bfloat16, torch.uint8, torch.int8, torch.int16,
+                      torch.int32, torch.int64, torch.bool ]
+_OBJ_TENSOR_TYPES_ENUM = { t: i for i, t in enumerate(_OBJ_TENSOR_TYPES) }
+# numpy has no bfloat16, so it's encoded/decoded as int16, which has the same size
+_OBJ_NUMPY_TYPES = [ torch.empty(0, dtype=torch.int16 if t == torch.bfloat16 else t).numpy().dtype
+                     for t in _OBJ_TENSOR_TYPES ]
+_STRUCT_U8 = struct.Struct('<B')
+_STRUCT_U32 = struct.Struct('<I')
+_STRUCT_I64 = struct.Struct('<q')
+_STRUCT_F64 = struct.Struct('<d')
+_STRUCT_TENSOR = struct.Struct('<BB')
+
+
+def _encode(obj, buf: bytearray) -> None:
+    """Encode an object, or raise `TypeError` if it (or any item) isn't supported."""
+    # check bool before int, since bool is a subclass of int
+    if obj is None:
+        buf += _STRUCT_U8.pack(_OBJ_NONE)
+    elif obj is False:
+        buf += _STRUCT_U8.pack(_OBJ_FALSE)
+    elif obj is True:
+        buf += _STRUCT_U8.pack(_OBJ_TRUE)
+    elif type(obj) is int: # pylint: disable=unidiomatic-typecheck
+        buf += _STRUCT_U8.pack(_OBJ_INT)
+        try:
+            buf += _STRUCT_I64.pack(obj)
+        except struct.error as exc:
+            raise TypeError("int out of range") from exc
+    elif type(obj) is float: # pylint: disable=unidiomatic-typecheck
+        buf += _STRUCT_U8.pack(_OBJ_FLOAT)
+        buf += _STRUCT_F64.pack(obj)
+    elif type(obj) is str: # pylint: disable=unidiomatic-typecheck
+        data = obj.encode()
+        buf += _STRUCT_U8.pack(_OBJ_STR)
+        buf += _STRUCT_U32.pack(len(data))
+        buf += data
+    elif type(obj) is bytes: # pylint: disable=unidiomatic-typecheck
+        buf += _STRUCT_U8.pack(_OBJ_BYTES)
+        buf += _STRUCT_U32.pack(len(obj))
+        buf += obj
+    elif type(obj) in (tuple, list):
+        buf += _STRUCT_U8.pack(_OBJ_TUPLE if type(obj) is tuple else _OBJ_LIST)
+        buf += _STRUCT_U32.pack(len(obj))
+        for item in obj:
+            _encode(item, buf)
+    elif isinstance(obj, torch.Tensor) and obj.dtype in _OBJ_TENSOR_TYPES_ENUM:
+        tensor = obj.detach().cpu()
+        buf += _STRUCT_U8.pack(_OBJ_TENSOR)
+        buf += _STRUCT_TENSOR.pack(_OBJ_TENSOR_TYPES_ENUM[tensor.dtype], tensor.dim())
+        for dim in tensor.shape:
+            buf += _STRUCT_I64.pack(dim)
+        buf += bytes(-len(buf) % _OBJ_ALIGN)
+        if tensor.dtype == torch.bfloat16:
+            tensor = tensor.view(torch.int16)
+        buf += tensor.contiguous().numpy().tobytes()
+    else:
+        raise TypeError(f"unsupported type: {type(obj)}")
+
+
+def _decode(mview: memoryview, offset: int) -> Tuple[Any, int]:
+    """Decode an object at an offset, return the object and the offset that follows it."""
+    tag = mview[offset]
+    offset += 1
+    if tag == _OBJ_NONE:
+        return None, offset
+    if tag == _OBJ_FALSE:
+        return False, offset
+    if tag == _OBJ_TRUE:
+        return True, offset
+    if tag == _OBJ_INT:
+        return _STRUCT_I64.unpack_from(mview, offset)[0], offset + _STRUCT_I64.size
+    if tag == _OBJ_FLOAT:
+        return _STRUCT_F64.unpack_from(mview, offset)[0], offset + _STRUCT_F64.size
+    if tag in (_OBJ_STR, _OBJ_BYTES):
+        length, = _STRUCT_U32.unpack_from(mview, offset)
+        offset += _STRUCT_U32.size
+        data = mview[offset:offset + length]
+        obj = str(data, 'utf-8') if tag == _OBJ_STR else bytes(data)
+        return obj, offset + length
+    if tag in (_OBJ_TUPLE, _OBJ_LIST):
+        count, = _STRUCT_U32.unpack_from(mview, offset)
+        offset += _STRUCT_U32.size
+        items = []
+        for _ in range(count):
+            item, offset = _decode(mview, offset)
+            items.append(item)
+        return (tuple(items) if tag == _OBJ_TUPLE else items), offset
+    if tag == _OBJ_TENSOR:
+        dtype_enum, ndim = _STRUCT_TENSOR.unpack_from(mview, offset)
+        offset += _STRUCT_TENSOR.size
+        shape = [_STRUCT_I64.unpack_from(mview, offset + i * _STRUCT_I64.size)[0]
+                 for i in range(ndim)]
+        offset += ndim * _STRUCT_I64.size
+        offset += -offset % _OBJ_ALIGN
+        np_dtype = _OBJ_NUMPY_TYPES[dtype_enum]
+        count = int(np.prod(shape, dtype=np.int64))
+        # zero-copy: the tensor shares memory with the encoded buffer
+        arr = np.frombuffer(mview, dtype=np_dtype, count=count, offset=offset).reshape(shape)
+        tensor = torch.from_numpy(arr)
+        if _OBJ_TENSOR_TYPES[dtype_enum] == torch.bfloat16:
+            tensor = tensor.view(torch.bfloat16)
+        return tensor, offset + count * np_dtype.itemsize
+    raise ValueError(f"Unknown object codec tag: {tag}")
 
 
-# Based on: torch.distributed.distributed_c10d.py:_object_to_tensor
 def object_to_tensor(obj, device):
-    """Convert a Python object to a `torch.Tensor`."""
-    bytes_io = io.BytesIO()
-    pickle.Pickler(bytes_io).dump(obj)
-    byte_storage = torch.ByteStorage.from_buffer(bytes_io.getvalue())  # type: ignore[attr-defined]
-    # Do not replace `torch.ByteTensor` or `torch.LongTensor` with torch.tensor and specifying dtype.
-    # Otherwise, it will casue 100X slowdown.
-    # See: https://github.com/pytorch/pytorch/issues/65696
-    byte_tensor = torch.ByteTensor(byte_storage).to(device)
+    """
+    Convert a Python object to a `torch.Tensor`.
+
+    Supports `None`, `bool`, `int`, `float`, `str`, `bytes`, `torch.Tensor`, and `tuple`s and
+    `list`s of these types with a compact binary codec.
+    Other objects are pickled.
+    """
+    buf = bytearray()
+    try:
+        _encode(obj, buf)
+    except TypeError:
+        buf = bytearray(_STRUCT_U8.pack(_OBJ_PICKLE))
+        buf += pickle.dumps(obj)
+    # pad so that the buffer can be reinterpreted as any tensor type, e.g., in a packed buffer
+    buf += bytes(-len(buf) % _OBJ_ALIGN)
+    byte_tensor = torch.from_numpy(np.frombuffer(buf, dtype=np.uint8)).to(device)
     local_size = torch.LongTensor([byte_tensor.numel()]).to(device)
     return byte_tensor, local_size
 
 
-# Based on: torch.distributed.distributed_c10d.py:_tensor_to_object
 def tensor_to_object(tensor, tensor_size):
-    """Convert a `torch.Tensor` to a Python object."""
+    """Convert a `torch.Tensor` to a Python object - decoded tensors may share its memory."""
     tensor = tensor.cpu()
-    buf = tensor.numpy().tobytes()[:tensor_size]
-    return pickle.Unpickler(io.BytesIO(buf)).load()
+    mview = memoryview(tensor.numpy())[:tensor_size]
+    if mview[0] == _OBJ_PICKLE:
+        return pickle.loads(mview[1:])
+    obj, _ = _decode(mview, 0)
+    return obj
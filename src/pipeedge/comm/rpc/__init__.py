@@ -1,17 +1,44 @@
 """RPC communication module."""
+import copy
+import logging
+import queue
 import threading
 from typing import Any, Callable, List, Optional, Tuple, Type, Union
 import torch
 from torch import nn
 from torch.distributed import rpc
-from .. import DistCmdHandler, DistContext
+from torch.utils.hooks import RemovableHandle
+from .. import DistCmdHandler, DistContext, tree_children
 
+logger = logging.getLogger(__name__)
 
 def tensorpipe_rpc_backend_options_factory(*args, **kwargs):
     """Create a `rpc.TensorPipeRpcBackendOptions`."""
     return rpc.TensorPipeRpcBackendOptions(*args, **kwargs)
 
 
+def _cmd_tree_broadcast(remote_cmd_handler: DistCmdHandler, cmd: int,
+                        tensors: Tuple[torch.Tensor, ...], root: int, world_size: int) -> None:
+    """Forward a command to this rank's children in the broadcast tree, then handle it."""
+    rank = rpc.get_worker_info().id
+    futs = [rpc.rpc_async(dst, _cmd_tree_broadcast,
+                          args=(remote_cmd_handler, cmd, tensors, root, world_size))
+            for dst in tree_children(rank, root, world_size)]
+    remote_cmd_handler(cmd, tensors)
+    torch.futures.wait_all(futs)
+
+
+def _cmd_tree_gather(remote_fn: Callable[[], Any], root: int, world_size: int) -> List[tuple]:
+    """Gather (rank, result) pairs from this rank's subtree in the gather tree."""
+    rank = rpc.get_worker_info().id
+    futs = [rpc.rpc_async(src, _cmd_tree_gather, args=(remote_fn, root, world_size))
+            for src in tree_children(rank, root, world_size)]
+    gathered = [(rank, remote_fn())]
+    for results in torch.futures.wait_all(futs):
+        gathered += results
+    return gathered
+
+
 class DistRpcContext(DistContext):
     """The singleton distributed RPC context manager."""
 
@@ -27,106 +54,261 @@ class DistRpcContext(DistContext):
 
     def cmd_broadcast(self, remote_cmd_handler: DistCmdHandler, cmd: int,
                       tensors: Optional[Tuple[torch.Tensor, ...]]=None) -> None:
-        """Broadcast a command."""
+        """Broadcast a command, which receivers forward down a binomial tree."""
         assert self._initialized
         if tensors is None:
             tensors = ()
-        futs = []
-        for rank in range(self._world_size):
-            if rank != self._rank:
-                fut = rpc.rpc_async(rank, remote_cmd_handler, args=(cmd, tensors))
-                futs.append(fut)
+        futs = [rpc.rpc_async(dst, _cmd_tree_broadcast,
+                              args=(remote_cmd_handler, cmd, tensors, self._rank, self._world_size))
+                for dst in tree_children(self._rank, self._rank, self._world_size)]
         torch.futures.wait_all(futs)
 
+    def cmd_gather(self, remote_fn: Callable[[], Any]) -> List[Any]:
+        """Call a function on all ranks, gathering results up a binomial tree (in rank order)."""
+        assert self._initialized
+        results = [None] * self._world_size
+        for rank, result in _cmd_tree_gather(remote_fn, self._rank, self._world_size):
+            results[rank] = result
+        return results
+
+
+# Placeholder for the results of a failed microbatch in a `DistRpcResultsReorderBuffer`
+_RESULTS_SKIPPED = object()
+
+
+class DistRpcResultsReorderBuffer:
+    """
+    Deliver sequence-numbered results to a callback in sequence order.
+
+    Sequence numbers of failed microbatches are skipped (see `skip`), so they don't hold back
+    later results.
+    """
+
+    def __init__(self, results_cb: Callable[[Any], None]):
+        super().__init__()
+        self._results_cb = results_cb
+        self._lock = threading.Lock()
+        self._seq_next = 0
+        self._pending = {}
+        # only one thread delivers at a time, which keeps callbacks in order without holding _lock
+        self._delivering = False
+
+    def __call__(self, seq: int, outputs: Any) -> None:
+        """Buffer results, delivering them and any buffered successors if they're next in order."""
+        self._buffer(seq, outputs)
+
+    def skip(self, seq: int) -> None:
+        """Skip a sequence number whose results will never arrive, e.g., if processing failed."""
+        logger.warning("Skipping results for microbatch: %d", seq)
+        self._buffer(seq, _RESULTS_SKIPPED)
+
+    def _buffer(self, seq: int, outputs: Any) -> None:
+        with self._lock:
+            if seq < self._seq_next or seq in self._pending:
+                # e.g., a failure reported after the results were already delivered
+                return
+            self._pending[seq] = outputs
+            if self._delivering:
+                # the delivering thread will find these results
+                return
+            self._delivering = True
+        try:
+            while True:
+                with self._lock:
+                    if self._seq_next not in self._pending:
+                        self._delivering = False
+                        return
+                    outputs = self._pending.pop(self._seq_next)
+                    self._seq_next += 1
+                if outputs is not _RESULTS_SKIPPED:
+                    self._results_cb(outputs)
+        except Exception:
+            with self._lock:
+                self._delivering = False
+            raise
+
+
+class DistRpcCredits:
+    """
+    Credits for sending to a `DistRpcPipelineStage` without first asking if it's ready.
+
+    The receiving stage grants its credits up front, and each send consumes one credit until the
+    stage finishes with it, i.e., the credit is returned with the RPC's response.
+    If a call fails (here or in a later stage), its error is logged and its sequence number is
+    skipped by the `DistRpcResultsReorderBuffer` at `results_rref`, since its results are lost.
+    """
+
+    def __init__(self, stage_rref: rpc.RRef, results_rref: Optional[rpc.RRef]=None):
+        super().__init__()
+        self._stage_rref = stage_rref
+        self._results_rref = results_rref
+        self._sem = threading.Semaphore(value=stage_rref.rpc_sync().credits())
+
+    def _release(self, fut: torch.futures.Future, seq: int) -> None:
+        try:
+            fut.wait()
+        except Exception as exc: # pylint: disable=broad-except
+            logger.error("Stage call failed for microbatch %d: %s", seq, exc)
+            if self._results_rref is not None:
+                self._results_rref.rpc_async().skip(seq)
+        finally:
+            self._sem.release()
+
+    def send(self, inputs: Any, seq: int) -> None:
+        """Wait for a credit, then asynchronously call the stage."""
+        self._sem.acquire() # pylint: disable=consider-using-with
+        self._stage_rref.rpc_async().__call__(inputs, seq).then(
+            lambda fut: self._release(fut, seq))
+
 
 class DistRpcPipelineStage:
-    """Wrap a module that is not RPC-aware to manage threading and memory."""
-    # NOTE: message ordering is NOT enforced!
+    """
+    Wrap a module that is not RPC-aware to manage threading and memory.
+
+    Parameters
+    ----------
+    module_cls : Type[nn.Module]
+        The module class.
+    module_args : Optional[tuple]
+        Arguments for the module constructor.
+    module_kwargs : Optional[dict]
+        Keyword arguments for the module constructor.
+    num_fwd : Optional[int]
+        Maximum number of inputs that may be in this stage at once, i.e., the credits granted to the
+        previous stage (default: `3 * num_mod * module_replicas`).
+    num_mod : int
+        Maximum number of concurrent calls into each module replica.
+    module_replicas : int
+        Number of module copies, so that inputs may be processed in parallel without sharing a
+        module (at the expense of memory).
+    num_threads : Optional[int]
+        The `torch.set_num_threads` value for threads calling the module(s), e.g., so that
+        concurrent calls divide the host's cores rather than oversubscribe them.
+    """
+    # NOTE: messages may be processed out of order, but carry sequence numbers so that results can
+    # be delivered in order by a `DistRpcResultsReorderBuffer`.
 
     def __init__(self, module_cls: Type[nn.Module], module_args: Optional[tuple]=None,
-                 module_kwargs: Optional[dict]=None):
+                 module_kwargs: Optional[dict]=None, num_fwd: Optional[int]=None,
+                 num_mod: int=1, module_replicas: int=1, num_threads: Optional[int]=None):
         super().__init__()
         if module_args is None:
             module_args = ()
         if module_kwargs is None:
             module_kwargs = {}
-        # _sem_fwd limits RPC threads in forward(), and thus data memory requirements (in + out).
-        # _sem_mod limits Module thread parallelism, and thus processing memory requirements.
+        if num_mod < 1:
+            raise ValueError(f"Module concurrency must be > 0, but num_mod={num_mod}")
+        if module_replicas < 1:
+            raise ValueError(f"Module replicas must be > 0, but module_replicas={module_replicas}")
+        if num_fwd is None:
+            num_fwd = 3 * num_mod * module_replicas
+        if num_fwd < 1:
+            raise ValueError(f"Forward concurrency must be > 0, but num_fwd={num_fwd}")
+        if num_threads is not None and num_threads < 1:
+            raise ValueError(f"Module torch threads must be > 0, but num_threads={num_threads}")
+        # _credits limits RPC threads in forward(), and thus data memory requirements (in + out).
+        # Senders are granted _credits up front, so they don't ask if this stage is ready.
+        # _mod_slots limits Module thread parallelism, and thus processing memory requirements.
+        # It holds each module replica's index num_mod times, so N = num_mod * module_replicas.
         # If each stage is configured for single-thread Module processing, then N=1.
-        # Ideally, for _sem_mod value=N:
+        # Ideally, for N _mod_slots:
         # (1) N inputs are being or have been received (prior to forward() or waiting on _sem_mod)
-        # (2) N inputs are processing (acquired _sem_mod)
-        # (3) N outputs are sending or waiting to send (released _sem_mod)
+        # (2) N inputs are processing (acquired a _mod_slots entry)
+        # (3) N outputs are sending or waiting to send (released a _mod_slots entry)
         # More generally, however, the local stage may be backed up at any of these three steps,
         # depending on its performance relative to other stages and network conditions.
-        self._sem_fwd = threading.Semaphore(value=3) # value = 3*N
-        self._sem_mod = threading.Semaphore(value=1) # value = N
+        self._credits = num_fwd # default value = 3*N
         self._module = module_cls(*module_args, **module_kwargs)
-        self._next_rref = None
-        self._results_to = None
-        self._results_cb = None
+        self._modules = [self._module] + \
+            [copy.deepcopy(self._module) for _ in range(module_replicas - 1)]
+        self._mod_slots = queue.Queue()
+        for _ in range(num_mod):
+            for idx in range(module_replicas):
+                self._mod_slots.put(idx)
+        self._num_threads = num_threads
+        self._next_credits = None
+        self._results_rref = None
 
     def module_to(self, *args, **kwargs) -> None:
         """Wrap the module's `nn.Module.to` method (`device` can be be a `str`)."""
-        self._module.to(*args, **kwargs)
+        for module in self._modules:
+            module.to(*args, **kwargs)
 
-    def set_next(self, stage_rref: rpc.RRef) -> None:
-        """Set the RRef of the next pipeline stage - used by all stages except the last."""
-        self._next_rref = stage_rref
+    def set_next(self, stage_rref: rpc.RRef, results_rref: Optional[rpc.RRef]=None) -> None:
+        """
+        Set the RRef of the next pipeline stage - used by all stages except the last.
 
-    def set_results(self, results_to: Union[int, rpc.WorkerInfo, str],
-                    results_cb: Callable[[Any], None]) -> None:
-        """Set the results destination - used by only the last stage."""
-        self._results_to = results_to
-        self._results_cb = results_cb
+        Failures in the next stages are reported to the results reorder buffer at `results_rref`.
+        """
+        self._next_credits = DistRpcCredits(stage_rref, results_rref=results_rref)
 
-    def wait_for_ready(self) -> None:
-        """Wait for this stage to be ready to receive data - MUST be called from previous stage."""
-        # NOTE: This approach breaks down if the previous stage fails to send data afterward.
-        self._sem_fwd.acquire() # pylint: disable=consider-using-with
+    def set_results(self, results_rref: rpc.RRef) -> None:
+        """Set the RRef of the results reorder buffer - used by only the last stage."""
+        self._results_rref = results_rref
 
-    def __call__(self, inputs: Any) -> None:
-        """Wrap the module's callable method."""
+    def credits(self) -> int:
+        """Get the number of credits to grant the previous stage (inputs it may send at once)."""
+        return self._credits
+
+    def __call__(self, inputs: Any, seq: int) -> None:
+        """Wrap the module's callable method, where `seq` is the inputs' sequence number."""
+        # Returning (or raising) returns the previous stage's credit, so another microbatch may be
+        # received.
+        if self._num_threads is not None:
+            # torch's intra-op parallelism setting is thread-local for OpenMP builds
+            torch.set_num_threads(self._num_threads)
+        idx = self._mod_slots.get()
         try:
-            with self._sem_mod:
-                outputs = self._module(inputs)
-            if self._next_rref is not None:
-                # Sending must be asynchronous, otherwise we lose pipeline parallelism.
-                # However, don't try to send until the next stage is ready.
-                # If we were to initiate the async send (and then release _sem_fwd) too soon,
-                # outbound data could get backlogged in this stage when the next stage is slow.
-                self._next_rref.rpc_sync().wait_for_ready()
-                self._next_rref.rpc_async().__call__(outputs)
-            else:
-                assert self._results_to is not None
-                assert self._results_cb is not None
-                # There's no synchronization with the results handler, just send the data.
-                rpc.rpc_sync(self._results_to, self._results_cb, args=(outputs,))
+            outputs = self._modules[idx](inputs)
         finally:
-            # Now release so that another microbatch may be received.
-            self._sem_fwd.release()
+            self._mod_slots.put(idx)
+        if self._next_credits is not None:
+            # Sending must be asynchronous, otherwise we lose pipeline parallelism.
+            # However, don't try to send until the next stage has a credit for us.
+            # If we were to initiate the async send (and then return our credit) too soon,
+            # outbound data could get backlogged in this stage when the next stage is slow.
+            self._next_credits.send(outputs, seq)
+        else:
+            assert self._results_rref is not None
+            # There's no synchronization with the results handler, just send the data.
+            self._results_rref.rpc_sync().__call__(seq, outputs)
 
     def mod_register_buffer(self, *args, **kwargs) -> None:
-        """Wrap the module's `register_buffer()` method."""
-        return self._module.register_buffer(*args, **kwargs)
+        """Wrap the module replicas' `register_buffer()` method."""
+        for module in self._modules:
+            module.register_buffer(*args, **kwargs)
+
+    def mod_register_forward_hook(self, *args, **kwargs) -> List[RemovableHandle]:
+        """
+        Wrap the module replicas' `register_forward_hook()` method.
 
-    def mod_register_forward_hook(self, *args, **kwargs) -> None:
-        """Wrap the module's `register_forward_hook()` method."""
-        return self._module.register_forward_hook(*args, **kwargs)
+        Returns the hook handles, one per module replica (in replica order).
+        """
+        return [module.register_forward_hook(*args, **kwargs) for module in self._modules]
 
-    def mod_register_forward_pre_hook(self, *args, **kwargs) -> None:
-        """Wrap the module's `register_forward_pre_hook()` method."""
-        return self._module.register_forward_pre_hook(*args, **kwargs)
+    def mod_register_forward_pre_hook(self, *args, **kwargs) -> List[RemovableHandle]:
+        """
+        Wrap the module replicas' `register_forward_pre_hook()` method.
+
+        Returns the hook handles, one per module replica (in replica order).
+        """
+        return [module.register_forward_pre_hook(*args, **kwargs) for module in self._modules]
 
 
 class DistRpcPipeline:
-    """A distributed RPC pipeline which links `DistRpcPipelineStage` RRefs."""
+    """
+    A distributed RPC pipeline which links `DistRpcPipelineStage` RRefs.
+
+    Inputs are numbered in `enqueue_tensor` order, and `results_cb` is called in the same order.
+    """
 
     def __init__(self, stage_rrefs: List[rpc.RRef], results_to: Union[int, rpc.WorkerInfo, str],
                  results_cb: Callable[[Any], None]):
         super().__init__()
         self._rref_list = stage_rrefs
-        self._link_pipeline(results_to, results_cb)
+        self._seq = 0
+        self._results_rref = self._link_pipeline(results_to, results_cb)
+        self._credits = DistRpcCredits(self._rref_list[0], results_rref=self._results_rref)
 
     def rpc_register_buffer(self, name: str, tensors: List[Optional[torch.Tensor]],
                             **kwargs: dict) -> None:
@@ -152,12 +334,14 @@ class DistRpcPipeline:
 
     def _link_pipeline(self, results_to, results_cb):
         n_stages = len(self._rref_list)
-        futs = [self._rref_list[i].rpc_async().set_next(self._rref_list[i + 1])
+        results_rref = rpc.remote(results_to, DistRpcResultsReorderBuffer, args=(results_cb,))
+        futs = [self._rref_list[i].rpc_async().set_next(self._rref_list[i + 1], results_rref)
                 for i in range(n_stages - 1)]
-        futs.append(self._rref_list[-1].rpc_async().set_results(results_to, results_cb))
+        futs.append(self._rref_list[-1].rpc_async().set_results(results_rref))
         torch.futures.wait_all(futs)
+        return results_rref
 
     def enqueue_tensor(self, tensor: torch.Tensor) -> None:
         """Insert data into the front of the pipeline."""
-        self._rref_list[0].rpc_sync().wait_for_ready()
-        self._rref_list[0].rpc_async().__call__(tensor)
+        self._credits.send(tensor, self._seq)
+        self._seq += 1
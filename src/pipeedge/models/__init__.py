@@ -1,5 +1,5 @@
 """Models module."""
-from typing import Any, Tuple, Type, Union
+from typing import Any, List, Mapping, Sequence, Tuple, Type, Union
 from torch import nn, Tensor
 
 ModuleShardData: Type = Union[Tensor, Tuple[Tensor, ...]]
@@ -30,11 +30,30 @@ class ModuleShard(nn.Module):
         super().__init__()
         self.config = config
         self.shard_config = shard_config
+        # layers with modules reused from another shard, which aren't built or loaded again
+        self.layers_reused: List[int] = []
 
     def has_layer(self, layer: int) -> bool:
         """Check if shard has the specified layer."""
         return layer in range(self.shard_config.layer_start, self.shard_config.layer_end + 1)
 
+    def has_new_layer(self, layer: int) -> bool:
+        """Check if shard has the specified layer and didn't reuse it from another shard."""
+        return self.has_layer(layer) and layer not in self.layers_reused
+
+    def reuse_layers(self, shard: 'ModuleShard',
+                     layer_modules: Mapping[int, Sequence[str]]) -> None:
+        """
+        Reuse the modules of layers that `shard` also has.
+
+        `layer_modules` maps each layer to the names of the attributes that hold its modules.
+        """
+        for layer, names in layer_modules.items():
+            if self.has_layer(layer) and shard.has_layer(layer):
+                for name in names:
+                    setattr(self, name, getattr(shard, name))
+                self.layers_reused.append(layer)
+
 
 def get_microbatch_size(shard_data: ModuleShardData, verify: bool=False):
     """Get the microbatch size from shard data."""
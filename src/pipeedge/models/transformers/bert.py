@@ -2,7 +2,7 @@
 from collections.abc import Mapping
 import logging
 import math
-from typing import Union
+from typing import Optional, Union
 import numpy as np
 import torch
 from torch import nn
@@ -16,26 +16,54 @@ from . import TransformerShardData
 
 logger = logging.getLogger(__name__)
 
+# The modules of each layer shard's sublayers
+_LAYER_SHARD_MODULES = {
+    0: ('self_attention',),
+    1: ('self_output',),
+    2: ('intermediate',),
+    3: ('output',),
+}
+
+
+class _PrefixedWeights(Mapping):
+    """A read-only view of the weights with keys that start with a prefix, without the prefix."""
+
+    def __init__(self, weights: Mapping, prefix: str):
+        self._weights = weights
+        self._prefix = prefix
+
+    def __getitem__(self, key):
+        return self._weights[self._prefix + key]
+
+    def __iter__(self):
+        return (key[len(self._prefix):] for key in self._weights if key.startswith(self._prefix))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
 
 class BertLayerShard(ModuleShard):
     """Module shard based on `BertLayer`."""
 
-    def __init__(self, config: BertConfig, shard_config: ModuleShardConfig):
+    def __init__(self, config: BertConfig, shard_config: ModuleShardConfig,
+                 layer_reuse: Optional[ModuleShard]=None):
         super().__init__(config, shard_config)
         self.self_attention = None
         self.self_output = None
         self.intermediate = None
         self.output = None
+        if layer_reuse is not None:
+            self.reuse_layers(layer_reuse, _LAYER_SHARD_MODULES)
         self._build_shard()
 
     def _build_shard(self):
-        if self.has_layer(0):
+        if self.has_new_layer(0):
             self.self_attention = BertSelfAttention(self.config)
-        if self.has_layer(1):
+        if self.has_new_layer(1):
             self.self_output = BertSelfOutput(self.config)
-        if self.has_layer(2):
+        if self.has_new_layer(2):
             self.intermediate = BertIntermediate(self.config)
-        if self.has_layer(3):
+        if self.has_new_layer(3):
             self.output = BertOutput(self.config)
 
     @torch.no_grad()
@@ -56,7 +84,8 @@ class BertModelShard(ModuleShard):
     """Module shard based on `BertModel`."""
 
     def __init__(self, config: BertConfig, shard_config: ModuleShardConfig,
-                 model_weights: Union[str, Mapping]):
+                 model_weights: Union[str, Mapping],
+                 shard_reuse: Optional['BertModelShard']=None):
         super().__init__(config, shard_config)
         self.embeddings = None
         # BertModel uses an encoder here, but we'll just add the layers here instead.
@@ -68,17 +97,26 @@ class BertModelShard(ModuleShard):
         if isinstance(model_weights, str):
             logger.debug(">>>> Load weight file: %s", model_weights)
             with np.load(model_weights) as weights:
-                self._build_shard(weights)
+                self._build_shard(weights, shard_reuse)
         else:
-            self._build_shard(model_weights)
+            self._build_shard(model_weights, shard_reuse)
 
-    def _build_shard(self, weights):
-        if self.shard_config.is_first:
+    def _build_shard(self, weights, shard_reuse):
+        if self.shard_config.is_first and shard_reuse is not None and \
+            shard_reuse.shard_config.is_first:
+            logger.debug(">>>> Reuse embeddings layer for the first shard")
+            self.embeddings = shard_reuse.embeddings
+        elif self.shard_config.is_first:
             logger.debug(">>>> Load embeddings layer for the first shard")
             self.embeddings = BertEmbeddings(self.config)
             self.embeddings.eval()
             self._load_weights_first(weights)
 
+        # reuse the previous shard's layers by their id
+        layers_reuse = {}
+        if shard_reuse is not None:
+            layer_id_start = math.ceil(shard_reuse.shard_config.layer_start / 4) - 1
+            layers_reuse = dict(enumerate(shard_reuse.layers, start=layer_id_start))
         layer_curr = self.shard_config.layer_start
         while layer_curr <= self.shard_config.layer_end:
             layer_id = math.ceil(layer_curr / 4) - 1
@@ -90,12 +128,19 @@ class BertModelShard(ModuleShard):
             logger.debug(">>>> Load layer %d, sublayers %d-%d",
                          layer_id, sublayer_start, sublayer_end)
             layer_config = ModuleShardConfig(layer_start=sublayer_start, layer_end=sublayer_end)
-            layer = BertLayerShard(self.config, layer_config)
+            layer = BertLayerShard(self.config, layer_config,
+                                   layer_reuse=layers_reuse.get(layer_id))
+            if len(layer.layers_reused) > 0:
+                logger.debug(">>>> Reuse layer %d, sublayers %s", layer_id, layer.layers_reused)
             self._load_weights_layer(weights, layer_id, layer)
             self.layers.append(layer)
             layer_curr += sublayer_end - sublayer_start + 1
 
-        if self.shard_config.is_last:
+        if self.shard_config.is_last and shard_reuse is not None and \
+            shard_reuse.shard_config.is_last:
+            logger.debug(">>>> Reuse pooler for the last shard")
+            self.pooler = shard_reuse.pooler
+        elif self.shard_config.is_last:
             logger.debug(">>>> Load pooler for the last shard")
             self.pooler = BertPooler(self.config)
             self.pooler.eval()
@@ -118,22 +163,22 @@ class BertModelShard(ModuleShard):
     @torch.no_grad()
     def _load_weights_layer(self, weights, layer_id, layer):
         root = f"encoder.layer.{layer_id}."
-        if layer.has_layer(0):
+        if layer.has_new_layer(0):
             layer.self_attention.query.weight.copy_(torch.from_numpy(weights[root + "attention.self.query.weight"]))
             layer.self_attention.key.weight.copy_(torch.from_numpy(weights[root + "attention.self.key.weight"]))
             layer.self_attention.value.weight.copy_(torch.from_numpy(weights[root + "attention.self.value.weight"]))
             layer.self_attention.query.bias.copy_(torch.from_numpy(weights[root + "attention.self.query.bias"]))
             layer.self_attention.key.bias.copy_(torch.from_numpy(weights[root + "attention.self.key.bias"]))
             layer.self_attention.value.bias.copy_(torch.from_numpy(weights[root + "attention.self.value.bias"]))
-        if layer.has_layer(1):
+        if layer.has_new_layer(1):
             layer.self_output.dense.weight.copy_(torch.from_numpy(weights[root + "attention.output.dense.weight"]))
             layer.self_output.LayerNorm.weight.copy_(torch.from_numpy(weights[root + "attention.output.LayerNorm.weight"]))
             layer.self_output.dense.bias.copy_(torch.from_numpy(weights[root + "attention.output.dense.bias"]))
             layer.self_output.LayerNorm.bias.copy_(torch.from_numpy(weights[root + "attention.output.LayerNorm.bias"]))
-        if layer.has_layer(2):
+        if layer.has_new_layer(2):
             layer.intermediate.dense.weight.copy_(torch.from_numpy(weights[root + "intermediate.dense.weight"]))
             layer.intermediate.dense.bias.copy_(torch.from_numpy(weights[root + "intermediate.dense.bias"]))
-        if layer.has_layer(3):
+        if layer.has_new_layer(3):
             layer.output.dense.weight.copy_(torch.from_numpy(weights[root + "output.dense.weight"]))
             layer.output.dense.bias.copy_(torch.from_numpy(weights[root + "output.dense.bias"]))
             layer.output.LayerNorm.weight.copy_(torch.from_numpy(weights[root + "output.LayerNorm.weight"]))
@@ -165,7 +210,8 @@ class BertShardForSequenceClassification(ModuleShard):
     """Module shard based on `BertForSequenceClassification`."""
 
     def __init__(self, config: BertConfig, shard_config: ModuleShardConfig,
-                 model_weights: Union[str, Mapping]):
+                 model_weights: Union[str, Mapping],
+                 shard_reuse: Optional['BertShardForSequenceClassification']=None):
         super().__init__(config, shard_config)
         self.bert = None
         self.classifier = None
@@ -174,26 +220,28 @@ class BertShardForSequenceClassification(ModuleShard):
         if isinstance(model_weights, str):
             logger.debug(">>>> Load weight file: %s", model_weights)
             with np.load(model_weights) as weights:
-                self._build_shard(weights)
+                self._build_shard(weights, shard_reuse)
         else:
-            self._build_shard(model_weights)
+            self._build_shard(model_weights, shard_reuse)
 
-    def _build_shard(self, weights):
+    def _build_shard(self, weights, shard_reuse):
         ## all shards use the inner BERT model
         self.bert = BertModelShard(self.config, self.shard_config,
-                                   self._extract_weights_bert(weights))
+                                   self._extract_weights_bert(weights),
+                                   shard_reuse=None if shard_reuse is None else shard_reuse.bert)
 
-        if self.shard_config.is_last:
+        if self.shard_config.is_last and shard_reuse is not None and \
+            shard_reuse.shard_config.is_last:
+            logger.debug(">>>> Reuse classifier for the last shard")
+            self.classifier = shard_reuse.classifier
+        elif self.shard_config.is_last:
             logger.debug(">>>> Load classifier for the last shard")
             self.classifier = nn.Linear(self.config.hidden_size, self.config.num_labels)
             self._load_weights_last(weights)
 
     def _extract_weights_bert(self, weights):
-        bert_weights = {}
-        for key, val in weights.items():
-            if key.startswith('bert.'):
-                bert_weights[key[len('bert.'):]] = val
-        return bert_weights
+        # a view rather than a copy, so only the weights that are used get loaded
+        return _PrefixedWeights(weights, 'bert.')
 
     @torch.no_grad()
     def _load_weights_last(self, weights):
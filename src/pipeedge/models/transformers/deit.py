@@ -23,11 +23,20 @@ _HUB_MODEL_NAMES = {
     'facebook/deit-tiny-distilled-patch16-224': 'deit_tiny_distilled_patch16_224',
 }
 
+# The modules of each layer shard's sublayers (copied from `.vit`)
+_LAYER_SHARD_MODULES = {
+    0: ('layernorm_before', 'self_attention'),
+    1: ('self_output',),
+    2: ('layernorm_after', 'intermediate'),
+    3: ('output',),
+}
+
 
 class DeiTLayerShard(ModuleShard):
     """Module shard based on `DeiTLayer` (copied from `.vit.ViTLayerShard`)."""
 
-    def __init__(self, config: DeiTConfig, shard_config: ModuleShardConfig):
+    def __init__(self, config: DeiTConfig, shard_config: ModuleShardConfig,
+                 layer_reuse: Optional[ModuleShard]=None):
         super().__init__(config, shard_config)
         self.layernorm_before = None
         self.self_attention = None
@@ -35,20 +44,22 @@ class DeiTLayerShard(ModuleShard):
         self.layernorm_after = None
         self.intermediate = None
         self.output = None
+        if layer_reuse is not None:
+            self.reuse_layers(layer_reuse, _LAYER_SHARD_MODULES)
         self._build_shard()
 
     def _build_shard(self):
-        if self.has_layer(0):
+        if self.has_new_layer(0):
             self.layernorm_before = nn.LayerNorm(self.config.hidden_size,
                                                  eps=self.config.layer_norm_eps)
             self.self_attention = ViTSelfAttention(self.config)
-        if self.has_layer(1):
+        if self.has_new_layer(1):
             self.self_output = ViTSelfOutput(self.config)
-        if self.has_layer(2):
+        if self.has_new_layer(2):
             self.layernorm_after = nn.LayerNorm(self.config.hidden_size,
                                                 eps=self.config.layer_norm_eps)
             self.intermediate = ViTIntermediate(self.config)
-        if self.has_layer(3):
+        if self.has_new_layer(3):
             self.output = ViTOutput(self.config)
 
     @torch.no_grad()
@@ -73,7 +84,8 @@ class DeiTModelShard(ModuleShard):
     """Module shard based on `DeiTModel`."""
 
     def __init__(self, config: DeiTConfig, shard_config: ModuleShardConfig,
-                 model_weights: Union[str, Mapping]):
+                 model_weights: Union[str, Mapping],
+                 shard_reuse: Optional['DeiTModelShard']=None):
         super().__init__(config, shard_config)
         self.embeddings = None
         # DeiTModel uses an encoder here, but we'll just add the layers here instead.
@@ -85,16 +97,25 @@ class DeiTModelShard(ModuleShard):
         if isinstance(model_weights, str):
             logger.debug(">>>> Load weight file: %s", model_weights)
             with np.load(model_weights) as weights:
-                self._build_shard(weights)
+                self._build_shard(weights, shard_reuse)
         else:
-            self._build_shard(model_weights)
+            self._build_shard(model_weights, shard_reuse)
 
-    def _build_shard(self, weights):
-        if self.shard_config.is_first:
+    def _build_shard(self, weights, shard_reuse):
+        if self.shard_config.is_first and shard_reuse is not None and \
+            shard_reuse.shard_config.is_first:
+            logger.debug(">>>> Reuse embeddings layer for the first shard")
+            self.embeddings = shard_reuse.embeddings
+        elif self.shard_config.is_first:
             logger.debug(">>>> Load embeddings layer for the first shard")
             self.embeddings = DeiTEmbeddings(self.config)
             self._load_weights_first(weights)
 
+        # reuse the previous shard's layers by their id
+        layers_reuse = {}
+        if shard_reuse is not None:
+            layer_id_start = math.ceil(shard_reuse.shard_config.layer_start / 4) - 1
+            layers_reuse = dict(enumerate(shard_reuse.layers, start=layer_id_start))
         layer_curr = self.shard_config.layer_start
         while layer_curr <= self.shard_config.layer_end:
             layer_id = math.ceil(layer_curr / 4) - 1
@@ -106,12 +127,19 @@ class DeiTModelShard(ModuleShard):
             logger.debug(">>>> Load layer %d, sublayers %d-%d",
                          layer_id, sublayer_start, sublayer_end)
             layer_config = ModuleShardConfig(layer_start=sublayer_start, layer_end=sublayer_end)
-            layer = DeiTLayerShard(self.config, layer_config)
+            layer = DeiTLayerShard(self.config, layer_config,
+                                   layer_reuse=layers_reuse.get(layer_id))
+            if len(layer.layers_reused) > 0:
+                logger.debug(">>>> Reuse layer %d, sublayers %s", layer_id, layer.layers_reused)
             self._load_weights_layer(weights, layer_id, layer)
             self.layers.append(layer)
             layer_curr += sublayer_end - sublayer_start + 1
 
-        if self.shard_config.is_last:
+        if self.shard_config.is_last and shard_reuse is not None and \
+            shard_reuse.shard_config.is_last:
+            logger.debug(">>>> Reuse layernorm for the last shard")
+            self.layernorm = shard_reuse.layernorm
+        elif self.shard_config.is_last:
             logger.debug(">>>> Load layernorm for the last shard")
             self.layernorm = nn.LayerNorm(self.config.hidden_size, eps=self.config.layer_norm_eps)
             self._load_weights_last(weights)
@@ -132,7 +160,7 @@ class DeiTModelShard(ModuleShard):
     def _load_weights_layer(self, weights, layer_id, layer):
         root = f"blocks.{layer_id}."
         embed_dim = self.config.hidden_size
-        if layer.has_layer(0):
+        if layer.has_new_layer(0):
             layer.layernorm_before.weight.copy_(torch.from_numpy(weights[root + "norm1.weight"]))
             layer.layernorm_before.bias.copy_(torch.from_numpy(weights[root + "norm1.bias"]))
             qkv_weight = weights[root + "attn.qkv.weight"]
@@ -143,15 +171,15 @@ class DeiTModelShard(ModuleShard):
             layer.self_attention.query.bias.copy_(torch.from_numpy(qkv_bias[0:embed_dim,]))
             layer.self_attention.key.bias.copy_(torch.from_numpy(qkv_bias[embed_dim:embed_dim*2]))
             layer.self_attention.value.bias.copy_(torch.from_numpy(qkv_bias[embed_dim*2:embed_dim*3]))
-        if layer.has_layer(1):
+        if layer.has_new_layer(1):
             layer.self_output.dense.weight.copy_(torch.from_numpy(weights[root + "attn.proj.weight"]))
             layer.self_output.dense.bias.copy_(torch.from_numpy(weights[root + "attn.proj.bias"]))
-        if layer.has_layer(2):
+        if layer.has_new_layer(2):
             layer.layernorm_after.weight.copy_(torch.from_numpy(weights[root + "norm2.weight"]))
             layer.layernorm_after.bias.copy_(torch.from_numpy(weights[root + "norm2.bias"]))
             layer.intermediate.dense.weight.copy_(torch.from_numpy(weights[root + "mlp.fc1.weight"]))
             layer.intermediate.dense.bias.copy_(torch.from_numpy(weights[root + "mlp.fc1.bias"]))
-        if layer.has_layer(3):
+        if layer.has_new_layer(3):
             layer.output.dense.weight.copy_(torch.from_numpy(weights[root + "mlp.fc2.weight"]))
             layer.output.dense.bias.copy_(torch.from_numpy(weights[root + "mlp.fc2.bias"]))
 
@@ -190,7 +218,8 @@ class DeiTShardForImageClassification(ModuleShard):
     """Module shard based on `DeiTForImageClassification`."""
 
     def __init__(self, config: DeiTConfig, shard_config: ModuleShardConfig,
-                 model_weights: Union[str, Mapping]):
+                 model_weights: Union[str, Mapping],
+                 shard_reuse: Optional['DeiTShardForImageClassification']=None):
         super().__init__(config, shard_config)
         self.deit = None
         self.classifier = None
@@ -199,15 +228,20 @@ class DeiTShardForImageClassification(ModuleShard):
         if isinstance(model_weights, str):
             logger.debug(">>>> Load weight file: %s", model_weights)
             with np.load(model_weights) as weights:
-                self._build_shard(weights)
+                self._build_shard(weights, shard_reuse)
         else:
-            self._build_shard(model_weights)
+            self._build_shard(model_weights, shard_reuse)
 
-    def _build_shard(self, weights):
+    def _build_shard(self, weights, shard_reuse):
         ## all shards use the inner DeiT model
-        self.deit = DeiTModelShard(self.config, self.shard_config, weights)
+        self.deit = DeiTModelShard(self.config, self.shard_config, weights,
+                                   shard_reuse=None if shard_reuse is None else shard_reuse.deit)
 
-        if self.shard_config.is_last:
+        if self.shard_config.is_last and shard_reuse is not None and \
+            shard_reuse.shard_config.is_last:
+            logger.debug(">>>> Reuse classifier for the last shard")
+            self.classifier = shard_reuse.classifier
+        elif self.shard_config.is_last:
             logger.debug(">>>> Load classifier for the last shard")
             self.classifier = nn.Linear(self.config.hidden_size, self.config.num_labels) if self.config.num_labels > 0 else nn.Identity()
             self._load_weights_last(weights)
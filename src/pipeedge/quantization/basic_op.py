@@ -1,176 +1,246 @@
 """ Basic operations used for Quantization """
-from typing import List
-import numpy as np
+import math
+from typing import List, Optional, Tuple
 import torch
 
-def _quant_op(input_data, bit, mode='original'):
-    """
-    The input and output should be all on the interval [0, 1].
-        bit is only defined on positive integer values.
-    """
-    assert bit > 0
-    assert np.all(input_data >= 0)
-    assert np.all(input_data <= 1)
-
-    # input should be in [0,1]
-    # the res can be removed for further speed/memory improvement
-    if mode == 'original':
-        scale = (1 << bit) - 1
-        res = np.around(scale * input_data)
-        int_map = res.copy()
-        int_map = int_map.astype(np.uint32)
-        res /= scale
-    elif mode == 'modified':
-        scale = 1 << bit
-        res = np.floor(scale * input_data)
-        int_map = res.copy()
-        int_map = int_map.astype(np.uint32)
-        np.clip(res, 0, scale-1, res)
-        res /= scale
-    else:
-        raise ValueError('mode should be either [original] or [modified]')
-
-    assert np.all(res >= 0)
-    assert np.all(res <= 1)
-    return res, int_map
-
-
-def _intmap_encode(int_map, bitwidth):
-    """ compress the converted int_map to tesnor with fewer numbers"""
-    # the int_map is assumed as a 4- or 3-dimensional np.array [b(optional),c,h,w]
-    int_map = int_map.flatten()
-    # enc_ratio is the number of original values compressed into one single int32 value
-    enc_ratio = int(32/bitwidth)
-
-    # store tensor into new_tensor
-    # e.g. original tensor with 6 values: [0,1,2,3,4,5] (dtype=int32)
-    # new tensor with 2 values: [3,2,1,0], [5,4,NULL,NULL] (enc_ratio=4, one int32 has 4 values)
-    int_map_ext = np.append(int_map,
-                            np.repeat(0, (enc_ratio - len(int_map) % enc_ratio) % enc_ratio))
-    int_map_rs = np.reshape(int_map_ext, (-1, enc_ratio))
-    bitshift = np.array([(i % enc_ratio) * bitwidth for i in range(enc_ratio)], dtype=np.uint32)
-    int_map_shifted = np.left_shift(int_map_rs, bitshift)
-    new_array = np.bitwise_or.reduce(int_map_shifted, axis=1, dtype=np.uint32)
-
-    return new_array
-
-
-def _intmap_decode(input_data, orig_shape, bitwidth):
-    """ restore the compressed tensor """
-    # the input is assumed as an 1-dimensional tensor / np.array
-    # orig_shape represents the original tensor shape in format of tensor.shape [b(optional),c,h,w]
-    enc_ratio = int(32/bitwidth)
-    orig_size = np.prod(orig_shape, dtype=np.uint32)
-
-    # restore tensor into original_tensor
-    # e.g. new tensor with 2 values: [3,2,1,0], [5,4,NULL,NULL] (enc_ratio=4, one
-    #    uint32 will contain 4 uint8 values)
-    # original tensor should be 6 values: [0,1,2,3,4,5] (dtype=int32)
-    data_exploded = np.repeat(input_data, enc_ratio)
-    data_rs = np.reshape(data_exploded, (-1, enc_ratio))
-    bitshift = np.array([(i % enc_ratio) * bitwidth for i in range(enc_ratio)], dtype=np.uint32)
-    data_shifted = np.right_shift(data_rs, bitshift)
-    data_flat = data_shifted.flatten()
-    orig_tensor = np.bitwise_and(data_flat, 2**bitwidth-1)
-    orig_tensor = orig_tensor[:orig_size]
-
-    # # old version of implementation
-    # for idx in range(orig_size):
-    #     alt_idx = idx//enc_ratio
-    #     alt_bitshift = (idx % enc_ratio) * bitwidth
-    #     if (alt_bitshift+bitwidth)!=32:
-    #         # mask the higher bits
-    #         # e.g. decode the '2' in [3,2,1,0], need to mask the '3' in front of '2'
-    #         significant_bits_masked_input = (input[alt_idx] % (1<<(alt_bitshift+bitwidth)))
-    #     else:
-    #         # e.g. '3' in [3,2,1,0] does not need mask, otherwise would be overflowed
-    #         significant_bits_masked_input = input[alt_idx]
-    #     orig_tensor[idx] = significant_bits_masked_input >> alt_bitshift
-
-    return orig_tensor.reshape(orig_shape)
-
-
-def _intmap2float(int_map, bitwidth):
-    """ used to restore the tesnor from intmap to float """
-    scale = (1 << bitwidth) - 1
-    return (int_map/scale).astype(np.float32)
-
-def _uint32_to_uint8(tensor):
-    """ re-represent uint32 to uint8, since torch has no uint32 (does have uint8) """
-    assert tensor.dtype == np.uint32
-    return tensor.view('uint8')
-
-def _uint8_to_uint32(tensor):
-    """ restore the uint32 value from 4 uint8 values """
-    assert tensor.dtype == np.uint8
-    return tensor.view('uint32')
+def _bitstream_chunk(bitwidth: int) -> Tuple[int, int]:
+    """ the number of values and bytes in each repeating chunk of a dense bitstream """
+    chunk_bits = bitwidth * 8 // math.gcd(bitwidth, 8)
+    return chunk_bits // bitwidth, chunk_bits // 8
+
+
+def bitstream_nbytes(numel: int, bitwidth: int) -> int:
+    """Get the size in bytes of `numel` values densely packed with `bitwidth` bits each."""
+    return (numel * bitwidth + 7) // 8
+
+
+def _bitstream_encode_outerdim(int_map: torch.Tensor, bitwidth: int, out: torch.Tensor) -> None:
+    """ pack each item in int_map [b,numel] into a dense bitstream in out [b,nbytes] """
+    # int_map may have any dtype with integral values, and out is a uint8 tensor
+    # value j starts at bit j*bitwidth, counting from the least significant bit of the first byte
+    # e.g., with bitwidth=6, values [a,b,c,d] are packed into 3 bytes: [bb aaaaaa] [cccc bbbb]
+    #    [dddddd cc], so every chunk of 4 values is packed the same way into 3 bytes
+    n_items, numel = int_map.shape
+    chunk_vals, chunk_bytes = _bitstream_chunk(bitwidth)
+    n_chunks = -(-numel // chunk_vals)
+    # torch has no uint32, so values are int64
+    vals_buf = torch.empty((n_items, n_chunks), dtype=torch.int64)
+    tmp = torch.empty_like(vals_buf)
+    tmp_u8 = torch.empty((n_items, n_chunks), dtype=torch.uint8)
+    out.zero_()
+    for i in range(chunk_vals):
+        # value i of each chunk, where the last chunk may be partial
+        n_vals = (numel - i + chunk_vals - 1) // chunk_vals
+        vals = vals_buf[:, :n_vals]
+        vals.copy_(int_map[:, i::chunk_vals])
+        offset = i * bitwidth
+        for k in range(offset // 8, (offset + bitwidth - 1) // 8 + 1):
+            # the bits of value i in byte k of each chunk
+            part = tmp[:, :n_vals]
+            part.copy_(vals)
+            shift = 8 * k - offset
+            if shift >= 0:
+                part >>= shift
+            else:
+                part <<= -shift
+            part &= 0xFF
+            part_u8 = tmp_u8[:, :n_vals]
+            part_u8.copy_(part)
+            out[:, k::chunk_bytes][:, :n_vals].bitwise_or_(part_u8)
+
+
+def _bitstream_decode_outerdim(input_data: torch.Tensor, bitwidth: int, out: torch.Tensor) -> None:
+    """ unpack each item in input_data [b,nbytes], a dense bitstream, into out [b,numel] """
+    # out may have any dtype that can represent the int values
+    n_items, numel = out.shape
+    chunk_vals, chunk_bytes = _bitstream_chunk(bitwidth)
+    n_chunks = -(-numel // chunk_vals)
+    vals_buf = torch.empty((n_items, n_chunks), dtype=torch.int64)
+    tmp = torch.empty_like(vals_buf)
+    mask = (1 << bitwidth) - 1
+    for i in range(chunk_vals):
+        n_vals = (numel - i + chunk_vals - 1) // chunk_vals
+        vals = vals_buf[:, :n_vals]
+        vals.zero_()
+        offset = i * bitwidth
+        for k in range(offset // 8, (offset + bitwidth - 1) // 8 + 1):
+            part = tmp[:, :n_vals]
+            part.copy_(input_data[:, k::chunk_bytes][:, :n_vals])
+            shift = 8 * k - offset
+            if shift >= 0:
+                part <<= shift
+            else:
+                part >>= -shift
+            vals.bitwise_or_(part)
+        vals &= mask
+        out[:, i::chunk_vals].copy_(vals)
 
 
 def compression_factor(quant_bit: torch.Tensor) -> torch.Tensor:
-    """Compute the compression factor (data size improvement) for quantization bit widths > 0."""
+    """
+    Compute the compression factor (data size improvement) for quantization bit widths > 0.
+
+    Quantized values are densely packed, so this is exact, excluding any padding in the last byte.
+    """
     return torch.div(32, quant_bit)
 
 
-def tensor_encode(input_data: torch.Tensor, quant_bit: int) -> List[torch.Tensor]:
+def _groups(n_channels: int, group_size: int) -> Tuple[int, int]:
+    """ the number of channel groups and their size, where the last group may be smaller """
+    n_groups = -(-n_channels // group_size)
+    # the size is normalized so that it can be inferred from the number of groups
+    return n_groups, -(-n_channels // n_groups)
+
+
+def _group_reduce(channel_stats: torch.Tensor, group_size: int, reduce) -> torch.Tensor:
+    """ reduce per-channel statistics [b,channels] to per-group statistics [b,groups] """
+    n_items, n_channels = channel_stats.shape
+    n_groups, group_size = _groups(n_channels, group_size)
+    # padding with copies of the last channel doesn't change the last group's min or max
+    pad = channel_stats[:, -1:].expand(-1, n_groups * group_size - n_channels)
+    channel_stats = torch.cat((channel_stats, pad), dim=1)
+    return reduce(channel_stats.reshape(n_items, n_groups, group_size), dim=2)
+
+
+def _group_expand(group_vals: torch.Tensor, n_channels: int) -> torch.Tensor:
+    """ expand per-group values [b,groups] to per-channel values [b,channels] """
+    group_size = -(-n_channels // group_vals.shape[1])
+    return group_vals.repeat_interleave(group_size, dim=1)[:, :n_channels]
+
+
+def tensor_encode(input_data: torch.Tensor, quant_bit: int,
+                  group_size: int=0) -> List[torch.Tensor]:
     """
         The input to the encoder should be a torch.Tensor
-        We first cast it to a np.array, then do everything else
+        Encodes as a microbatch with a single item, see `tensor_encode_outerdim`
     """
-    quant_bit_tensor = torch.tensor(quant_bit, dtype = torch.int8)
-    if quant_bit == 0:
-        return [input_data, torch.tensor(input_data.shape), torch.tensor(1.0), torch.tensor(0.0),
-                quant_bit_tensor]
-
-    input_data = input_data.numpy()
-    shape = input_data.shape
-    # ensure the input is scaled to [0,1],
-    shift = input_data.min()
-    input_data = input_data - shift
-    scale_factor = input_data.max()
-    rescale_input = input_data/scale_factor
-    # quant
-    _, int_map = _quant_op(rescale_input, quant_bit)
-    comm_tensor = _intmap_encode(int_map, quant_bit)
-    # split uint32 into 4 uint8
-    comm_tensor = _uint32_to_uint8(comm_tensor)
-    # convert array to tensor for p2p communication
-    comm_tensor = torch.tensor(comm_tensor, dtype = torch.uint8)
-    shape = torch.tensor(shape, dtype = torch.int32)
-    scale_factor = torch.tensor(scale_factor, dtype = torch.float32)
-    shift = torch.tensor(shift, dtype = torch.float32)
-
-    # scale_factor is needed to restore the tensor
-    return [comm_tensor, shape, scale_factor, shift, quant_bit_tensor]
+    return [t[0] for t in tensor_encode_outerdim(input_data.unsqueeze(0), quant_bit,
+                                                 group_size=group_size)]
 
 
 def tensor_decode(encodings: List[torch.Tensor]) -> torch.Tensor:
     """
         decode the compressed tensor with uint8 value
     """
-    comm_tensor, input_shape, scale_factor, shift, quant_bit = encodings
+    return tensor_decode_outerdim([t.unsqueeze(0) for t in encodings])[0]
+
+
+def tensor_encode_outerdim(batched_tensor: torch.Tensor, quant_bit: int, group_size: int=0,
+                           out: Optional[torch.Tensor]=None) -> List[torch.Tensor]:
+    """
+    do quantization on each image in the micro-batched tensor with size [b,c,h,w]
+
+    With `group_size=0`, each item has a single scale_factor and shift.
+    Otherwise, each group of `group_size` channels in the last dimension has its own scale_factor
+    and shift (e.g., `group_size=1` is per-channel), which better preserves the values of other
+    channels when a few channels have outliers.
+    If set, `out` is a preallocated uint8 tensor [b,nbytes] for the packed values (see
+    `bitstream_nbytes`), e.g., a reused send buffer, which is returned as the first encoding.
+    """
+    if group_size < 0:
+        raise ValueError(f"Group size must be >= 0, but group_size={group_size}")
+    n_items = batched_tensor.shape[0]
     if quant_bit == 0:
-        return comm_tensor
-
-    # convert tensor to array for computation and splice uint8 to uint32
-    assert isinstance(comm_tensor, torch.Tensor)
-    comm_tensor = _uint8_to_uint32(comm_tensor.numpy())
-    input_shape = input_shape.tolist()
-    scale_factor = scale_factor.item()
-    shift = shift.item()
-    quant_bit = quant_bit.item()
-    restore_int_map = _intmap_decode(comm_tensor, input_shape, quant_bit)
-    restore_tensor = _intmap2float(restore_int_map, quant_bit)
-    return torch.from_numpy((restore_tensor*scale_factor+shift).astype(np.float32))
-
-
-def tensor_encode_outerdim(batched_tensor: torch.Tensor, quant_bit: int) -> List[torch.Tensor]:
-    """do quantization on each image in the micro-batched tensor with size [b,c,h,w]"""
-    list_of_lists = [tensor_encode(t, quant_bit) for t in batched_tensor]
-    encoded_tensors = list(zip(*list_of_lists))
-    return [torch.stack(t,0) for t in encoded_tensors]
-
-
-def tensor_decode_outerdim(batched_encodings: List[torch.Tensor]) -> torch.Tensor:
-    """decode the encoded tensor with multiple images in one batch, each encoded image data is in length of 5"""
-    tensors = [tensor_decode(encodings) for encodings in zip(*batched_encodings)]
-    return torch.stack(tensors, 0)
+        shape = torch.tensor(batched_tensor.shape[1:]).repeat(n_items, 1)
+        return [batched_tensor, shape, torch.ones(n_items), torch.zeros(n_items),
+                torch.full((n_items,), quant_bit, dtype=torch.int8)]
+
+    shape = batched_tensor.shape[1:]
+    n_channels = shape[-1] if len(shape) > 0 else 1
+    input_data = batched_tensor.reshape(n_items, -1, n_channels)
+    # ensure each item (or group) is scaled to [0,1]
+    if group_size > 0:
+        # scale_factor and shift are [b,groups]
+        shift = _group_reduce(input_data.amin(dim=1), group_size, torch.amin)
+        scale_factor = _group_reduce(input_data.amax(dim=1), group_size, torch.amax) - shift
+    else:
+        # scale_factor and shift are [b]
+        shift = input_data.amin(dim=(1, 2))
+        scale_factor = input_data.amax(dim=(1, 2)) - shift
+    return _tensor_quant_outerdim(input_data, shape, quant_bit, scale_factor, shift, out=out)
+
+
+def _tensor_quant_outerdim(input_data: torch.Tensor, shape: torch.Size, quant_bit: int,
+                           scale_factor: torch.Tensor, shift: torch.Tensor,
+                           clamp_bound: Optional[float]=None,
+                           out: Optional[torch.Tensor]=None) -> List[torch.Tensor]:
+    """ quantize and encode input_data [b,rows,channels], given its scale_factor and shift """
+    # if clamp_bound is set, input_data is first clamped to [-clamp_bound, clamp_bound]
+    n_items, _, n_channels = input_data.shape
+    out_shape = (n_items, bitstream_nbytes(shape.numel(), quant_bit))
+    if out is None:
+        out = torch.empty(out_shape, dtype=torch.uint8)
+    elif out.shape != out_shape or out.dtype != torch.uint8:
+        raise ValueError(f"Output must be a uint8 tensor with shape {list(out_shape)}, but "
+                         f"dtype={out.dtype} and shape={list(out.shape)}")
+    if scale_factor.dim() > 1:
+        shift_bcast = _group_expand(shift, n_channels)[:, None]
+        scale_bcast = _group_expand(scale_factor, n_channels)[:, None]
+    else:
+        shift_bcast = shift[:, None, None]
+        scale_bcast = scale_factor[:, None, None]
+    if clamp_bound is None:
+        rescale_input = input_data - shift_bcast
+    else:
+        rescale_input = input_data.clamp(min=-clamp_bound, max=clamp_bound)
+        rescale_input.sub_(shift_bcast)
+    # constant items (or groups) have scale_factor=0, which would otherwise produce NaNs
+    rescale_input.div_(torch.where(scale_bcast == 0, torch.ones_like(scale_bcast), scale_bcast))
+    # quant: round to the nearest of the 2^quant_bit levels in [0,1]
+    if quant_bit > 16:
+        # float32 can't represent all the integer levels exactly
+        rescale_input = rescale_input.double()
+    int_map = rescale_input.mul_((1 << quant_bit) - 1).round_().reshape(n_items, -1)
+    _bitstream_encode_outerdim(int_map, quant_bit, out)
+    return [out, torch.tensor(shape, dtype=torch.int32).repeat(n_items, 1),
+            scale_factor, shift, torch.full((n_items,), quant_bit, dtype=torch.int8)]
+
+
+def tensor_decode_outerdim(batched_encodings: List[torch.Tensor],
+                           out: Optional[torch.Tensor]=None) -> torch.Tensor:
+    """
+    decode the encoded tensor with multiple images in one batch, each encoded image data is in length of 5
+
+    If set, `out` is a preallocated contiguous float32 tensor [b,c,h,w] for the decoded tensor,
+    e.g., a reused input buffer, which is returned.
+    """
+    comm_tensor, input_shape, scale_factor, shift, quant_bit = batched_encodings
+    n_items = comm_tensor.shape[0]
+    shape = input_shape[0].tolist()
+    if out is not None and (list(out.shape) != [n_items, *shape] or
+                            out.dtype != torch.float32 or not out.is_contiguous()):
+        raise ValueError(f"Output must be a contiguous float32 tensor with shape "
+                         f"{[n_items, *shape]}, but dtype={out.dtype} and shape={list(out.shape)}")
+    bit = quant_bit[0].item()
+    if bit == 0 and torch.all(quant_bit == 0):
+        # unquantized, so there's only a copy to do if the caller provided a buffer
+        return comm_tensor if out is None else out.copy_(comm_tensor)
+    if out is None:
+        out = torch.empty((n_items, *shape), dtype=torch.float32)
+    if not torch.all(quant_bit == bit):
+        # items were encoded separately
+        for i, encodings in enumerate(zip(*batched_encodings)):
+            tensor_decode_outerdim([t.unsqueeze(0) for t in encodings], out=out[i:i+1])
+        return out
+
+    restore_tensor = out.view(n_items, -1)
+    _bitstream_decode_outerdim(comm_tensor, bit, restore_tensor)
+    _tensor_dequant_outerdim(restore_tensor, shape, bit, scale_factor, shift)
+    return out
+
+
+def _tensor_dequant_outerdim(restore_tensor: torch.Tensor, shape: List[int], bit: int,
+                             scale_factor: torch.Tensor, shift: torch.Tensor) -> None:
+    """ dequantize the int values in restore_tensor [b,numel] in place """
+    n_items = restore_tensor.shape[0]
+    n_channels = shape[-1] if len(shape) > 0 else 1
+    restore_tensor = restore_tensor.view(n_items, -1, n_channels)
+    if scale_factor.dim() > 1:
+        # per-group scale_factor and shift
+        scale_factor = _group_expand(scale_factor, n_channels)[:, None]
+        shift = _group_expand(shift, n_channels)[:, None]
+    else:
+        scale_factor = scale_factor[:, None, None]
+        shift = shift[:, None, None]
+    restore_tensor.div_((1 << bit) - 1)
+    restore_tensor.mul_(scale_factor).add_(shift)
@@ -1,11 +1,25 @@
 """clamp functions used for clipping quantization methods"""
+from typing import List, Optional
+import numpy as np
 from scipy.special import lambertw
 import torch
+from .basic_op import _tensor_quant_outerdim
+
+# Largest supported quantization bitwidth
+_BIT_MAX = 32
+
+
+def _clamp_factors(exponents: np.ndarray) -> torch.Tensor:
+    # scipy returns a float64, but we'll overflow first if we don't force it for large exponents
+    return torch.from_numpy(np.asarray(lambertw(3 * np.float64(4)**exponents).real))
+
+# lambertw is expensive, so precompute factors for all bitwidths (indexed by bitwidth)
+_CLAMP_FACTORS_GELU = _clamp_factors(np.arange(_BIT_MAX + 1) + 1)
+_CLAMP_FACTORS_LAPLACE = _clamp_factors(np.arange(_BIT_MAX + 1))
 
 
 def _clamp_factor_gelu(bit: int) -> torch.Tensor:
-    # scipy returns a float64, but we'll overflow first if we don't force it when bit>=31
-    return lambertw(3 * torch.tensor(4, dtype=torch.float64)**(bit+1)).real
+    return _CLAMP_FACTORS_GELU[bit]
 
 
 def clamp_banner2019_gelu(tensor: torch.Tensor, bit: int) -> torch.Tensor:
@@ -20,8 +34,7 @@ def clamp_banner2019_gelu(tensor: torch.Tensor, bit: int) -> torch.Tensor:
 
 
 def _clamp_factor_laplace(bit: int) -> torch.Tensor:
-    # scipy returns a float64, but we'll overflow first if we don't force it when bit>=32
-    return lambertw(3 * torch.tensor(4, dtype=torch.float64)**bit).real
+    return _CLAMP_FACTORS_LAPLACE[bit]
 
 
 def clamp_banner2019_laplace(tensor: torch.Tensor, bit: int) -> torch.Tensor:
@@ -31,3 +44,35 @@ def clamp_banner2019_laplace(tensor: torch.Tensor, bit: int) -> torch.Tensor:
     dist_parameter = torch.sqrt(0.5*variance)
     alpha = _clamp_factor_laplace(bit).to(tensor) * dist_parameter
     return tensor.clamp(min=-alpha, max=alpha)
+
+
+def tensor_encode_outerdim_banner2019(batched_tensor: torch.Tensor, bit: int,
+                                      out: Optional[torch.Tensor]=None) -> List[torch.Tensor]:
+    """
+    Clamp then quantize a micro-batched tensor, like `tensor_encode_outerdim` after clamping.
+
+    Uses `clamp_banner2019_laplace`, or `clamp_banner2019_gelu` if the tensor's min is >= 0.2
+    (i.e., it's probably a GeLU layer output).
+    Rather than clamping and then computing quantization statistics from the clamped tensor, all
+    statistics are computed from the original tensor, and clamping is done while quantizing.
+    `out` is an optional preallocated buffer, see `tensor_encode_outerdim`.
+    """
+    n_items = batched_tensor.shape[0]
+    shape = batched_tensor.shape[1:]
+    input_data = batched_tensor.reshape(n_items, -1, 1)
+    items = input_data.reshape(n_items, -1)
+    item_min, item_max = items.amin(dim=1), items.amax(dim=1)
+    # float64 avoids cancellation in the variance of large activations with a nonzero mean
+    variance, mean = torch.var_mean(input_data.reshape(-1).double(), unbiased=False)
+    if item_min.min() < 0.2:
+        alpha = _clamp_factor_laplace(bit) * torch.sqrt(0.5 * variance)
+    else:
+        # the GeLU clamp's variance is about 0 rather than the mean: 2 * E[x^2]
+        variance = 2 * (variance + mean * mean)
+        alpha = _clamp_factor_gelu(bit) * torch.sqrt(0.5 * variance)
+    alpha = alpha.to(batched_tensor.dtype).item()
+    # clamping is monotonic, so the clamped tensor's min and max are the clamped min and max
+    shift = item_min.clamp(min=-alpha, max=alpha)
+    scale_factor = item_max.clamp(min=-alpha, max=alpha) - shift
+    return _tensor_quant_outerdim(input_data, shape, bit, scale_factor, shift, clamp_bound=alpha,
+                                  out=out)
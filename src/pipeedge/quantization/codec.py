@@ -0,0 +1,150 @@
+"""Registry of codecs that encode tensors for the wire, identified by codec IDs."""
+from typing import Callable, List
+import torch
+from .basic_op import _tensor_dequant_outerdim, tensor_decode_outerdim, tensor_encode_outerdim
+from .clamp_op import tensor_encode_outerdim_banner2019
+from .entropy_op import huffman_decode_outerdim, huffman_encode_outerdim
+
+# Codec IDs 1-32 are integer quantization with that bitwidth, for compatibility with `quant_bit`
+CODEC_ID_FP32 = 0
+CODEC_ID_INT_MIN = 1
+CODEC_ID_INT_MAX = 32
+CODEC_ID_FP16 = 33
+CODEC_ID_BF16 = 34
+# Codec IDs 65-96 are integer quantization with bitwidth (ID - 64), followed by Huffman coding
+CODEC_ID_INT_HUFFMAN_OFFSET = 64
+
+# Encoders take a microbatched tensor, the codec ID, a quantization group size, and whether to
+# clamp before quantization.
+# Like `tensor_encode_outerdim`, encodings are lists of 5 tensors, the last one being codec IDs.
+CodecEncoder = Callable[[torch.Tensor, int, int, bool], List[torch.Tensor]]
+CodecDecoder = Callable[[List[torch.Tensor]], torch.Tensor]
+
+_CODECS = {}
+
+def _codec_add(codec_id: int, name: str, bits: int, encode: CodecEncoder,
+               decode: CodecDecoder) -> None:
+    _CODECS[codec_id] = {
+        'name': name,
+        'bits': bits,
+        'encode': encode,
+        'decode': decode,
+    }
+
+
+def _cast_encoder(dtype: torch.dtype) -> CodecEncoder:
+    def _encode(batched_tensor: torch.Tensor, codec_id: int, _group_size: int,
+                _clamp: bool) -> List[torch.Tensor]:
+        n_items = batched_tensor.shape[0]
+        shape = torch.tensor(batched_tensor.shape[1:]).repeat(n_items, 1)
+        return [batched_tensor.to(dtype), shape, torch.ones(n_items), torch.zeros(n_items),
+                torch.full((n_items,), codec_id, dtype=torch.int8)]
+    return _encode
+
+
+def _cast_decode(encodings: List[torch.Tensor]) -> torch.Tensor:
+    return encodings[0].to(torch.float32)
+
+
+def _int_encoder(quant_bit: int, huffman: bool=False) -> CodecEncoder:
+    def _encode(batched_tensor: torch.Tensor, codec_id: int, group_size: int,
+                clamp: bool) -> List[torch.Tensor]:
+        # clamping is skipped with per-group scales, which are meant to preserve outlier channels
+        if clamp and quant_bit > 0 and group_size == 0:
+            encodings = tensor_encode_outerdim_banner2019(batched_tensor, quant_bit)
+        else:
+            encodings = tensor_encode_outerdim(batched_tensor, quant_bit, group_size=group_size)
+        if huffman:
+            data = huffman_encode_outerdim(encodings[0], batched_tensor.shape[1:].numel(),
+                                           quant_bit)
+            # otherwise, send the packed values with the plain int codec ID
+            if data.shape[1] < encodings[0].shape[1]:
+                encodings[0] = data
+                encodings[4] = torch.full_like(encodings[4], codec_id)
+        return encodings
+    return _encode
+
+
+def _int_huffman_decoder(quant_bit: int) -> CodecDecoder:
+    def _decode(encodings: List[torch.Tensor]) -> torch.Tensor:
+        data, input_shape, scale_factor, shift, _ = encodings
+        n_items = data.shape[0]
+        shape = input_shape[0].tolist()
+        restore_tensor = torch.empty((n_items, *shape), dtype=torch.float32)
+        # decode values straight into the output, rather than packing them to a bitstream first
+        huffman_decode_outerdim(data, quant_bit, restore_tensor.view(n_items, -1))
+        _tensor_dequant_outerdim(restore_tensor.view(n_items, -1), shape, quant_bit, scale_factor,
+                                 shift)
+        return restore_tensor
+    return _decode
+
+
+# fp32 is the same as no quantization (quant_bit=0)
+_codec_add(CODEC_ID_FP32, 'fp32', 32, _int_encoder(0), tensor_decode_outerdim)
+for _bit in range(CODEC_ID_INT_MIN, CODEC_ID_INT_MAX + 1):
+    _codec_add(_bit, f'int{_bit}', _bit, _int_encoder(_bit), tensor_decode_outerdim)
+    _codec_add(CODEC_ID_INT_HUFFMAN_OFFSET + _bit, f'int{_bit}-huffman', _bit,
+               _int_encoder(_bit, huffman=True), _int_huffman_decoder(_bit))
+_codec_add(CODEC_ID_FP16, 'fp16', 16, _cast_encoder(torch.float16), _cast_decode)
+_codec_add(CODEC_ID_BF16, 'bf16', 16, _cast_encoder(torch.bfloat16), _cast_decode)
+
+
+def get_codec_ids() -> List[int]:
+    """Get a list of available codec IDs."""
+    return list(_CODECS.keys())
+
+def get_codec_id(name: str) -> int:
+    """Get a codec ID from its name (e.g., 'fp16' or 'int8') or its ID as a string."""
+    if name.isdigit():
+        codec_id = int(name)
+        if codec_id in _CODECS:
+            return codec_id
+    for codec_id, codec in _CODECS.items():
+        if codec['name'] == name:
+            return codec_id
+    raise ValueError(f"Unknown codec: {name}")
+
+def get_codec_name(codec_id: int) -> str:
+    """Get a codec's name."""
+    return _CODECS[codec_id]['name']
+
+def get_codec_bits(codec_id: int) -> int:
+    """Get a codec's encoded bits per value (excluding metadata)."""
+    return _CODECS[codec_id]['bits']
+
+def is_int_codec(codec_id: int) -> bool:
+    """Check if a codec ID is for integer quantization (without entropy coding)."""
+    return CODEC_ID_INT_MIN <= codec_id <= CODEC_ID_INT_MAX
+
+def is_huffman_codec(codec_id: int) -> bool:
+    """Check if a codec ID is for integer quantization followed by Huffman coding."""
+    return is_int_codec(codec_id - CODEC_ID_INT_HUFFMAN_OFFSET)
+
+def get_huffman_codec_id(codec_id: int) -> int:
+    """Get the Huffman-coded variant of an integer quantization codec ID (others are unchanged)."""
+    return codec_id + CODEC_ID_INT_HUFFMAN_OFFSET if is_int_codec(codec_id) else codec_id
+
+
+def encode_outerdim(batched_tensor: torch.Tensor, codec_id: int, group_size: int=0,
+                    clamp: bool=False) -> List[torch.Tensor]:
+    """
+    Encode each item in a microbatched tensor.
+
+    `group_size` only applies to integer quantization, see `tensor_encode_outerdim`.
+    `clamp` clamps outliers before integer quantization with per-item scales, see
+    `tensor_encode_outerdim_banner2019`.
+    """
+    if codec_id not in _CODECS:
+        raise ValueError(f"Unknown codec ID: {codec_id}")
+    return _CODECS[codec_id]['encode'](batched_tensor, codec_id, group_size, clamp)
+
+
+def decode_outerdim(batched_encodings: List[torch.Tensor]) -> torch.Tensor:
+    """Decode a microbatched tensor, whose items may use different codecs."""
+    codec_ids = batched_encodings[4]
+    codec_id = codec_ids[0].item()
+    if not torch.all(codec_ids == codec_id):
+        # items were encoded separately
+        return torch.cat([decode_outerdim([t[i:i+1] for t in batched_encodings])
+                          for i in range(len(codec_ids))])
+    return _CODECS[codec_id]['decode'](batched_encodings)
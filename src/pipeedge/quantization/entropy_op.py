@@ -0,0 +1,67 @@
+"""Entropy coding for quantized tensors."""
+import zlib
+import numpy as np
+import torch
+from .basic_op import _bitstream_decode_outerdim
+
+# Deflate with Huffman coding only (no LZ77 string matching, which rarely helps with quantized
+# values), where each block has its own frequency table, so tables adapt over windows of symbols.
+# Raw deflate (negative window bits) has no header or checksum.
+_ZLIB_LEVEL = 1
+_ZLIB_WBITS = -15
+_ZLIB_MEM_LEVEL = 9
+
+
+def _n_planes(bit: int) -> int:
+    # values are coded as byte planes (low byte first), so each symbol is a byte of one value
+    return (bit + 7) // 8
+
+
+def huffman_encode_outerdim(comm_tensor: torch.Tensor, numel: int, bit: int) -> torch.Tensor:
+    """
+    Entropy-code each item in comm_tensor [b,nbytes], a dense bitstream of `numel` values.
+
+    Items are coded separately and padded with zeros to the longest item's length.
+    """
+    n_items = comm_tensor.shape[0]
+    n_planes = _n_planes(bit)
+    if bit == 8:
+        symbols = comm_tensor
+    else:
+        # symbols aligned with values have meaningful statistics, unlike bytes of the bitstream
+        vals = torch.empty((n_items, numel), dtype=torch.int64)
+        _bitstream_decode_outerdim(comm_tensor, bit, vals)
+        symbols = torch.empty((n_items, n_planes, numel), dtype=torch.uint8)
+        for plane in range(n_planes):
+            symbols[:, plane].copy_(vals & 0xFF)
+            vals >>= 8
+    datas = []
+    for item in symbols.numpy():
+        compressor = zlib.compressobj(_ZLIB_LEVEL, zlib.DEFLATED, _ZLIB_WBITS, _ZLIB_MEM_LEVEL,
+                                      zlib.Z_HUFFMAN_ONLY)
+        datas.append(compressor.compress(item) + compressor.flush())
+    data = np.zeros((n_items, max((len(d) for d in datas), default=0)), dtype=np.uint8)
+    for item, item_data in zip(data, datas):
+        item[:len(item_data)] = np.frombuffer(item_data, dtype=np.uint8)
+    return torch.from_numpy(data)
+
+
+def huffman_decode_outerdim(data: torch.Tensor, bit: int, out: torch.Tensor) -> None:
+    """Decode `huffman_encode_outerdim` data [b,length] to int values in out [b,numel]."""
+    n_items, numel = out.shape
+    n_planes = _n_planes(bit)
+    symbols = np.empty((n_items, n_planes * numel), dtype=np.uint8)
+    for item, item_data in zip(symbols, data.numpy()):
+        decompressor = zlib.decompressobj(_ZLIB_WBITS)
+        # stops at the end of the deflate stream, ignoring the zero padding
+        item[:] = np.frombuffer(decompressor.decompress(item_data.tobytes()), dtype=np.uint8)
+    symbols = torch.from_numpy(symbols).view(n_items, n_planes, numel)
+    if n_planes == 1:
+        out.copy_(symbols[:, 0])
+        return
+    # combine planes as ints, which out (e.g., float32) may not represent exactly until the end
+    vals = symbols[:, n_planes - 1].long()
+    for plane in range(n_planes - 2, -1, -1):
+        vals <<= 8
+        vals |= symbols[:, plane]
+    out.copy_(vals)
@@ -35,7 +35,7 @@ def mem_bytes(yml_model: dict, layer_l: int, layer_r: int, dtype: str, ubatch_si
     dat_bytes_out = ubatch_bytes(yml_model['parameters_out'][layer_r], ubatch_size, dtype=dtype)
     # Communication and processing memory buffer overheads: send/recv/queue/processing buffers
     # Temporary processing buffers not accounted for - that's a function of the model impl
-    # data_buffers_{in,out}: 1 for in-flight data exchanges, 1 for queues (p2p comm only)
+    # data_buffers_{in,out}: 1 for in-flight data exchanges, plus the queue depth (p2p comm only)
     mem_bytes_buffers = 0
     # Receive buffer (and maybe queue)
     if layer_l > 0:
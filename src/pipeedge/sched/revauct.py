@@ -16,13 +16,16 @@ DeviceBidData: Type = Tuple[Mapping[Tuple[int, int], float], Mapping[str, dict]]
 """A device's bids: (1) shard layer pairs mapped to their costs, (2) communication properties."""
 
 def bid_latency(yml_model: dict, yml_dev_type: dict, yml_dtm_profile: dict, ubatch_size: int,
-                dtype: str='torch.float32') -> List[ShardBid]:
+                dtype: str='torch.float32', data_buffers_in: int=2, data_buffers_out: int=2) -> \
+    List[ShardBid]:
     """Bid for shards using latency as the cost metric."""
     bids = []
     dt_mem_bytes = yml_dev_type['mem_MB'] * 1024 * 1024
     for layer_l in range(yml_model['layers']):
         for layer_r in range(layer_l, yml_model['layers']):
-            bytes_req = mem_bytes(yml_model, layer_l, layer_r, dtype, ubatch_size)
+            bytes_req = mem_bytes(yml_model, layer_l, layer_r, dtype, ubatch_size,
+                                  data_buffers_in=data_buffers_in,
+                                  data_buffers_out=data_buffers_out)
             if dt_mem_bytes > bytes_req:
                 cost = computation_time(yml_dtm_profile, layer_l, layer_r)
                 bids.append(((layer_l, layer_r), cost))
@@ -64,19 +64,27 @@ def yaml_device_type(mem_MB: Union[int, float], bw_Mbps: Union[int, float],
         'model_profiles': model_profiles,
     }
 
-def yaml_device_neighbors_type(bw_Mbps: Union[int, float]) -> dict:
+def yaml_device_neighbors_type(bw_Mbps: Union[int, float],
+                               latency_ms: Optional[Union[int, float]]=None) -> dict:
     """Create a YAML device neighbors type."""
     assert isinstance(bw_Mbps, (int, float))
-    return {
+    yml = {
         'bw_Mbps': bw_Mbps,
-        # Currently only one field, but could be extended, e.g., to include latency_{ms,us}.
     }
+    # latency is optional, since it's not required by schedulers
+    if latency_ms is not None:
+        assert isinstance(latency_ms, (int, float))
+        yml['latency_ms'] = latency_ms
+    return yml
 
-def yaml_device_neighbors(neighbors: List[str], bws_Mbps: Union[List[int], List[float]]) -> dict:
+def yaml_device_neighbors(neighbors: List[str], bws_Mbps: Union[List[int], List[float]],
+                          latencies_ms: Optional[Union[List[int], List[float]]]=None) -> dict:
     """Create a YAML device neighbors."""
     _assert_list_type(neighbors, str)
     _assert_list_type(bws_Mbps, (int, float))
+    if latencies_ms is None:
+        latencies_ms = [None] * len(neighbors)
     return {
-        neighbor: yaml_device_neighbors_type(bw_Mbps)
-            for neighbor, bw_Mbps in zip(neighbors, bws_Mbps)
+        neighbor: yaml_device_neighbors_type(bw_Mbps, latency_ms=latency_ms)
+            for neighbor, bw_Mbps, latency_ms in zip(neighbors, bws_Mbps, latencies_ms)
     }
@@ -0,0 +1,45 @@
+# pylint: disable=missing-function-docstring
+"""Test comm.p2p.util object codec."""
+import unittest
+import torch
+from pipeedge.comm.p2p.util import object_to_tensor, tensor_to_object
+
+
+def _round_trip(obj):
+    tensor, size = object_to_tensor(obj, None)
+    return tensor, tensor_to_object(tensor, int(size))
+
+
+class TestObjectCodec(unittest.TestCase):
+    """Test object_to_tensor and tensor_to_object."""
+
+    def test_scalars(self):
+        for obj in (None, True, False, 0, -1, 2**63 - 1, 1.5, float('inf'), '', 'foo', b'bar'):
+            _, obj_dec = _round_trip(obj)
+            self.assertEqual(type(obj_dec), type(obj))
+            self.assertEqual(obj_dec, obj)
+
+    def test_containers(self):
+        obj = (1, [2.0, 'three', (None, [])], ())
+        _, obj_dec = _round_trip(obj)
+        self.assertEqual(obj_dec, obj)
+
+    def test_tensors(self):
+        tensors = [torch.ones((2, 3), dtype=torch.float32), torch.tensor(5, dtype=torch.int8),
+                   torch.zeros(0), torch.rand(3, 4).t(), torch.ones(3, dtype=torch.bfloat16),
+                   torch.tensor([True, False])]
+        _, obj_dec = _round_trip((1, tensors))
+        self.assertEqual(obj_dec[0], 1)
+        for tensor, tensor_dec in zip(tensors, obj_dec[1]):
+            self.assertEqual(tensor.dtype, tensor_dec.dtype)
+            self.assertTrue(torch.equal(tensor, tensor_dec))
+
+    def test_tensor_zero_copy(self):
+        tensor, tensor_dec = _round_trip(torch.arange(10))
+        self.assertGreaterEqual(tensor_dec.data_ptr(), tensor.data_ptr())
+        self.assertLess(tensor_dec.data_ptr(), tensor.data_ptr() + tensor.numel())
+
+    def test_pickle_fallback(self):
+        for obj in ({ 'a': 1 }, [1, { 2 }], 2**64):
+            _, obj_dec = _round_trip(obj)
+            self.assertEqual(obj_dec, obj)
@@ -0,0 +1,64 @@
+# pylint: disable=missing-function-docstring
+"""Test comm.p2p.codec."""
+import unittest
+import torch
+from pipeedge.comm.p2p import _pack_segments, _pack_tensors, _unpack_tensors, codec
+
+
+class TestCompress(unittest.TestCase):
+    """Test compress and decompress."""
+
+    def _check_round_trip(self, codec_name, tensors):
+        records = [(t.dtype, list(t.shape)) for t in tensors]
+        segments = _pack_segments(records)
+        buf = _pack_tensors(tensors)
+        data = codec.compress(codec_name, buf, segments)
+        self.assertEqual(data.dtype, torch.uint8)
+        buf_out = torch.empty_like(buf)
+        codec.decompress(codec_name, data, buf_out, segments)
+        for tensor, tensor_out in zip(tensors, _unpack_tensors(buf_out, records)):
+            self.assertTrue(torch.equal(tensor, tensor_out))
+        return data
+
+    def test_zlib(self):
+        self._check_round_trip(codec.CODEC_ZLIB, (torch.rand(8, 16), torch.arange(10)))
+
+    def test_shuffle_zlib(self):
+        self._check_round_trip(codec.CODEC_SHUFFLE_ZLIB,
+                               (torch.rand(8, 16), torch.arange(10), torch.tensor(1.0),
+                                torch.zeros(0), torch.ones(3, dtype=torch.int8)))
+
+    def test_compressible(self):
+        tensors = (torch.zeros(1000),)
+        data = self._check_round_trip(codec.CODEC_SHUFFLE_ZLIB, tensors)
+        self.assertLess(len(data), 4000)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            codec.compress('foo', torch.zeros(16, dtype=torch.uint8), [])
+
+
+class TestCodecController(unittest.TestCase):
+    """Test CodecController."""
+
+    def test_initial(self):
+        self.assertTrue(codec.CodecController().enabled())
+
+    def test_ratio(self):
+        ctlr = codec.CodecController(ratio_max=0.9, probe_interval=4)
+        ctlr.observe_compress(100, 99, 0)
+        self.assertFalse(ctlr.pays_off())
+        # probes periodically
+        self.assertEqual([ctlr.enabled() for _ in range(4)], [False, False, False, True])
+
+    def test_cost(self):
+        ctlr = codec.CodecController()
+        ctlr.observe_compress(100, 50, 1)
+        # saving 50 bytes of sending is slower than compressing
+        ctlr.observe_send(50, 2)
+        self.assertTrue(ctlr.pays_off())
+        ctlr = codec.CodecController()
+        ctlr.observe_compress(100, 50, 1)
+        # saving 50 bytes of sending is faster than compressing
+        ctlr.observe_send(50, 0.01)
+        self.assertFalse(ctlr.pays_off())
@@ -3,7 +3,7 @@
 import os
 import unittest
 import torch
-from pipeedge.comm.p2p import DistP2pContext
+from pipeedge.comm.p2p import DistP2pContext, PROTOCOL_FRAMED, PROTOCOL_PACKED
 
 MASTER_ADDR = 'localhost'
 MASTER_PORT = '29501'
@@ -38,3 +38,24 @@ class TestDistP2pContext(unittest.TestCase):
         # pylint: disable=no-self-use
         with DistP2pContext(INIT_ARGS, INIT_KWARGS, _cmd_cb):
             pass
+
+    def test_context_framed(self):
+        # pylint: disable=no-self-use
+        with DistP2pContext(INIT_ARGS, INIT_KWARGS, _cmd_cb, protocol=PROTOCOL_FRAMED) as ctx:
+            ctx.cmd_broadcast(0, (torch.zeros(1),))
+
+    def test_context_packed(self):
+        # pylint: disable=no-self-use
+        with DistP2pContext(INIT_ARGS, INIT_KWARGS, _cmd_cb, protocol=PROTOCOL_PACKED) as ctx:
+            ctx.cmd_broadcast(0, (torch.zeros(1),))
+
+    def test_gather(self):
+        with DistP2pContext(INIT_ARGS, INIT_KWARGS, _cmd_cb) as ctx:
+            tensor = torch.ones(2)
+            results = ctx.cmd_gather((tensor,))
+            self.assertEqual(len(results), 1)
+            self.assertTrue(torch.equal(results[0][0], tensor))
+
+    def test_protocol_invalid(self):
+        with self.assertRaises(ValueError):
+            DistP2pContext(INIT_ARGS, INIT_KWARGS, _cmd_cb, protocol='foo')
@@ -0,0 +1,98 @@
+# pylint: disable=missing-function-docstring
+"""Test comm.p2p.TensorSendThread and comm.p2p.TensorRecvThread between two processes."""
+import os
+import unittest
+import torch
+from torch import multiprocessing as mp
+from pipeedge.comm.p2p import ConditionQueue, DistP2pContext, TensorRecvThread, \
+    TensorSendThread, PROTOCOL_FRAMED, PROTOCOL_PACKED, PROTOCOL_TENSORS, codec
+
+MASTER_ADDR = 'localhost'
+MASTER_PORT = '29502'
+
+BACKEND = 'gloo'
+INIT_ARGS = (BACKEND,)
+
+
+def _cmd_cb(_cmd, _tensors):
+    pass
+
+
+def _payloads():
+    payloads = [
+        # a single tensor (not a tuple)
+        torch.arange(10),
+        # mixed dtypes and shapes, including a scalar and an empty tensor
+        (torch.ones(2, 3), torch.tensor(5, dtype=torch.int8), torch.empty(0),
+         torch.zeros(4, dtype=torch.bfloat16)),
+        # enough dimensions to overflow the fixed-length frame header into an extension
+        tuple(torch.full((1, 2, 3, 4, 5), i, dtype=torch.float64) for i in range(10)),
+        # a non-tensor object in a tuple
+        (torch.ones(3), { 'key': [1, 2] }),
+    ]
+    # more payloads than shared memory ring slots, so slots are released and reused
+    return payloads * 3
+
+
+def _assert_payload_equal(payload, expected):
+    if isinstance(expected, tuple):
+        assert isinstance(payload, tuple) and len(payload) == len(expected)
+        for obj, obj_expected in zip(payload, expected):
+            _assert_payload_equal(obj, obj_expected)
+    elif isinstance(expected, torch.Tensor):
+        assert isinstance(payload, torch.Tensor)
+        assert payload.dtype == expected.dtype and torch.equal(payload, expected)
+    else:
+        assert payload == expected
+
+
+def _exchange(rank, protocol, use_shm, codec_name):
+    os.environ['MASTER_ADDR'] = MASTER_ADDR
+    os.environ['MASTER_PORT'] = MASTER_PORT
+    payloads = _payloads()
+    with DistP2pContext(INIT_ARGS, { 'world_size': 2, 'rank': rank }, _cmd_cb,
+                        protocol=protocol):
+        queue = ConditionQueue(maxsize=0)
+        if rank == 0:
+            thread = TensorSendThread(queue, 1, protocol=protocol, use_shm=use_shm,
+                                      codec_name=codec_name)
+            for payload in payloads:
+                queue.put(payload)
+            thread.start()
+            # stop (which sends the stop sentinel) once all payloads are dequeued
+            with queue.condition:
+                while not queue.empty():
+                    queue.condition.wait()
+            thread.stop()
+        else:
+            thread = TensorRecvThread(queue, 0, protocol=protocol)
+            thread.start()
+        # the receiver stops when it receives the stop sentinel
+        thread.join()
+        if rank == 1:
+            for expected in payloads:
+                _assert_payload_equal(queue.get(block=False), expected)
+            assert queue.empty()
+
+
+class TestTensorExchange(unittest.TestCase):
+    """Test sending and receiving payloads with each wire protocol."""
+
+    def _test_exchange(self, protocol, use_shm=False, codec_name=codec.CODEC_NONE):
+        # raises if either process fails
+        mp.spawn(_exchange, args=(protocol, use_shm, codec_name), nprocs=2)
+
+    def test_tensors(self):
+        self._test_exchange(PROTOCOL_TENSORS)
+
+    def test_framed(self):
+        self._test_exchange(PROTOCOL_FRAMED)
+
+    def test_packed(self):
+        self._test_exchange(PROTOCOL_PACKED)
+
+    def test_packed_shm(self):
+        self._test_exchange(PROTOCOL_PACKED, use_shm=True)
+
+    def test_packed_link_codec(self):
+        self._test_exchange(PROTOCOL_PACKED, codec_name={ 1: codec.CODEC_SHUFFLE_ZLIB })
@@ -0,0 +1,42 @@
+# pylint: disable=missing-function-docstring
+"""Test comm.p2p tensor packing."""
+import unittest
+import torch
+from pipeedge.comm.p2p import PACK_ALIGN, TORCH_TYPES, _pack_tensors, _unpack_tensors
+
+
+class TestPackTensors(unittest.TestCase):
+    """Test _pack_tensors and _unpack_tensors."""
+
+    def _check_round_trip(self, tensors):
+        buf = _pack_tensors(tensors)
+        self.assertEqual(buf.dtype, torch.uint8)
+        self.assertEqual(len(buf) % PACK_ALIGN, 0)
+        unpacked = _unpack_tensors(buf, [(t.dtype, list(t.shape)) for t in tensors])
+        self.assertEqual(len(unpacked), len(tensors))
+        for tensor, tensor_unpacked in zip(tensors, unpacked):
+            self.assertEqual(tensor.dtype, tensor_unpacked.dtype)
+            self.assertEqual(tensor.shape, tensor_unpacked.shape)
+            self.assertTrue(torch.equal(tensor, tensor_unpacked))
+
+    def test_dtypes(self):
+        tensors = tuple(torch.ones((2, 3), dtype=dtype) for dtype in TORCH_TYPES)
+        self._check_round_trip(tensors)
+
+    def test_shapes(self):
+        tensors = (torch.rand(8, 197, 768), torch.tensor(1.0), torch.zeros(0),
+                   torch.arange(5, dtype=torch.int8))
+        self._check_round_trip(tensors)
+
+    def test_noncontiguous(self):
+        self._check_round_trip((torch.rand(4, 5).t(),))
+
+    def test_buffer_reuse(self):
+        buf = _pack_tensors((torch.rand(100),))
+        buf_small = _pack_tensors((torch.rand(10),), buf=buf)
+        self.assertEqual(buf_small.data_ptr(), buf.data_ptr())
+
+    def test_zero_copy(self):
+        buf = _pack_tensors((torch.rand(10),))
+        tensor, = _unpack_tensors(buf, [(torch.float32, [10])])
+        self.assertEqual(tensor.data_ptr(), buf.data_ptr())
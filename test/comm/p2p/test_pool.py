@@ -0,0 +1,52 @@
+# pylint: disable=missing-function-docstring
+"""Test comm.p2p.util.TensorPool."""
+import unittest
+import torch
+from pipeedge.comm.p2p.util import TensorPool, shares_memory
+
+
+class TestTensorPool(unittest.TestCase):
+    """Test TensorPool."""
+
+    def test_reuse(self):
+        pool = TensorPool(2)
+        buf = pool.acquire((2, 3), torch.float32)
+        pool.release(buf)
+        self.assertIs(pool.acquire((2, 3), torch.float32), buf)
+        pool.release(buf)
+        # different key
+        self.assertIsNot(pool.acquire((3, 2), torch.float32), buf)
+        self.assertIsNot(pool.acquire((2, 3), torch.int32), buf)
+
+    def test_max_size(self):
+        pool = TensorPool(1)
+        buf1 = pool.acquire((4,), torch.uint8)
+        buf2 = pool.acquire((4,), torch.uint8)
+        pool.release(buf1)
+        pool.release(buf2)
+        self.assertIs(pool.acquire((4,), torch.uint8), buf1)
+        self.assertIsNot(pool.acquire((4,), torch.uint8), buf2)
+
+    def test_reclaim(self):
+        pool = TensorPool(2)
+        buf = pool.acquire((4,), torch.float32)
+        payload = (buf,)
+        pool.lend(payload, (buf,))
+        pool.reclaim(payload, (torch.ones(4),))
+        self.assertIs(pool.acquire((4,), torch.float32), buf)
+
+    def test_reclaim_shared(self):
+        pool = TensorPool(2)
+        buf = pool.acquire((4,), torch.float32)
+        payload = (buf,)
+        pool.lend(payload, (buf,))
+        pool.reclaim(payload, (torch.ones(4), buf[2:]))
+        self.assertIsNot(pool.acquire((4,), torch.float32), buf)
+
+    def test_shares_memory(self):
+        buf = torch.zeros(8, dtype=torch.uint8)
+        self.assertTrue(shares_memory(buf, buf[7:]))
+        self.assertTrue(shares_memory(buf, (None, [buf.view(torch.int32)])))
+        self.assertFalse(shares_memory(buf[:4], buf[4:]))
+        self.assertFalse(shares_memory(buf, torch.zeros(8, dtype=torch.uint8)))
+        self.assertFalse(shares_memory(buf, 'foo'))
@@ -0,0 +1,39 @@
+# pylint: disable=missing-function-docstring
+"""Test comm.p2p.probe."""
+import itertools
+import unittest
+from pipeedge.comm.p2p import probe
+
+
+class TestPairings(unittest.TestCase):
+    """Test round_robin_pairings and sample_pairings."""
+
+    def _check_rounds(self, world_size):
+        rounds = probe.round_robin_pairings(world_size)
+        pairs = []
+        for pairs_round in rounds:
+            ranks = [rank for pair in pairs_round for rank in pair]
+            # no rank is in more than one pair per round
+            self.assertEqual(len(ranks), len(set(ranks)))
+            pairs += pairs_round
+        self.assertEqual(sorted(pairs), list(itertools.combinations(range(world_size), 2)))
+
+    def test_round_robin_pairings(self):
+        for world_size in range(1, 12):
+            self._check_rounds(world_size)
+
+    def test_round_robin_pairings_rounds(self):
+        self.assertEqual(len(probe.round_robin_pairings(8)), 7)
+        self.assertEqual(len(probe.round_robin_pairings(7)), 7)
+
+    def test_sample_pairings(self):
+        rounds = probe.round_robin_pairings(10)
+        self.assertEqual(probe.sample_pairings(rounds, 1), rounds)
+        sampled = probe.sample_pairings(rounds, 0.5, seed=1)
+        self.assertEqual(sampled, probe.sample_pairings(rounds, 0.5, seed=1))
+        for pairs in sampled:
+            self.assertGreater(len(pairs), 0)
+
+    def test_sample_pairings_invalid(self):
+        with self.assertRaises(ValueError):
+            probe.sample_pairings([], 0)
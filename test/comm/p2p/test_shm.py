@@ -0,0 +1,60 @@
+# pylint: disable=missing-function-docstring
+"""Test comm.p2p.shm."""
+import os
+import unittest
+import torch
+from pipeedge.comm.p2p import shm
+
+
+class TestShmRing(unittest.TestCase):
+    """Test ShmRing."""
+
+    def setUp(self):
+        self.ring = shm.ShmRing.create(2, 64)
+        # notifications that the reader freed a slot
+        self.releases = 0
+        self.stopped = False
+
+    def _wait_release(self):
+        if self.stopped or self.releases == 0:
+            return False
+        self.releases -= 1
+        return True
+
+    def tearDown(self):
+        self.ring.unlink()
+
+    def test_open(self):
+        ring = shm.ShmRing.open(self.ring.path)
+        self.assertIsNotNone(ring)
+        self.assertEqual(ring.slots, 2)
+        self.assertEqual(ring.slot_bytes, 64)
+
+    def test_open_invalid(self):
+        self.assertIsNone(shm.ShmRing.open(os.path.join(shm.SHM_DIR, shm.SHM_PREFIX + 'foo')))
+        self.assertIsNone(shm.ShmRing.open(__file__))
+
+    def test_write_read(self):
+        reader = shm.ShmRing.open(self.ring.path)
+        for i in range(5):
+            slot = self.ring.wait_write(8, self._wait_release)
+            slot.copy_(torch.arange(i, i + 8, dtype=torch.uint8))
+            self.ring.commit_write()
+            buf = torch.empty(8, dtype=torch.uint8)
+            reader.read_into(buf)
+            self.releases += 1
+            self.assertTrue(torch.equal(buf, torch.arange(i, i + 8, dtype=torch.uint8)))
+
+    def test_full(self):
+        for _ in range(2):
+            self.assertIsNotNone(self.ring.wait_write(8, self._wait_release))
+            self.ring.commit_write()
+        self.stopped = True
+        self.assertIsNone(self.ring.wait_write(8, self._wait_release))
+        self.stopped = False
+        reader = shm.ShmRing.open(self.ring.path)
+        reader.read_into(torch.empty(8, dtype=torch.uint8))
+        self.releases += 1
+        self.assertIsNotNone(self.ring.wait_write(8, self._wait_release))
+        # the notification was consumed
+        self.assertEqual(self.releases, 0)
@@ -0,0 +1,77 @@
+# pylint: disable=missing-function-docstring
+"""Test comm.p2p.DistP2pPipelineStage."""
+import unittest
+from pipeedge.comm.p2p import DistP2pPipelineStage, PROTOCOL_FRAMED, PROTOCOL_TENSORS, \
+    QUEUE_NAMES, _link_codecs, _replica_peer, codec
+
+
+class TestDistP2pPipelineStage(unittest.TestCase):
+    """Test DistP2pPipelineStage."""
+
+    def test_queue_depths(self):
+        queue_depths = { name: i + 1 for i, name in enumerate(QUEUE_NAMES) }
+        stage = DistP2pPipelineStage(None, None, None, None, queue_depths=queue_depths)
+        self.assertEqual(stage.queue_occupancy(), { name: 0 for name in QUEUE_NAMES })
+
+    def test_queue_depths_invalid(self):
+        with self.assertRaises(ValueError):
+            DistP2pPipelineStage(None, None, None, None, queue_depths={ 'foo': 1 })
+        with self.assertRaises(ValueError):
+            DistP2pPipelineStage(None, None, None, None, queue_depths={ 'in': 0 })
+
+    def test_send_window_invalid(self):
+        with self.assertRaises(ValueError):
+            DistP2pPipelineStage(None, None, None, None, send_window=0)
+
+    def test_work_threads_invalid(self):
+        with self.assertRaises(ValueError):
+            DistP2pPipelineStage(None, None, None, None, work_threads=0)
+        with self.assertRaises(ValueError):
+            DistP2pPipelineStage(None, None, None, None, work_num_threads=0)
+
+    def test_replica_invalid(self):
+        with self.assertRaises(ValueError):
+            DistP2pPipelineStage(None, None, None, None, replica=(2, 2))
+
+    def test_replica_peers(self):
+        # senders and receivers must agree on where each microbatch goes
+        for n_src in range(1, 5):
+            for n_dst in range(1, 5):
+                srcs = list(range(n_src))
+                dsts = list(range(n_src, n_src + n_dst))
+                sent = { dst: [] for dst in dsts }
+                for ubatch in range(24):
+                    src = ubatch % n_src
+                    dst = _replica_peer(dsts, (src, n_src), ubatch // n_src)
+                    self.assertEqual(dst, dsts[ubatch % n_dst])
+                    sent[dst].append(src)
+                for idx, dst in enumerate(dsts):
+                    recvd = [_replica_peer(srcs, (idx, n_dst), seq)
+                             for seq in range(len(sent[dst]))]
+                    self.assertEqual(recvd, sent[dst])
+
+    def test_shm_invalid(self):
+        with self.assertRaises(ValueError):
+            DistP2pPipelineStage(None, None, None, None, protocol=PROTOCOL_TENSORS, use_shm=True)
+
+    def test_codec_invalid(self):
+        with self.assertRaises(ValueError):
+            DistP2pPipelineStage(None, None, None, None, codec_name='foo')
+        with self.assertRaises(ValueError):
+            DistP2pPipelineStage(None, None, None, None, protocol=PROTOCOL_FRAMED,
+                                 codec_name=codec.CODEC_ZLIB)
+        with self.assertRaises(ValueError):
+            DistP2pPipelineStage(None, None, None, None, codec_name={ 1: 'foo' })
+        with self.assertRaises(ValueError):
+            DistP2pPipelineStage(None, None, None, None, protocol=PROTOCOL_FRAMED,
+                                 codec_name={ 1: codec.CODEC_ZLIB })
+
+    def test_link_codecs(self):
+        self.assertEqual(_link_codecs(codec.CODEC_ZLIB, [1, 2]),
+                         { 1: codec.CODEC_ZLIB, 2: codec.CODEC_ZLIB })
+        self.assertEqual(_link_codecs({ 2: codec.CODEC_ZLIB, 3: codec.CODEC_SHUFFLE_ZLIB }, [1, 2]),
+                         { 1: codec.CODEC_NONE, 2: codec.CODEC_ZLIB })
+
+    def test_epoch_invalid(self):
+        with self.assertRaises(ValueError):
+            DistP2pPipelineStage(None, None, None, None, epoch=-1)
@@ -0,0 +1,36 @@
+# pylint: disable=missing-function-docstring
+"""Test comm.p2p.TensorWorkThread."""
+import random
+import time
+import unittest
+from pipeedge.comm.p2p import ConditionQueue, TensorWorkThread, WorkSequencer
+
+
+def _work_cb(payload):
+    time.sleep(random.random() / 100)
+    return payload
+
+
+class TestTensorWorkThread(unittest.TestCase):
+    """Test TensorWorkThread."""
+
+    def test_sequencer(self):
+        count = 32
+        queue_in = ConditionQueue(maxsize=2)
+        queue_out = ConditionQueue(maxsize=count)
+        sequencer = WorkSequencer()
+        threads = [TensorWorkThread(queue_in, queue_out, _work_cb, sequencer=sequencer)
+                   for _ in range(4)]
+        for thr in threads:
+            thr.start()
+        for i in range(count):
+            with queue_in.condition:
+                while queue_in.full():
+                    queue_in.condition.wait()
+                queue_in.put(i)
+                queue_in.condition.notify_all()
+        for thr in threads:
+            thr.stop()
+        for thr in threads:
+            thr.join()
+        self.assertEqual([queue_out.get(block=False) for _ in range(count)], list(range(count)))
@@ -28,3 +28,7 @@ class TestDistRpcContext(unittest.TestCase):
         # pylint: disable=no-self-use
         with DistRpcContext(INIT_ARGS, INIT_KWARGS):
             pass
+
+    def test_gather(self):
+        with DistRpcContext(INIT_ARGS, INIT_KWARGS) as ctx:
+            self.assertEqual(ctx.cmd_gather(os.getpid), [os.getpid()])
@@ -0,0 +1,88 @@
+# pylint: disable=missing-function-docstring
+"""Test comm.rpc.DistRpcPipeline."""
+import os
+import queue
+import unittest
+import torch
+from torch import nn
+from torch.distributed import rpc
+from pipeedge.comm.rpc import DistRpcContext, DistRpcPipeline, DistRpcPipelineStage
+
+MASTER_ADDR = 'localhost'
+MASTER_PORT = '29501'
+
+INIT_ARGS = ('worker0',)
+INIT_KWARGS = { 'world_size': 1, 'rank': 0 }
+
+_results = queue.Queue()
+
+
+def _results_cb(outputs):
+    _results.put(outputs)
+
+
+class _FailOnThree(nn.Module):
+    def forward(self, inputs):
+        if int(inputs) == 3:
+            raise ValueError("Failed on 3")
+        return inputs
+
+
+class TestDistRpcPipeline(unittest.TestCase):
+    """Test DistRpcPipeline."""
+
+    @classmethod
+    def setUpClass(cls):
+        os.environ['MASTER_ADDR'] = MASTER_ADDR
+        os.environ['MASTER_PORT'] = MASTER_PORT
+
+    def test_pipeline(self):
+        with DistRpcContext(INIT_ARGS, INIT_KWARGS):
+            stage_rrefs = [rpc.remote(0, DistRpcPipelineStage, args=(nn.Identity,))
+                           for _ in range(2)]
+            pipeline = DistRpcPipeline(stage_rrefs, 0, _results_cb)
+            # more microbatches than the stages have credits for
+            for i in range(10):
+                pipeline.enqueue_tensor(torch.tensor(i))
+            for i in range(10):
+                self.assertEqual(int(_results.get(timeout=10)), i)
+
+    def test_pipeline_concurrency(self):
+        with DistRpcContext(INIT_ARGS, INIT_KWARGS):
+            stage_rrefs = [rpc.remote(0, DistRpcPipelineStage, args=(nn.Identity,),
+                                      kwargs={ 'num_mod': 2, 'module_replicas': 2 })]
+            pipeline = DistRpcPipeline(stage_rrefs, 0, _results_cb)
+            for i in range(10):
+                pipeline.enqueue_tensor(torch.tensor(i))
+            for i in range(10):
+                self.assertEqual(int(_results.get(timeout=10)), i)
+
+    def test_pipeline_failure(self):
+        with DistRpcContext(INIT_ARGS, INIT_KWARGS):
+            stage_rrefs = [rpc.remote(0, DistRpcPipelineStage, args=(nn.Identity,)),
+                           rpc.remote(0, DistRpcPipelineStage, args=(_FailOnThree,))]
+            pipeline = DistRpcPipeline(stage_rrefs, 0, _results_cb)
+            for i in range(10):
+                pipeline.enqueue_tensor(torch.tensor(i))
+            # the failed microbatch is skipped rather than holding back later results
+            for i in [0, 1, 2, 4, 5, 6, 7, 8, 9]:
+                self.assertEqual(int(_results.get(timeout=10)), i)
+
+    def test_stage_invalid(self):
+        for kwargs in ({ 'num_fwd': 0 }, { 'num_mod': 0 }, { 'module_replicas': 0 },
+                       { 'num_threads': 0 }):
+            with self.assertRaises(ValueError):
+                DistRpcPipelineStage(nn.Identity, **kwargs)
+
+    def test_stage_hook_handles(self):
+        stage = DistRpcPipelineStage(nn.Identity, module_replicas=2)
+        calls = []
+        handles = stage.mod_register_forward_hook(lambda *_: calls.append(None))
+        pre_handles = stage.mod_register_forward_pre_hook(lambda *_: calls.append(None))
+        self.assertEqual(len(handles), 2)
+        self.assertEqual(len(pre_handles), 2)
+        for handle in handles + pre_handles:
+            handle.remove()
+        for module in stage._modules: # pylint: disable=protected-access
+            module(torch.zeros(1))
+        self.assertEqual(calls, [])
@@ -0,0 +1,60 @@
+# pylint: disable=missing-function-docstring
+"""Test comm.rpc.DistRpcResultsReorderBuffer."""
+import threading
+import unittest
+from pipeedge.comm.rpc import DistRpcResultsReorderBuffer
+
+
+class TestDistRpcResultsReorderBuffer(unittest.TestCase):
+    """Test DistRpcResultsReorderBuffer."""
+
+    def test_in_order(self):
+        results = []
+        rob = DistRpcResultsReorderBuffer(results.append)
+        for seq in range(3):
+            rob(seq, seq)
+        self.assertEqual(results, [0, 1, 2])
+
+    def test_out_of_order(self):
+        results = []
+        rob = DistRpcResultsReorderBuffer(results.append)
+        rob(2, 'c')
+        rob(1, 'b')
+        self.assertEqual(results, [])
+        rob(0, 'a')
+        self.assertEqual(results, ['a', 'b', 'c'])
+        rob(3, 'd')
+        self.assertEqual(results, ['a', 'b', 'c', 'd'])
+
+    def test_threads(self):
+        results = []
+        rob = DistRpcResultsReorderBuffer(results.append)
+        thrs = [threading.Thread(target=rob, args=(seq, seq)) for seq in reversed(range(100))]
+        for thr in thrs:
+            thr.start()
+        for thr in thrs:
+            thr.join()
+        self.assertEqual(results, list(range(100)))
+
+    def test_skip(self):
+        results = []
+        rob = DistRpcResultsReorderBuffer(results.append)
+        rob(2, 'c')
+        rob.skip(1)
+        rob(0, 'a')
+        self.assertEqual(results, ['a', 'c'])
+        # a failure reported after the results were delivered is ignored
+        rob.skip(0)
+        rob(3, 'd')
+        self.assertEqual(results, ['a', 'c', 'd'])
+
+    def test_callback_unlocked(self):
+        results = []
+        def _results_cb(outputs):
+            results.append(outputs)
+            if outputs == 0:
+                # would deadlock if called with the buffer's lock held
+                rob(1, 1)
+        rob = DistRpcResultsReorderBuffer(_results_cb)
+        rob(0, 0)
+        self.assertEqual(results, [0, 1])
@@ -0,0 +1,38 @@
+# pylint: disable=missing-function-docstring
+"""Test comm tree_parent and tree_children."""
+import unittest
+from pipeedge.comm import tree_children, tree_parent
+
+
+class TestTree(unittest.TestCase):
+    """Test tree_parent and tree_children."""
+
+    def _check_tree(self, root, world_size):
+        ranks = set()
+        depth_max = 0
+        stack = [(root, 0)]
+        while stack:
+            rank, depth = stack.pop()
+            ranks.add(rank)
+            depth_max = max(depth_max, depth)
+            for child in tree_children(rank, root, world_size):
+                self.assertEqual(tree_parent(child, root, world_size), rank)
+                stack.append((child, depth + 1))
+        self.assertEqual(ranks, set(range(world_size)))
+        self.assertLessEqual(depth_max, (world_size - 1).bit_length())
+
+    def test_trees(self):
+        for world_size in (1, 2, 3, 5, 8, 13, 100):
+            for root in range(world_size):
+                self._check_tree(root, world_size)
+
+    def test_root(self):
+        self.assertIsNone(tree_parent(3, 3, 8))
+        self.assertEqual(tree_children(0, 0, 8), [4, 2, 1])
+        self.assertEqual(tree_children(0, 0, 1), [])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            tree_children(0, 8, 8)
+        with self.assertRaises(ValueError):
+            tree_parent(8, 0, 8)
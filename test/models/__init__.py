@@ -0,0 +1 @@
+"""Test models module."""
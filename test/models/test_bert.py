@@ -0,0 +1,77 @@
+# pylint: disable=missing-function-docstring
+"""Test models.transformers.bert."""
+import unittest
+import torch
+from transformers import BertConfig, BertModel
+from pipeedge.models import ModuleShardConfig
+from pipeedge.models.transformers.bert import BertModelShard
+
+# 3 transformer blocks, each split 4 ways
+LAYERS = 12
+
+
+class _RecordedWeights(dict):
+    """Weights that record which keys are loaded."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loaded = set()
+
+    def __getitem__(self, key):
+        self.loaded.add(key)
+        return super().__getitem__(key)
+
+
+class TestBertModelShardReuse(unittest.TestCase):
+    """Test reusing the layers of a previous BertModelShard."""
+
+    def setUp(self):
+        self.config = BertConfig(vocab_size=32, hidden_size=8, num_hidden_layers=LAYERS // 4,
+                                 num_attention_heads=2, intermediate_size=16,
+                                 max_position_embeddings=16)
+        model = BertModel(self.config)
+        self.weights = _RecordedWeights((key, val.numpy())
+                                        for key, val in model.state_dict().items())
+        # may be a non-persistent buffer, so not in the state dict
+        self.weights['embeddings.position_ids'] = model.embeddings.position_ids.numpy()
+
+    def _shard(self, layer_start, layer_end, shard_reuse=None):
+        shard_config = ModuleShardConfig(layer_start=layer_start, layer_end=layer_end,
+                                         is_first=layer_start == 1, is_last=layer_end == LAYERS)
+        shard = BertModelShard(self.config, shard_config, self.weights, shard_reuse=shard_reuse)
+        shard.eval()
+        return shard
+
+    def test_overlapping_layers(self):
+        shard_prev = self._shard(1, 6)
+        self.weights.loaded.clear()
+        # layers 3-6 are block 0's sublayers 2-3 and block 1's sublayers 0-1
+        shard = self._shard(3, LAYERS, shard_reuse=shard_prev)
+        self.assertIs(shard.layers[0].intermediate, shard_prev.layers[0].intermediate)
+        self.assertIs(shard.layers[0].output, shard_prev.layers[0].output)
+        self.assertIs(shard.layers[1].self_attention, shard_prev.layers[1].self_attention)
+        self.assertIs(shard.layers[1].self_output, shard_prev.layers[1].self_output)
+        loaded = self.weights.loaded
+        self.assertFalse(any(key.startswith('encoder.layer.0.') for key in loaded))
+        self.assertFalse(any(key.startswith('encoder.layer.1.attention.') for key in loaded))
+        self.assertIn('encoder.layer.1.intermediate.dense.weight', loaded)
+        self.assertIn('encoder.layer.2.attention.self.query.weight', loaded)
+        self.assertIn('pooler.dense.weight', loaded)
+        # the same results as a shard that loads all its layers
+        data = torch.randn(2, 5, self.config.hidden_size)
+        self.assertTrue(torch.allclose(shard(data), self._shard(3, LAYERS)(data)))
+
+    def test_first_layers(self):
+        shard_prev = self._shard(1, 5)
+        self.weights.loaded.clear()
+        shard = self._shard(1, 8, shard_reuse=shard_prev)
+        self.assertIs(shard.embeddings, shard_prev.embeddings)
+        self.assertIs(shard.layers[0].self_attention, shard_prev.layers[0].self_attention)
+        self.assertIs(shard.layers[1].self_attention, shard_prev.layers[1].self_attention)
+        self.assertEqual(self.weights.loaded,
+                         { f'encoder.layer.1.{key}' for key in [
+                             'attention.output.dense.weight', 'attention.output.dense.bias',
+                             'attention.output.LayerNorm.weight', 'attention.output.LayerNorm.bias',
+                             'intermediate.dense.weight', 'intermediate.dense.bias',
+                             'output.dense.weight', 'output.dense.bias',
+                             'output.LayerNorm.weight', 'output.LayerNorm.bias'] })
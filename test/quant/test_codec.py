@@ -0,0 +1,87 @@
+# pylint: disable=missing-function-docstring
+"""Test quantization.codec."""
+import unittest
+import torch
+from pipeedge.quantization import codec
+
+
+class TestCodec(unittest.TestCase):
+    """Test codec registry encode and decode."""
+
+    def test_names(self):
+        self.assertEqual(codec.get_codec_id('fp16'), codec.CODEC_ID_FP16)
+        self.assertEqual(codec.get_codec_id('bf16'), codec.CODEC_ID_BF16)
+        self.assertEqual(codec.get_codec_id('int8'), 8)
+        self.assertEqual(codec.get_codec_id('8'), 8)
+        self.assertEqual(codec.get_codec_id('0'), codec.CODEC_ID_FP32)
+        for codec_id in codec.get_codec_ids():
+            self.assertEqual(codec.get_codec_id(codec.get_codec_name(codec_id)), codec_id)
+        with self.assertRaises(ValueError):
+            codec.get_codec_id('fp8')
+        with self.assertRaises(ValueError):
+            codec.get_codec_id('33.5')
+
+    def test_fp32(self):
+        tensor = torch.randn(4, 3, 5)
+        encodings = codec.encode_outerdim(tensor, codec.CODEC_ID_FP32)
+        self.assertEqual(len(encodings), 5)
+        self.assertTrue(torch.equal(codec.decode_outerdim(encodings), tensor))
+
+    def test_cast(self):
+        tensor = torch.randn(4, 3, 5)
+        for codec_id, dtype in [(codec.CODEC_ID_FP16, torch.float16),
+                                (codec.CODEC_ID_BF16, torch.bfloat16)]:
+            encodings = codec.encode_outerdim(tensor, codec_id)
+            self.assertEqual(len(encodings), 5)
+            self.assertEqual(encodings[0].dtype, dtype)
+            self.assertTrue(torch.all(encodings[4] == codec_id))
+            decoded = codec.decode_outerdim(encodings)
+            self.assertEqual(decoded.dtype, torch.float32)
+            self.assertTrue(torch.equal(decoded, tensor.to(dtype).to(torch.float32)))
+
+    def test_int(self):
+        tensor = torch.randn(4, 3, 5)
+        encodings = codec.encode_outerdim(tensor, 8)
+        self.assertEqual(encodings[0].dtype, torch.uint8)
+        self.assertTrue(torch.allclose(codec.decode_outerdim(encodings), tensor, atol=0.1))
+
+    def test_mixed(self):
+        tensor = torch.randn(2, 3, 5)
+        enc_fp16 = codec.encode_outerdim(tensor[:1], codec.CODEC_ID_FP16)
+        enc_fp32 = codec.encode_outerdim(tensor[1:], codec.CODEC_ID_FP32)
+        # only the metadata differs in dtype, so the payloads can be stacked as float32
+        encodings = [torch.cat((t16.to(t32.dtype), t32)) for t16, t32 in zip(enc_fp16, enc_fp32)]
+        decoded = codec.decode_outerdim(encodings)
+        self.assertTrue(torch.equal(decoded[1], tensor[1]))
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            codec.encode_outerdim(torch.randn(2, 3), 100)
+
+    def test_huffman(self):
+        tensor = torch.randn(4, 3, 5)
+        for bit in [2, 4, 8, 12]:
+            codec_id = codec.get_huffman_codec_id(bit)
+            self.assertTrue(codec.is_huffman_codec(codec_id))
+            self.assertEqual(codec.get_codec_id(f'int{bit}-huffman'), codec_id)
+            self.assertEqual(codec.get_codec_bits(codec_id), bit)
+            encodings = codec.encode_outerdim(tensor, codec_id)
+            # small tensors may not compress, in which case they're sent with the plain int codec
+            self.assertTrue(torch.all((encodings[4] == codec_id) | (encodings[4] == bit)))
+            # entropy coding is lossless
+            decoded = codec.decode_outerdim(encodings)
+            self.assertTrue(torch.equal(decoded,
+                                        codec.decode_outerdim(codec.encode_outerdim(tensor, bit))))
+        # only integer codecs have Huffman-coded variants
+        self.assertEqual(codec.get_huffman_codec_id(codec.CODEC_ID_FP16), codec.CODEC_ID_FP16)
+
+    def test_huffman_compresses(self):
+        # few distinct values code to fewer bits than the bitwidth
+        tensor = torch.zeros(2, 1024)
+        tensor[:, ::64] = 1
+        for bit in [4, 8, 12]:
+            codec_id = codec.get_huffman_codec_id(bit)
+            encodings = codec.encode_outerdim(tensor, codec_id)
+            self.assertTrue(torch.all(encodings[4] == codec_id))
+            self.assertLess(encodings[0].shape[1], 1024 * bit / 8)
+            self.assertTrue(torch.equal(codec.decode_outerdim(encodings), tensor))
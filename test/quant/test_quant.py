@@ -1,21 +1,30 @@
 # pylint: disable
 """ Test quantization mosule """
+import math
 import unittest
-import numpy as np
+from scipy.special import lambertw
 import torch
-from pipeedge.quantization.basic_op import _quant_op, _intmap_encode, _intmap_decode, _intmap2float
+from pipeedge.quantization.basic_op import (
+    _bitstream_decode_outerdim, _bitstream_encode_outerdim, bitstream_nbytes, tensor_decode,
+    tensor_decode_outerdim, tensor_encode, tensor_encode_outerdim
+)
+from pipeedge.quantization.clamp_op import (
+    _clamp_factor_gelu, _clamp_factor_laplace, clamp_banner2019_gelu, clamp_banner2019_laplace,
+    tensor_encode_outerdim_banner2019
+)
 
 def quant_func(input_shape, quant_bit):
     assert quant_bit >= 0
     assert quant_bit <= 32
     b,h,w = input_shape
     input_tensor = torch.rand(b,h,w, dtype=torch.float32) #8,768,3072
-    input_array = input_tensor.numpy()
-    output, int_map = _quant_op(input_array, quant_bit)
-    comm_tensor = _intmap_encode(int_map, quant_bit)
-    restore_int_map = _intmap_decode(comm_tensor, input_array.shape, quant_bit)
-    restore_tensor = _intmap2float(restore_int_map, quant_bit)
-    return np.all((restore_tensor-output) < 1e-6)
+    # quantize to int values in [0, 2^quant_bit - 1], then pack and unpack them
+    int_map = input_tensor.double().mul_((1 << quant_bit) - 1).round_().reshape(b, -1)
+    comm_tensor = torch.empty((b, bitstream_nbytes(h * w, quant_bit)), dtype=torch.uint8)
+    _bitstream_encode_outerdim(int_map, quant_bit, comm_tensor)
+    restore_int_map = torch.empty((b, h * w), dtype=torch.int64)
+    _bitstream_decode_outerdim(comm_tensor, quant_bit, restore_int_map)
+    return torch.equal(restore_int_map, int_map.long())
 
 class TestQuantCorrect(unittest.TestCase):
     """test quant operations' correctness"""
@@ -28,3 +37,130 @@ class TestQuantCorrect(unittest.TestCase):
         for shape in self.input_shapes:
             for bit in self.test_bit_list:
                 self.assertTrue(quant_func(shape, bit))
+
+
+class TestQuantOuterdim(unittest.TestCase):
+    """test vectorized microbatch encode/decode"""
+
+    def test_wire_size(self):
+        for bit in [2, 3, 5, 6, 7, 8, 13, 16, 32]:
+            for numel in [1, 7, 64, 70]:
+                encodings = tensor_encode_outerdim(torch.randn(4, numel), bit)
+                self.assertEqual(encodings[0].shape, (4, math.ceil(numel * bit / 8)))
+                self.assertEqual(encodings[0].dtype, torch.uint8)
+
+    def test_roundtrip(self):
+        for bit in [2, 3, 5, 6, 7, 8, 13, 16, 32]:
+            tensor = torch.randn(4, 10, 7)
+            decoded = tensor_decode_outerdim(tensor_encode_outerdim(tensor, bit))
+            self.assertEqual(decoded.shape, tensor.shape)
+            # error is at most half a quantization step
+            step = (tensor.amax(dim=(1, 2)) - tensor.amin(dim=(1, 2))) / ((1 << bit) - 1)
+            err = (decoded - tensor).abs().amax(dim=(1, 2))
+            self.assertTrue(torch.all(err <= step / 2 + 1e-5))
+
+    def test_unquantized(self):
+        tensor = torch.randn(4, 10, 7)
+        self.assertTrue(torch.equal(tensor_decode_outerdim(tensor_encode_outerdim(tensor, 0)),
+                                    tensor))
+
+    def test_per_item(self):
+        tensor = torch.randn(4, 10, 7)
+        encodings = tensor_encode_outerdim(tensor, 6)
+        for item, item_encodings in zip(tensor, zip(*encodings)):
+            for enc, item_enc in zip(tensor_encode(item, 6), item_encodings):
+                self.assertTrue(torch.equal(enc, item_enc))
+        decoded = tensor_decode_outerdim(encodings)
+        for item_decoded, item_encodings in zip(decoded, zip(*encodings)):
+            self.assertTrue(torch.equal(tensor_decode(item_encodings), item_decoded))
+
+    def test_large_bitwidth(self):
+        """test 32-bit values, which torch's int32 can't hold unsigned"""
+        tensor = torch.randn(2, 9)
+        decoded = tensor_decode_outerdim(tensor_encode_outerdim(tensor, 32))
+        self.assertTrue(torch.allclose(decoded, tensor))
+
+    def test_constant_item(self):
+        tensor = torch.randn(3, 5)
+        tensor[1] = 2.5
+        decoded = tensor_decode_outerdim(tensor_encode_outerdim(tensor, 8))
+        self.assertFalse(torch.any(torch.isnan(decoded)))
+        self.assertTrue(torch.equal(decoded[1], tensor[1]))
+
+    def test_group_scales(self):
+        tensor = torch.randn(4, 6, 10)
+        # an outlier channel
+        tensor[:, :, 3] *= 100
+        decoded_tensor = tensor_decode_outerdim(tensor_encode_outerdim(tensor, 4))
+        for group_size in [1, 3, 4, 10]:
+            encodings = tensor_encode_outerdim(tensor, 4, group_size=group_size)
+            n_groups = math.ceil(10 / group_size)
+            self.assertEqual(encodings[2].shape, (4, n_groups))
+            self.assertEqual(encodings[3].shape, (4, n_groups))
+            decoded = tensor_decode_outerdim(encodings)
+            self.assertEqual(decoded.shape, tensor.shape)
+            # channels outside the outlier's group are more accurate than with per-tensor scales
+            size = math.ceil(10 / n_groups)
+            others = [c for c in range(10) if c // size != 3 // size]
+            if len(others) > 0:
+                err = (decoded[:, :, others] - tensor[:, :, others]).abs().max()
+                err_tensor = (decoded_tensor[:, :, others] - tensor[:, :, others]).abs().max()
+                self.assertLess(err, err_tensor)
+
+    def test_group_scales_per_item(self):
+        tensor = torch.randn(3, 5, 7)
+        encodings = tensor_encode_outerdim(tensor, 6, group_size=2)
+        decoded = tensor_decode_outerdim(encodings)
+        for item, item_decoded in zip(tensor, decoded):
+            item_encodings = tensor_encode(item, 6, group_size=2)
+            self.assertTrue(torch.equal(tensor_decode(item_encodings), item_decoded))
+
+    def test_group_size_invalid(self):
+        with self.assertRaises(ValueError):
+            tensor_encode_outerdim(torch.randn(2, 4), 8, group_size=-1)
+
+    def test_out(self):
+        """test encoding and decoding into preallocated buffers"""
+        tensor = torch.randn(4, 10, 7)
+        comm_buf = torch.empty((4, bitstream_nbytes(70, 5)), dtype=torch.uint8)
+        encodings = tensor_encode_outerdim(tensor, 5, out=comm_buf)
+        self.assertIs(encodings[0], comm_buf)
+        self.assertTrue(torch.equal(comm_buf, tensor_encode_outerdim(tensor, 5)[0]))
+        decoded_buf = torch.empty_like(tensor)
+        decoded = tensor_decode_outerdim(encodings, out=decoded_buf)
+        self.assertIs(decoded, decoded_buf)
+        self.assertTrue(torch.equal(decoded, tensor_decode_outerdim(encodings)))
+        with self.assertRaises(ValueError):
+            tensor_encode_outerdim(tensor, 6, out=comm_buf)
+        with self.assertRaises(ValueError):
+            tensor_decode_outerdim(encodings, out=torch.empty(4, 70))
+
+
+class TestClamp(unittest.TestCase):
+    """test clamping"""
+
+    def test_clamp_factors(self):
+        for bit in [1, 2, 8, 16, 31, 32]:
+            self.assertAlmostEqual(_clamp_factor_laplace(bit).item(),
+                                   lambertw(3 * 4.0**bit).real)
+            self.assertAlmostEqual(_clamp_factor_gelu(bit).item(),
+                                   lambertw(3 * 4.0**(bit + 1)).real)
+
+    def test_encode_banner2019(self):
+        for bit in [2, 4, 8]:
+            # the laplace clamp, then the gelu clamp (min >= 0.2)
+            for tensor in [torch.randn(4, 10, 7), torch.rand(4, 10, 7) + 0.2]:
+                clamp = clamp_banner2019_laplace if tensor.min() < 0.2 else clamp_banner2019_gelu
+                clamped = clamp(tensor, bit)
+                expected = tensor_decode_outerdim(tensor_encode_outerdim(clamped, bit))
+                decoded = tensor_decode_outerdim(tensor_encode_outerdim_banner2019(tensor, bit))
+                step = (clamped.max() - clamped.min()) / ((1 << bit) - 1)
+                self.assertTrue(torch.allclose(decoded, expected, atol=step.item() * 1.01))
+
+    def test_encode_banner2019_large_mean(self):
+        # the variance is small relative to the mean, which is prone to cancellation
+        tensor = torch.randn(4, 64, 64) - 1e4
+        decoded = tensor_decode_outerdim(tensor_encode_outerdim_banner2019(tensor, 8))
+        expected = clamp_banner2019_laplace(tensor, 8)
+        self.assertTrue(torch.all(expected != 0))
+        self.assertTrue(torch.allclose(decoded, expected, rtol=1e-4))
@@ -1,7 +1,8 @@
 # pylint: disable=C0116
 """Test yaml_types module."""
 import unittest
-from pipeedge.sched.yaml_types import yaml_device_type, yaml_model, yaml_model_profile
+from pipeedge.sched.yaml_types import yaml_device_neighbors, yaml_device_type, yaml_model, \
+    yaml_model_profile
 
 class TestYamlModel(unittest.TestCase):
     """Test yaml_model."""
@@ -43,3 +44,15 @@ class TestYamlDeviceType(unittest.TestCase):
         self.assertEqual(device_type['mem_MB'], 1)
         self.assertEqual(device_type['bw_Mbps'], 2)
         self.assertEqual(device_type['model_profiles'], {})
+
+
+class TestYamlDeviceNeighbors(unittest.TestCase):
+    """Test yaml_device_neighbors."""
+
+    def test_yaml_device_neighbors(self):
+        neighbors = yaml_device_neighbors(['foo', 'bar'], [1, 2.0])
+        self.assertEqual(neighbors, { 'foo': { 'bw_Mbps': 1 }, 'bar': { 'bw_Mbps': 2.0 } })
+
+    def test_yaml_device_neighbors_latency(self):
+        neighbors = yaml_device_neighbors(['foo'], [1], latencies_ms=[0.5])
+        self.assertEqual(neighbors, { 'foo': { 'bw_Mbps': 1, 'latency_ms': 0.5 } })
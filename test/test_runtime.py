@@ -0,0 +1,68 @@
+# pylint: disable=missing-function-docstring
+"""Test runtime.py hooks."""
+import unittest
+from unittest import mock
+import torch
+from pipeedge.comm.p2p import ConditionQueue, TensorWorkThread, WorkSequencer
+from pipeedge.quantization import codec as quant_codec
+from pipeedge.quantization.basic_op import bitstream_nbytes
+import runtime
+
+
+class _Identity(torch.nn.Module):
+    def forward(self, tensor):
+        return tensor
+
+
+class TestP2pMonitorHooks(unittest.TestCase):
+    """Test the p2p monitoring hooks."""
+
+    def test_post_hook_bf16(self):
+        # numpy has no bfloat16 type
+        tensor = torch.randn(4, 10, 7)
+        payload = tuple(quant_codec.encode_outerdim(tensor, quant_codec.CODEC_ID_BF16))
+        self.assertEqual(payload[0].dtype, torch.bfloat16)
+        mbits = sum(t.numel() * t.element_size() for t in payload) * 8 / 1000000
+        with mock.patch.object(runtime.monitoring, 'iteration') as iteration:
+            runtime.p2p_post_hook_monitor(payload, runtime.MONITORING_KEY_SEND)
+        iteration.assert_called_once_with(runtime.MONITORING_KEY_SEND, work=mbits, accuracy=mbits)
+
+
+class TestQuantHooks(unittest.TestCase):
+    """Test the quantization hooks."""
+
+    def test_encode_work_threads(self):
+        module = _Identity()
+        module.register_buffer('quant_bit', torch.tensor(4), persistent=False)
+        module.register_buffer('quant_group_size', torch.tensor(0), persistent=False)
+        module.register_buffer('quant_entropy', torch.tensor(True), persistent=False)
+        module.register_buffer('quant_entropy_ratio', torch.tensor(1.0), persistent=False)
+        module.register_forward_hook(runtime.forward_hook_quant_encode)
+        tensor = torch.randn(8, 64, 64)
+        codec_id = quant_codec.get_huffman_codec_id(4)
+        nbytes_coded = quant_codec.encode_outerdim(tensor, codec_id, clamp=True)[0].numel()
+        ratio = nbytes_coded / (8 * bitstream_nbytes(64 * 64, 4))
+        count = 32
+        queue_in = ConditionQueue(maxsize=2)
+        queue_out = ConditionQueue(maxsize=count)
+        sequencer = WorkSequencer()
+        threads = [TensorWorkThread(queue_in, queue_out, module, sequencer=sequencer)
+                   for _ in range(4)]
+        for thr in threads:
+            thr.start()
+        for _ in range(count):
+            with queue_in.condition:
+                while queue_in.full():
+                    queue_in.condition.wait()
+                queue_in.put(tensor)
+                queue_in.condition.notify_all()
+        for thr in threads:
+            thr.stop()
+        for thr in threads:
+            thr.join()
+        self.assertEqual(queue_out.qsize(), count)
+        # identical payloads have the same ratio, so the smoothed ratio doesn't depend on their
+        # order, but it does on every update
+        alpha = runtime.QUANT_ENTROPY_RATIO_ALPHA
+        expected = ratio + (1 - alpha)**count * (1 - ratio)
+        self.assertAlmostEqual(module.quant_entropy_ratio.item(), expected, places=5)
@@ -7,7 +7,7 @@ from .controller import AdaptiveIntegralXupController
 
 
 def constrain_max_bitwidth(t_max: torch.Tensor, d_size: torch.Tensor, d_speed: torch.Tensor,
-                           bw_max: torch.Tensor) -> torch.Tensor:
+                           bw_max: torch.Tensor, ratio: float=1.0) -> torch.Tensor:
     """
     Compute the maximum bitwidth to satisfy a data movement time constraint.
 
@@ -21,6 +21,9 @@ def constrain_max_bitwidth(t_max: torch.Tensor, d_size: torch.Tensor, d_speed: t
         The data movement speed.
     bw_max : torch.Tensor (scalar)
         The maximum bitwidth (usually the source data bitwidth).
+    ratio : float, optional
+        The compressed size relative to the packed size for bitwidths < `bw_max` (e.g., from
+        entropy coding after quantization).
 
     Returns
     -------
@@ -28,9 +31,11 @@ def constrain_max_bitwidth(t_max: torch.Tensor, d_size: torch.Tensor, d_speed: t
         The largest bitwidth that satisfies the time constraint, or 0 if not satisfiable.
     """
     bitwidths = torch.arange(bw_max, -1, -1, dtype=torch.int)
-    # Perfect packing would be: scales = bitwidths / bw_max
-    # Discretize scaling since we don't pack partial values (special handling for bitwidth=0)
-    scales = compression_factor(bitwidths[:-1]).to(dtype=torch.int).reciprocal()
+    # Quantized values are densely packed, so scales = bitwidths / bw_max
+    # (special handling for bitwidth=0)
+    scales = compression_factor(bitwidths[:-1]).reciprocal()
+    # ratio > 1 (compression not helping) would make lower bitwidths look slower than bw_max
+    scales[1:] *= min(ratio, 1.0)
     scales = torch.hstack((scales, torch.tensor(0)))
     # d_size = 0 -> scale = inf
     scale = torch.div(d_speed * t_max, d_size)
@@ -65,12 +70,27 @@ class AdaptiveBitwidthPerformanceController(AdaptiveIntegralXupController):
         self._bitwidths = list(bitwidths) # copy, then sort in reverse
         self._bitwidths.sort(reverse=True)
         self._speedups = [self._bitwidths[0] / b for b in self._bitwidths]
+        self._compression_ratio = 1.0
         # Use the parent controller class to compute speedup over max bitwidth baseline.
         u_0 = self._bitwidths[0] / bitwidth_start
         # We could use a performance measurement to estimate `x_hat_0` for the underlying Kalman
         # filter, but there's no real benefit - the filter converges on the first iteration anyway.
         super().__init__(perf_constraint, u_0, u_max=self._speedups[-1])
 
+    @property
+    def compression_ratio(self) -> float:
+        """The compressed size relative to the packed size for bitwidths < the max bitwidth."""
+        return self._compression_ratio
+
+    @compression_ratio.setter
+    def compression_ratio(self, ratio: float) -> None:
+        # e.g., from entropy coding after quantization (the max bitwidth isn't quantized)
+        # ratio > 1 (compression not helping) would break the monotonically increasing speedups
+        ratio = min(ratio, 1.0)
+        self._compression_ratio = ratio
+        self._speedups = [1.0] + [self._bitwidths[0] / (b * ratio) for b in self._bitwidths[1:]]
+        self._u_max = self._speedups[-1]
+
     def __call__(self, perf_measured: float, window_len: int) -> Tuple[int, int, int]:
         """
         Split a window period between two bitwidths to achieve ``perf_constraint``.